@@ -1,4 +1,5 @@
 import { NextRequest, NextResponse } from 'next/server'
+import { forwardedHeaders } from '@/lib/api-config'
 
 export async function POST(request: NextRequest) {
   try {
@@ -54,6 +55,7 @@ Be scientifically accurate. Return ONLY valid JSON.`
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
+        ...forwardedHeaders(request),
       },
       body: JSON.stringify({
         message: prompt,
@@ -1,4 +1,5 @@
 import { NextRequest, NextResponse } from 'next/server'
+import { forwardedHeaders } from '@/lib/api-config'
 
 export const dynamic = 'force-dynamic'
 
@@ -23,6 +24,7 @@ export async function POST(request: NextRequest) {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
+        ...forwardedHeaders(request),
       },
       body: JSON.stringify(config)
     })
@@ -99,6 +101,7 @@ Return ONLY valid JSON, no markdown or extra text.`
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
+        ...forwardedHeaders(request),
       },
       body: JSON.stringify({
         message: prompt,
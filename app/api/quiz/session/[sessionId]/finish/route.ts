@@ -1,4 +1,5 @@
 import { NextRequest, NextResponse } from 'next/server'
+import { forwardedHeaders } from '@/lib/api-config'
 
 interface UserAnswer {
   question_id: number
@@ -22,6 +23,7 @@ export async function POST(
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          ...forwardedHeaders(request),
         },
         body: JSON.stringify(answers)
       }
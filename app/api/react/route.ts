@@ -1,4 +1,5 @@
 import { NextRequest, NextResponse } from 'next/server'
+import { forwardedHeaders } from '@/lib/api-config'
 import { Experiment, ReactionResult } from '@/types/chemistry'
 
 export async function POST(request: NextRequest) {
@@ -24,6 +25,7 @@ export async function POST(request: NextRequest) {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
+        ...forwardedHeaders(request),
       },
       body: JSON.stringify({
         message: 'Analyze reaction',
@@ -1,4 +1,5 @@
 import { NextRequest, NextResponse } from 'next/server'
+import { forwardedHeaders } from '@/lib/api-config'
 
 // Validation Schema (Basic)
 function validateRequest(body: any) {
@@ -94,6 +95,7 @@ export async function POST(request: NextRequest) {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          ...forwardedHeaders(request),
           'X-Request-ID': crypto.randomUUID(),
           'X-Service-Name': 'spectroscopy-api',
         },
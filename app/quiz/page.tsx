@@ -279,14 +279,16 @@ export default function QuizPage() {
       if (response.ok) {
         const data = await response.json()
         if (data.suggestions) {
-          setUserAnswers(prev => {
-            const updated = [...prev]
-            const idx = updated.findIndex(a => a.question_id === newAnswer.question_id)
-            if (idx >= 0) {
-              updated[idx] = { ...updated[idx], suggestions: data.suggestions }
+          applySuggestions(newAnswer, data.suggestions)
+        } else if (data.suggestions_pending) {
+          // Free-text feedback is generated in the background; this request waits until it is ready
+          const pending = await fetch(`/api/quiz/session/${sessionId}/suggestions/${newAnswer.question_id}`)
+          if (pending.ok) {
+            const ready = await pending.json()
+            if (ready.suggestions) {
+              applySuggestions(newAnswer, ready.suggestions)
             }
-            return updated
-          })
+          }
         }
       }
     } catch (error) {
@@ -294,6 +296,18 @@ export default function QuizPage() {
     }
   }
 
+  const applySuggestions = (answer: UserAnswer, suggestions: string) => {
+    setUserAnswers(prev => {
+      const updated = [...prev]
+      const idx = updated.findIndex(a => a.question_id === answer.question_id)
+      // Skip if the student has since changed this answer
+      if (idx >= 0 && updated[idx].user_answer === answer.user_answer) {
+        updated[idx] = { ...updated[idx], suggestions }
+      }
+      return updated
+    })
+  }
+
   const handleNextQuestion = async () => {
     if (currentQuestionIndex < totalQuestions - 1) {
       const nextIndex = currentQuestionIndex + 1
@@ -0,0 +1,228 @@
+"""
+Admission control in front of upstream LLM calls
+Two checks run before a request starts any LLM work, so an overloaded or
+abusive caller gets a fast 429 with Retry-After instead of a slow timeout:
+
+- a global gate caps concurrent upstream calls; calls beyond the cap wait in
+  a queue of at most LLM_MAX_QUEUED. Requests are turned away once that
+  queue is full, and any other call finding it full (background summaries,
+  quiz prefetch, pool refills) fails at once with UpstreamBusy. Each
+  provider's own concurrency limit has a queue with the same bound
+- a token bucket per client IP limits how much work each one can start;
+  endpoints cost different amounts, e.g. quiz generation costs per question.
+  A request costing more than a full bucket is refused outright
+
+The client is the connecting address, or, when that address is a trusted
+proxy (the Next.js server routes run on the same host by default), the
+nearest untrusted address in its X-Forwarded-For chain. Request-body fields
+such as ``user_id`` are never used: the caller chooses them freely.
+
+    LLM_GLOBAL_CONCURRENCY=32      upstream calls in flight across all providers
+    LLM_MAX_QUEUED=64              calls allowed to wait for a slot
+    RATE_LIMIT_PER_MINUTE=60       cost units refilled per client per minute
+    RATE_LIMIT_BURST=30            bucket size; also the largest single request
+    TRUSTED_PROXIES=127.0.0.1,::1  peers whose X-Forwarded-For is believed
+    ADMISSION_COSTS=chat=1,quiz-question=1
+"""
+import asyncio
+import ipaddress
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from metrics import registry
+
+LLM_GLOBAL_CONCURRENCY = int(os.getenv("LLM_GLOBAL_CONCURRENCY", "32"))
+LLM_MAX_QUEUED = int(os.getenv("LLM_MAX_QUEUED", "64"))
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "60"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "30"))
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "50000"))
+# Peers (addresses or networks) allowed to report the client address in X-Forwarded-For
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(item.strip(), strict=False)
+    for item in os.getenv("TRUSTED_PROXIES", "127.0.0.1,::1").split(",")
+    if item.strip()
+]
+
+# Cost units per request (or per question/answer where noted)
+ENDPOINT_COSTS: Dict[str, float] = {
+    "chat": 1,
+    "analyze-reaction": 1,
+    "analyze-molecule": 1,
+    "generate-molecule": 2,
+    "quiz-question": 1,     # per requested question
+    "quiz-suggestions": 0.5,  # per wrong answer needing live suggestions
+    "conversation": 1,      # per created conversation, plus a unit per 10 seeded messages
+    **{
+        name.strip(): float(cost)
+        for name, _, cost in (item.partition("=") for item in os.getenv("ADMISSION_COSTS", "").split(","))
+        if name.strip() and cost.strip()
+    },
+}
+
+REJECTED = registry.counter("admission_rejected_total", "Requests refused before any LLM work", ("endpoint", "reason"))
+
+
+class RequestTooLarge(ValueError):
+    """The request costs more than a full rate-limit bucket, so it can never be admitted"""
+
+
+class UpstreamBusy(RuntimeError):
+    """Every upstream slot is taken and the wait queue is full"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Server is busy, please retry shortly")
+        self.retry_after = retry_after
+
+
+class ConcurrencyGate:
+    """Async semaphore with a bounded wait queue that tracks how long slots are held"""
+
+    def __init__(self, limit: int, max_queued: int):
+        self.limit = limit
+        self.max_queued = max_queued
+        self.running = 0
+        self.waiting = 0
+        self.hold_ewma = 1.0
+        self.rejected = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running server loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        return self._semaphore
+
+    @property
+    def saturated(self) -> bool:
+        return self.running >= self.limit and self.waiting >= self.max_queued
+
+    def retry_after(self) -> int:
+        """Rough seconds until the queue drains by one slot's worth"""
+        return max(1, math.ceil(self.hold_ewma * (self.waiting + 1) / self.limit))
+
+    async def __aenter__(self) -> "ConcurrencyGate":
+        semaphore = self._get_semaphore()
+        if semaphore.locked() and self.waiting >= self.max_queued:
+            self.rejected += 1
+            REJECTED.inc("upstream", "queue_full")
+            raise UpstreamBusy(self.retry_after())
+        self.waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.running -= 1
+        self._get_semaphore().release()
+
+    def observe_hold(self, seconds: float) -> None:
+        self.hold_ewma = 0.9 * self.hold_ewma + 0.1 * seconds
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "limit": self.limit,
+            "max_queued": self.max_queued,
+            "running": self.running,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "hold_ewma_seconds": round(self.hold_ewma, 3),
+        }
+
+
+class RateLimiter:
+    """Token bucket per client key, LRU-bounded"""
+
+    def __init__(self, per_minute: float, burst: float, max_clients: int):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()  # key -> (tokens, updated_at)
+
+    def try_acquire(self, key: str, cost: float) -> Tuple[bool, int]:
+        """Charge ``cost``; returns (allowed, retry_after_seconds)"""
+        if self.rate <= 0:
+            return True, 0
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return allowed, 0 if allowed else max(1, math.ceil((cost - tokens) / self.rate))
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+upstream_gate = ConcurrencyGate(LLM_GLOBAL_CONCURRENCY, LLM_MAX_QUEUED)
+rate_limiter = RateLimiter(RATE_LIMIT_PER_MINUTE, RATE_LIMIT_BURST, RATE_LIMIT_MAX_CLIENTS)
+
+registry.gauge("llm_gate_running", "Upstream LLM calls holding a global slot", lambda: upstream_gate.running)
+registry.gauge("llm_gate_waiting", "Upstream LLM calls waiting for a global slot", lambda: upstream_gate.waiting)
+registry.gauge("rate_limit_clients", "Clients with a tracked rate-limit bucket", lambda: len(rate_limiter))
+
+
+def _is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+
+def client_key(host: Optional[str], headers) -> str:
+    """Rate-limit key for the peer ``host``, looking through trusted proxies"""
+    client = host or "unknown"
+    forwarded = headers.get("x-forwarded-for")
+    if forwarded and _is_trusted_proxy(client):
+        # Walk back from the nearest hop; the first address not ours is the client.
+        # Entries left of it were written by the client and may be forged.
+        for hop in reversed([hop.strip() for hop in forwarded.split(",") if hop.strip()]):
+            client = hop
+            if not _is_trusted_proxy(hop):
+                break
+    return f"ip:{client}"
+
+
+def check(key: str, endpoint: str, units: float = 1) -> Optional[Tuple[str, int]]:
+    """None if admitted, else (reason, retry_after_seconds); charges the client's bucket.
+
+    Raises RequestTooLarge if ``units`` cost more than the bucket holds.
+    """
+    cost = ENDPOINT_COSTS.get(endpoint, 1) * units
+    if rate_limiter.rate > 0 and cost > rate_limiter.burst:
+        REJECTED.inc(endpoint, "too_large")
+        raise RequestTooLarge(f"Request costs {cost:g} units; at most {rate_limiter.burst:g} are allowed at once")
+    if upstream_gate.saturated:
+        REJECTED.inc(endpoint, "overloaded")
+        return "Server is busy, please retry shortly", upstream_gate.retry_after()
+    if cost <= 0:
+        return None
+    allowed, retry_after = rate_limiter.try_acquire(key, cost)
+    if not allowed:
+        REJECTED.inc(endpoint, "rate_limited")
+        return "Rate limit exceeded, please slow down", retry_after
+    return None
+
+
+def stats() -> Dict[str, object]:
+    return {
+        "upstream": upstream_gate.stats(),
+        "rate_limit": {
+            "per_minute": RATE_LIMIT_PER_MINUTE,
+            "burst": RATE_LIMIT_BURST,
+            "trusted_proxies": [str(network) for network in TRUSTED_PROXIES],
+            "tracked_clients": len(rate_limiter),
+        },
+        "costs": ENDPOINT_COSTS,
+    }
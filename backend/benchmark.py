@@ -0,0 +1,516 @@
+"""
+End-to-end load and latency benchmark with a simulated LLM
+Starts the API in-process with every LLM route served by a fake provider,
+drives the endpoints with concurrent simulated students, and reports
+throughput, p50/p95/p99 latency, time to first token and event-loop lag.
+Each run is saved to benchmark_results/ and compared with the previous one.
+
+    python benchmark.py --concurrency 50 --duration 20
+    python benchmark.py --scenarios chat,ws --latency lognormal:1.2,0.4 --token-rate 60
+    python benchmark.py --failure-rate 0.05 --cache-mode warm
+
+Latency distributions: fixed:S, uniform:MIN,MAX, normal:MEAN,SD, lognormal:MEDIAN,SIGMA
+(seconds until the first token; the rest of the output arrives at --token-rate).
+"""
+import argparse
+import asyncio
+import glob
+import json
+import math
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_results")
+SCENARIOS = ["chat", "ws", "analyze-reaction", "analyze-molecule", "generate-molecule", "quiz"]
+CHARS_PER_TOKEN = 4
+
+_WORDS = (
+    "acid base salt ion bond orbital electron proton neutron isotope catalyst enzyme polymer alkane alkene "
+    "alkyne ester ether ketone aldehyde amine amide benzene phenol oxidation reduction titration buffer "
+    "equilibrium enthalpy entropy gibbs kinetics rate order activation mechanism nucleophile electrophile "
+    "radical chirality isomer conformer resonance aromatic lattice crystal solvent solute molarity "
+    "pressure volume temperature gas liquid solid plasma spectrum absorbance emission quantum shell "
+    "valence halogen noble metal alloy corrosion electrode anode cathode cell potential hydrolysis"
+).split()
+_CHEMICALS = [
+    "HCl", "NaOH", "CuSO4", "AgNO3", "NaCl", "H2SO4", "KMnO4", "Zn", "Mg", "Fe", "CaCO3", "NH3",
+    "Na2CO3", "BaCl2", "Pb(NO3)2", "KI", "H2O2", "CH3COOH", "NaHCO3", "FeCl3",
+]
+_MOLECULES = ["water", "ethanol", "methane", "benzene", "caffeine", "glucose", "aspirin", "acetone"]
+
+
+# --- simulated LLM --------------------------------------------------------
+
+class LatencyDistribution:
+    def __init__(self, spec: str, rng: random.Random):
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",") if p]
+        self.rng = rng
+        if kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self) -> float:
+        p = self.params
+        if self.kind == "fixed":
+            return p[0]
+        if self.kind == "uniform":
+            return self.rng.uniform(p[0], p[1])
+        if self.kind == "normal":
+            return max(0.0, self.rng.gauss(p[0], p[1]))
+        return self.rng.lognormvariate(math.log(p[0]), p[1])
+
+
+def _sentence(rng: random.Random, words: int = 10) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words))
+
+
+def fake_response(prompt: str, config: Dict[str, Any], rng: random.Random) -> str:
+    """Plausible output for each prompt family, shaped like the real model's"""
+    if config.get("response_mime_type") != "application/json":
+        return " ".join(_sentence(rng, 12) + "." for _ in range(20))
+    if '"suggestions":[' in prompt:
+        ids = [int(i) for i in re.findall(r'"question_id": (\d+)', prompt)]
+        return json.dumps({"suggestions": [{"question_id": i, "suggestions": f"- {_sentence(rng)}"} for i in ids]})
+    if '"options"' in prompt:
+        options = [_sentence(rng, 3) for _ in range(4)]
+        return json.dumps({
+            "question": f"Which statement about {_sentence(rng, 8)}?",
+            "options": options,
+            "correct_answer": options[0],
+            "explanation": _sentence(rng, 25),
+            "option_feedback": {o: f"- {_sentence(rng)}" for o in options[1:]},
+        })
+    if '"question"' in prompt:
+        return json.dumps({
+            "question": f"Explain {_sentence(rng, 10)}.",
+            "correct_answer": _sentence(rng, 15),
+            "explanation": _sentence(rng, 25),
+        })
+    if '"productsInfo"' in prompt:
+        return json.dumps({
+            "balancedEquation": "A + B -> C + D",
+            "reactionType": "precipitation",
+            "visualObservation": _sentence(rng, 12),
+            "color": "blue",
+            "temperatureChange": "exothermic",
+            "productsInfo": [{"name": _sentence(rng, 1), "state": "aq", "color": "none"} for _ in range(2)],
+            "explanation": {"mechanism": _sentence(rng, 20), "keyConcept": _sentence(rng, 6)},
+            "safety": {"generalHazards": _sentence(rng, 10)},
+            "confidence": 0.9,
+        })
+    if '"atoms"' in prompt:
+        count = rng.randint(3, 24)
+        atoms = [{"id": f"a{i}", "element": rng.choice("CCCHHO"), "x": rng.uniform(-3, 3),
+                  "y": rng.uniform(-3, 3), "z": rng.uniform(-3, 3)} for i in range(count)]
+        bonds = [{"id": f"b{i}", "from": f"a{i}", "to": f"a{i + 1}", "type": "single"} for i in range(count - 1)]
+        return json.dumps({"name": f"Molecule {uuid.uuid4().hex[:8]}", "atoms": atoms, "bonds": bonds})
+    return json.dumps({"name": _sentence(rng, 2), "formula": "C2H6O", "description": _sentence(rng, 30)})
+
+
+def make_fake_provider(llm, latency: LatencyDistribution, token_rate: float, failure_rate: float,
+                       rng: random.Random):
+    class FakeLLMProvider(llm.LocalProvider):
+        """LocalProvider with sampled first-token latency, a token rate and injected failures"""
+
+        def __init__(self):
+            super().__init__(respond=lambda prompt, config: fake_response(prompt, config, rng),
+                             chunk_size=CHARS_PER_TOKEN * 4)
+            self.injected_failures = 0
+
+        def _maybe_fail(self) -> None:
+            if rng.random() < failure_rate:
+                self.injected_failures += 1
+                raise RuntimeError("injected upstream failure")
+
+        async def _generate(self, prompt: str, **config):
+            text = self.respond(prompt, config)
+            await asyncio.sleep(latency.sample() + len(text) / CHARS_PER_TOKEN / token_rate)
+            self._maybe_fail()
+            return text, self.estimate_usage(prompt, text)
+
+        async def _stream(self, prompt: str, **config):
+            text = self.respond(prompt, config)
+            await asyncio.sleep(latency.sample())
+            self._maybe_fail()
+            fail_at = rng.randrange(len(text)) if rng.random() < failure_rate else None
+            for i in range(0, len(text), self.chunk_size):
+                if i:
+                    await asyncio.sleep(self.chunk_size / CHARS_PER_TOKEN / token_rate)
+                if fail_at is not None and i >= fail_at:
+                    self.injected_failures += 1
+                    raise RuntimeError("injected failure mid-stream")
+                yield text[i:i + self.chunk_size]
+            yield self.estimate_usage(prompt, text)
+
+    return FakeLLMProvider()
+
+
+# --- server under test ----------------------------------------------------
+
+class LoopLagMonitor:
+    """Samples how late the server's event loop wakes up from a short sleep"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+
+    async def run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def reset(self) -> List[float]:
+        samples, self.samples = self.samples, []
+        return samples
+
+
+class ServerThread(threading.Thread):
+    def __init__(self, app, port: int):
+        super().__init__(daemon=True)
+        import uvicorn
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self.monitor = LoopLagMonitor()
+
+    def run(self) -> None:
+        asyncio.run(self._serve())
+
+    async def _serve(self) -> None:
+        monitor = asyncio.create_task(self.monitor.run())
+        try:
+            await self.server.serve()
+        finally:
+            monitor.cancel()
+
+    def wait_started(self, timeout: float = 30.0) -> None:
+        deadline = time.time() + timeout
+        while not self.server.started:
+            if time.time() > deadline or not self.is_alive():
+                raise RuntimeError("Server did not start")
+            time.sleep(0.05)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# --- scenarios --------------------------------------------------------------
+
+Sample = Tuple[float, Optional[float], bool]  # (latency, time to first token, ok)
+
+
+class Scenarios:
+    def __init__(self, client, ws_url: str, rng: random.Random, cold: bool):
+        self.client = client
+        self.ws_url = ws_url
+        self.rng = rng
+        self.cold = cold
+
+    async def _ndjson(self, path: str, body: Dict[str, Any], is_token: Callable[[dict], bool]) -> Sample:
+        started = time.perf_counter()
+        ttft = None
+        ok = True
+        async with self.client.stream("POST", path, json=body) as response:
+            ok = response.status_code == 200
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if event.get("error") or event.get("type") == "error":
+                    ok = False
+                elif ttft is None and is_token(event):
+                    ttft = time.perf_counter() - started
+        return time.perf_counter() - started, ttft, ok
+
+    async def chat(self) -> Sample:
+        return await self._ndjson("/chat", {"message": f"Explain {_sentence(self.rng, 6)}"}, lambda e: "token" in e)
+
+    async def ws(self, connection) -> Sample:
+        started = time.perf_counter()
+        ttft = None
+        ok = True
+        await connection.send(json.dumps({"message": f"Explain {_sentence(self.rng, 6)}"}))
+        while True:
+            for line in (await connection.recv()).splitlines():
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if event.get("done"):
+                    return time.perf_counter() - started, ttft, ok
+                if event.get("error"):
+                    ok = False
+                elif ttft is None and "token" in event:
+                    ttft = time.perf_counter() - started
+
+    async def _post(self, path: str, body: Dict[str, Any]) -> Sample:
+        started = time.perf_counter()
+        response = await self.client.post(path, json=body)
+        return time.perf_counter() - started, None, response.status_code == 200
+
+    async def analyze_reaction(self) -> Sample:
+        equipment = [f"beaker-{uuid.uuid4().hex[:8]}"] if self.cold else []
+        return await self._post("/analyze-reaction", {
+            "message": "", "chemicals": self.rng.sample(_CHEMICALS, 2), "equipment": equipment,
+        })
+
+    async def analyze_molecule(self) -> Sample:
+        # Random carbon skeleton with heteroatoms; cold runs make nearly every graph distinct
+        size = self.rng.randint(2, 30 if self.cold else 4)
+        atoms = [{"id": f"a{i}", "element": self.rng.choice("CCCNO"), "x": 0.0, "y": 0.0, "z": float(i)}
+                 for i in range(size)]
+        bonds = [{"id": f"b{i}", "from": f"a{i}", "to": f"a{i + 1}", "type": "single"} for i in range(size - 1)]
+        return await self._post("/analyze-molecule", {"atoms": atoms, "bonds": bonds})
+
+    async def generate_molecule(self) -> Sample:
+        query = f"compound {uuid.uuid4().hex[:10]}" if self.cold else self.rng.choice(_MOLECULES)
+        return await self._post("/generate-molecule", {"query": query})
+
+    async def quiz(self) -> Sample:
+        """Full lifecycle: generate, read every question, answer each, finish"""
+        started = time.perf_counter()
+        response = await self.client.post("/quiz/generate", json={
+            "difficulty": "medium", "num_questions": 5, "question_types": ["mcq", "explanation"],
+            "include_timer": False, "user_id": f"bench-{uuid.uuid4().hex[:8]}",
+        })
+        if response.status_code != 200:
+            return time.perf_counter() - started, None, False
+        quiz = response.json()
+        session_id = quiz["session_id"]
+        ttft = time.perf_counter() - started
+        answers = []
+        for index in range(quiz["total_questions"]):
+            question = (await self.client.get(f"/quiz/session/{session_id}/question/{index}")).json()["question"]
+            wrong = self.rng.random() < 0.5
+            answer = {
+                "question_id": question["id"],
+                "user_answer": (question.get("options") or ["?"])[-1] if wrong else question["correct_answer"],
+                "time_taken": self.rng.randint(5, 60),
+            }
+            submitted = await self.client.post(f"/quiz/session/{session_id}/submit-answer", json=answer)
+            if submitted.status_code != 200:
+                return time.perf_counter() - started, ttft, False
+            answers.append(answer)
+        finished = await self.client.post(f"/quiz/session/{session_id}/finish", json=answers)
+        return time.perf_counter() - started, ttft, finished.status_code == 200
+
+
+async def run_scenario(name: str, scenarios: Scenarios, concurrency: int, duration: float) -> List[Sample]:
+    samples: List[Sample] = []
+    deadline = time.perf_counter() + duration
+
+    async def worker() -> None:
+        connection = None
+        if name == "ws":
+            import websockets
+            connection = await websockets.connect(scenarios.ws_url, max_size=None)
+        try:
+            while time.perf_counter() < deadline:
+                try:
+                    if name == "ws":
+                        sample = await scenarios.ws(connection)
+                    else:
+                        sample = await getattr(scenarios, name.replace("-", "_"))()
+                except Exception as e:
+                    sample = (0.0, None, False)
+                    print(f"  ✗ {name}: {type(e).__name__}: {e}")
+                    if name == "ws":
+                        return
+                samples.append(sample)
+        finally:
+            if connection is not None:
+                await connection.close()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 4)
+
+
+def summarize(samples: List[Sample], lag: List[float], elapsed: float) -> Dict[str, Any]:
+    latencies = [latency for latency, _, ok in samples if ok]
+    ttfts = [ttft for _, ttft, ok in samples if ok and ttft is not None]
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for _, _, ok in samples if not ok),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_p50": percentile(latencies, 0.50),
+        "latency_p95": percentile(latencies, 0.95),
+        "latency_p99": percentile(latencies, 0.99),
+        "ttft_p50": percentile(ttfts, 0.50),
+        "ttft_p95": percentile(ttfts, 0.95),
+        "loop_lag_p50": percentile(lag, 0.50),
+        "loop_lag_p99": percentile(lag, 0.99),
+        "loop_lag_max": round(max(lag), 4) if lag else None,
+    }
+
+
+# --- results ----------------------------------------------------------------
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def save_results(results: Dict[str, Any], directory: str) -> str:
+    os.makedirs(directory, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime(results["meta"]["timestamp"]))
+    path = os.path.join(directory, f"{stamp}-{results['meta']['revision'] or 'unknown'}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    return path
+
+
+def previous_results(directory: str, exclude: str) -> Optional[Dict[str, Any]]:
+    paths = sorted(p for p in glob.glob(os.path.join(directory, "*.json")) if os.path.abspath(p) != os.path.abspath(exclude))
+    if not paths:
+        return None
+    with open(paths[-1], encoding="utf-8") as f:
+        return json.load(f)
+
+
+def print_report(results: Dict[str, Any], baseline: Optional[Dict[str, Any]]) -> None:
+    columns = ["requests", "errors", "throughput_rps", "latency_p50", "latency_p95", "latency_p99",
+               "ttft_p50", "loop_lag_p99"]
+    print(f"\n{'scenario':<18}" + "".join(f"{c:>15}" for c in columns))
+    for name, stats in results["scenarios"].items():
+        print(f"{name:<18}" + "".join(f"{'-' if stats[c] is None else stats[c]:>15}" for c in columns))
+    if not baseline:
+        return
+    print(f"\nChange vs {baseline['meta'].get('revision')} ({time.ctime(baseline['meta']['timestamp'])}):")
+    for name, stats in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        deltas = []
+        for key in ("throughput_rps", "latency_p95", "ttft_p50", "loop_lag_p99"):
+            if stats.get(key) is not None and before.get(key):
+                deltas.append(f"{key} {100 * (stats[key] - before[key]) / before[key]:+.1f}%")
+        print(f"  {name:<18} " + ", ".join(deltas))
+
+
+# --- entry point --------------------------------------------------------------
+
+def configure_environment(args) -> str:
+    """Isolate caches and keep background LLM work out of the measurements"""
+    workdir = tempfile.mkdtemp(prefix="elixra-bench-")
+    os.environ["RESULT_CACHE_DIR"] = workdir
+    os.environ["MOLECULE_LIBRARY_DB"] = os.path.join(workdir, "molecules.sqlite3")
+    os.environ["QUIZ_POOL_ENABLED"] = "1" if args.quiz_pool else "0"
+    os.environ["LLM_PROVIDERS"] = "local"
+    os.environ["LLM_ROUTE_DEFAULT"] = "local"
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    # Every simulated student shares one IP; the global upstream gate still applies
+    os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+    return workdir
+
+
+async def drive(args, port: int, server: ServerThread) -> Dict[str, Any]:
+    import httpx
+
+    rng = random.Random(args.seed + 1)
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    results: Dict[str, Any] = {}
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=args.timeout, limits=limits) as client:
+        scenarios = Scenarios(client, f"ws://127.0.0.1:{port}/ws", rng, cold=args.cache_mode == "cold")
+        for name in args.scenarios:
+            print(f"▶ {name}: {args.concurrency} concurrent clients for {args.duration:.0f}s")
+            server.monitor.reset()
+            started = time.perf_counter()
+            samples = await run_scenario(name, scenarios, args.concurrency, args.duration)
+            results[name] = summarize(samples, server.monitor.reset(), time.perf_counter() - started)
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", type=int, default=20, help="simulated students per scenario")
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds per scenario")
+    parser.add_argument("--latency", default="lognormal:0.8,0.35", help="time-to-first-token distribution")
+    parser.add_argument("--token-rate", type=float, default=80.0, help="simulated output tokens per second")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="probability an LLM call fails")
+    parser.add_argument("--cache-mode", choices=["cold", "warm"], default="cold",
+                        help="cold: unique inputs that miss every cache; warm: a small repeated input set")
+    parser.add_argument("--quiz-pool", action="store_true", help="keep the background question pool running")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--results-dir", default=RESULTS_DIR)
+    parser.add_argument("--compare", help="results file to compare against (default: the previous run)")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args(argv)
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    configure_environment(args)
+    import llm
+    from main import app
+
+    # .env may carry real routes; every route must hit the fake provider
+    llm.ENABLED_PROVIDERS[:] = ["local"]
+    llm.DEFAULT_ROUTE = "local"
+    for route in list(llm.provider_stats()["routes"]):
+        llm.set_route(route, "local")
+    rng = random.Random(args.seed)
+    fake = make_fake_provider(llm, LatencyDistribution(args.latency, rng), args.token_rate, args.failure_rate, rng)
+    llm.register_provider(fake)
+
+    port = _free_port()
+    server = ServerThread(app, port)
+    server.start()
+    server.wait_started()
+    try:
+        scenario_results = asyncio.run(drive(args, port, server))
+    finally:
+        server.server.should_exit = True
+        server.join(timeout=10)
+
+    results = {
+        "meta": {
+            "timestamp": time.time(),
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "settings": {k: v for k, v in vars(args).items() if k not in ("results_dir", "compare", "no_save")},
+            "injected_failures": fake.injected_failures,
+        },
+        "scenarios": scenario_results,
+    }
+    path = None if args.no_save else save_results(results, args.results_dir)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    elif path:
+        baseline = previous_results(args.results_dir, path)
+    print_report(results, baseline)
+    if path:
+        print(f"\n✓ Results saved to {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1 @@
+# Lets tests import the backend modules the way main.py does (``import single_flight``)
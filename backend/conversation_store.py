@@ -0,0 +1,165 @@
+"""
+Server-held chat conversations
+Clients that hold a conversation ID send only the new message. Each
+conversation keeps its recent turns within the chat history token budget and
+folds older ones into a rolling summary in the background, so the work per
+turn and the memory per conversation stay constant however long it runs.
+"""
+import asyncio
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from history_compaction import HistoryCompactor, clip_to_tokens, estimate_tokens
+from structured_logging import get_logger
+
+log = get_logger("chat.conversations")
+
+
+class Conversation:
+    __slots__ = (
+        "conversation_id", "recent", "recent_tokens", "summary", "unsummarized", "summarizing",
+        "turns", "created_at", "last_access", "context",
+    )
+
+    def __init__(self, conversation_id: str):
+        self.conversation_id = conversation_id
+        # (role, clipped content), oldest first; role is "user" or "assistant"
+        self.recent: Deque[Tuple[str, str]] = deque()
+        self.recent_tokens = 0
+        self.summary: Optional[str] = None
+        # Turns that left ``recent`` but are not in ``summary`` yet
+        self.unsummarized: List[Tuple[str, str]] = []
+        self.summarizing = False
+        self.turns = 0
+        self.created_at = time.time()
+        self.last_access = self.created_at
+        # Rendered prompt context, rebuilt by the caller after a change
+        self.context: Optional[str] = None
+
+
+class ConversationStore:
+    """LRU + idle-TTL store of conversations, compacted with ``compactor``'s budget"""
+
+    def __init__(self, compactor: HistoryCompactor, max_entries: int = 20000,
+                 idle_ttl_seconds: float = 3600, max_unsummarized: int = 20, max_seed_messages: int = 40):
+        self.compactor = compactor
+        self.max_entries = max_entries
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_unsummarized = max_unsummarized
+        self.max_seed_messages = max_seed_messages
+        self._conversations: "OrderedDict[str, Conversation]" = OrderedDict()
+        self._tasks: Set[asyncio.Task] = set()
+        self.created = 0
+        self.evicted = 0
+        self.misses = 0
+        self.summaries = 0
+        self.summary_failures = 0
+        self.dropped_turns = 0
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+    def _expire(self, now: float) -> None:
+        # Ordered by last access, so idle ones sit at the front
+        while self._conversations:
+            conversation = next(iter(self._conversations.values()))
+            if now - conversation.last_access <= self.idle_ttl_seconds:
+                break
+            self._conversations.popitem(last=False)
+            self.evicted += 1
+
+    def create(self, history: Optional[List[dict]] = None) -> Conversation:
+        """New conversation, optionally seeded with the last ``max_seed_messages`` of a client-held history"""
+        now = time.time()
+        self._expire(now)
+        conversation = Conversation(uuid.uuid4().hex)
+        self._conversations[conversation.conversation_id] = conversation
+        self.created += 1
+        while len(self._conversations) > self.max_entries:
+            self._conversations.popitem(last=False)
+            self.evicted += 1
+        for message in (history or [])[-self.max_seed_messages:]:
+            self.append(conversation, "user" if message.get("role") == "user" else "assistant",
+                        str(message.get("content") or ""))
+        return conversation
+
+    def get(self, conversation_id: str) -> Optional[Conversation]:
+        now = time.time()
+        self._expire(now)
+        conversation = self._conversations.get(conversation_id)
+        if conversation is None:
+            self.misses += 1
+            return None
+        conversation.last_access = now
+        self._conversations.move_to_end(conversation_id)
+        return conversation
+
+    def discard(self, conversation_id: str) -> bool:
+        return self._conversations.pop(conversation_id, None) is not None
+
+    def append(self, conversation: Conversation, role: str, content: str) -> None:
+        """Add a turn; turns pushed out of the recent window are queued for the summary"""
+        compactor = self.compactor
+        content = clip_to_tokens(content, compactor.message_tokens)
+        conversation.recent.append((role, content))
+        conversation.recent_tokens += estimate_tokens(content)
+        conversation.turns += 1
+        recent_budget = compactor.budget_tokens - compactor.summary_tokens
+        while len(conversation.recent) > compactor.min_recent and (
+            len(conversation.recent) > compactor.max_recent or conversation.recent_tokens > recent_budget
+        ):
+            old = conversation.recent.popleft()
+            conversation.recent_tokens -= estimate_tokens(old[1])
+            conversation.unsummarized.append(old)
+        if len(conversation.unsummarized) > self.max_unsummarized:
+            # The summarizer is failing or far behind; forget the oldest turns rather than grow
+            excess = len(conversation.unsummarized) - self.max_unsummarized
+            del conversation.unsummarized[:excess]
+            self.dropped_turns += excess
+        conversation.context = None
+        if conversation.unsummarized and not conversation.summarizing:
+            self._summarize(conversation)
+
+    def _summarize(self, conversation: Conversation) -> None:
+        batch = list(conversation.unsummarized)
+        conversation.summarizing = True
+
+        async def run() -> None:
+            try:
+                summary = await self.compactor.summarize(conversation.summary, batch)
+                conversation.summary = clip_to_tokens(summary.strip(), self.compactor.summary_tokens)
+                # Turns queued meanwhile stay for the next pass
+                done = {id(turn) for turn in batch}
+                conversation.unsummarized = [turn for turn in conversation.unsummarized if id(turn) not in done]
+                conversation.context = None
+                self.summaries += 1
+            except Exception as e:
+                self.summary_failures += 1
+                log.warning("conversation_summary_failed", conversation_id=conversation.conversation_id,
+                            turns=len(batch), error=str(e))
+                return
+            finally:
+                conversation.summarizing = False
+            if conversation.unsummarized and conversation.conversation_id in self._conversations:
+                self._summarize(conversation)
+
+        task = asyncio.create_task(run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "conversations": len(self._conversations),
+            "max_entries": self.max_entries,
+            "max_seed_messages": self.max_seed_messages,
+            "idle_ttl_seconds": self.idle_ttl_seconds,
+            "created": self.created,
+            "misses": self.misses,
+            "evicted": self.evicted,
+            "summaries": self.summaries,
+            "summary_failures": self.summary_failures,
+            "summaries_running": len(self._tasks),
+            "dropped_turns": self.dropped_turns,
+        }
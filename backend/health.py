@@ -0,0 +1,102 @@
+"""
+Background upstream prober for readiness checks
+Health endpoints read a cached status instead of calling the LLM themselves,
+so frequent load-balancer probes cost no quota and never wait on the model.
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+class UpstreamProber:
+    """Periodically checks the upstream and caches whether it is reachable.
+
+    A probe is skipped when real traffic has succeeded within the last
+    interval, since that already proves the upstream is reachable. The
+    upstream is reported not ready after ``failure_threshold`` consecutive
+    failed probes, so one slow check does not flap the pod.
+    """
+
+    def __init__(
+        self,
+        probe: Callable[[], Awaitable[None]],
+        interval: float = 30.0,
+        timeout: float = 5.0,
+        failure_threshold: int = 3,
+        last_success: Optional[Callable[[], Optional[float]]] = None,
+    ):
+        self.probe = probe
+        self.interval = interval
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.last_success = last_success or (lambda: None)
+
+        self.ready = False
+        self.checked_at: Optional[float] = None
+        self.probe_latency: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.consecutive_failures = 0
+        self.probes = 0
+        self.skipped = 0
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+
+    async def check(self) -> bool:
+        """Run one check now and update the cached status"""
+        now = time.time()
+        seen = self.last_success()
+        if seen is not None and now - seen < self.interval:
+            self.skipped += 1
+            self._mark_ok(now, None)
+            return True
+        self.probes += 1
+        started = time.time()
+        try:
+            await asyncio.wait_for(self.probe(), timeout=self.timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.checked_at = time.time()
+            self.probe_latency = self.checked_at - started
+            self.last_error = str(e) or type(e).__name__
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                self.ready = False
+            return False
+        self._mark_ok(time.time(), time.time() - started)
+        return True
+
+    def _mark_ok(self, now: float, latency: Optional[float]) -> None:
+        self.checked_at = now
+        if latency is not None:
+            self.probe_latency = latency
+        self.last_error = None
+        self.consecutive_failures = 0
+        self.ready = True
+
+    async def _run(self) -> None:
+        while True:
+            await self.check()
+            await asyncio.sleep(self.interval)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "checked_at": self.checked_at,
+            "age_seconds": round(time.time() - self.checked_at, 1) if self.checked_at else None,
+            "probe_latency_seconds": round(self.probe_latency, 3) if self.probe_latency is not None else None,
+            "last_error": self.last_error,
+            "consecutive_failures": self.consecutive_failures,
+            "interval_seconds": self.interval,
+            "probes": self.probes,
+            "skipped_probes": self.skipped,
+        }
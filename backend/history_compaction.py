@@ -0,0 +1,207 @@
+"""
+Token-budgeted compaction of chat history
+Clients resend their whole history every turn. Recent turns are kept verbatim
+(clipped if a single message is huge) within a token budget; everything older
+is replaced by a rolling summary. Summaries are cached by a hash of the
+history prefix they cover and extended in the background from the previous
+summary, so each older turn is summarized once and no request waits on it.
+Each extension sends at most ``max_summary_messages`` turns; a long backlog
+is folded in over several requests.
+"""
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from structured_logging import get_logger
+
+log = get_logger("chat.history")
+
+CHARS_PER_TOKEN = 4
+# Older turns are not worth showing clipped below this many tokens
+MIN_TAIL_TOKENS = 24
+
+
+def estimate_tokens(text: str) -> int:
+    # No tokenizer is shipped for every provider; ~4 characters per token is close enough for budgeting
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def clip_to_tokens(text: str, max_tokens: int) -> str:
+    """Keep the head and tail of an over-long message"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    head = text[:max_chars * 2 // 3].rstrip()
+    tail = text[len(text) - max_chars // 3:].lstrip()
+    return f"{head} [...] {tail}"
+
+
+def clipped_tail(messages: List[Tuple[str, str]], max_tokens: int,
+                 message_tokens: int) -> List[Tuple[str, str]]:
+    """The newest ``messages`` that fit in ``max_tokens``, each clipped to at most ``message_tokens``"""
+    tail: List[Tuple[str, str]] = []
+    room = max_tokens
+    for role, content in reversed(messages):
+        if room < MIN_TAIL_TOKENS:
+            break
+        content = clip_to_tokens(content, min(message_tokens, room))
+        cost = estimate_tokens(content)
+        if cost > room:
+            break
+        tail.append((role, content))
+        room -= cost
+    tail.reverse()
+    return tail
+
+
+class CompactedHistory(NamedTuple):
+    summary: Optional[str]
+    messages: List[Tuple[str, str]]  # (role, content), oldest first
+    tokens: int
+    summarized_messages: int
+    omitted_messages: int  # older than the summary, not yet folded into it and not shown
+
+
+class HistoryCompactor:
+    """Bounded-size view of a conversation for the prompt.
+
+    ``summarize(previous_summary, messages)`` returns a summary covering the
+    previous summary plus ``messages`` (a list of (role, content)).
+    """
+
+    def __init__(
+        self,
+        summarize: Callable[[Optional[str], List[Tuple[str, str]]], Awaitable[str]],
+        budget_tokens: int = 1200,
+        message_tokens: int = 300,
+        summary_tokens: int = 250,
+        max_recent: int = 6,
+        min_recent: int = 2,
+        max_entries: int = 2000,
+        max_summary_messages: int = 40,
+    ):
+        self.summarize = summarize
+        self.budget_tokens = budget_tokens
+        self.message_tokens = message_tokens
+        self.summary_tokens = summary_tokens
+        self.max_recent = max_recent
+        self.min_recent = min_recent
+        self.max_entries = max_entries
+        self.max_summary_messages = max_summary_messages
+
+        # prefix hash -> (messages covered, summary), least recently used first
+        self._summaries: "OrderedDict[str, Tuple[int, str]]" = OrderedDict()
+        # Background summaries keyed by the hash of the exact prefix they cover
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+        self.compactions = 0
+        self.summary_hits = 0
+        self.summaries_started = 0
+        self.summary_failures = 0
+
+    @staticmethod
+    def _prefix_hashes(messages: List[Tuple[str, str]]) -> List[str]:
+        """hashes[i] identifies messages[:i + 1]; a chain, so all prefixes cost one pass"""
+        hashes = []
+        digest = b""
+        for role, content in messages:
+            digest = hashlib.sha256(digest + role.encode("utf-8") + b"\0" + content.encode("utf-8")).digest()
+            hashes.append(digest.hex())
+        return hashes
+
+    def _lookup(self, hashes: List[str], upto: int) -> Tuple[int, Optional[str]]:
+        """Longest cached summary covering at most the first ``upto`` messages"""
+        for i in range(upto - 1, -1, -1):
+            entry = self._summaries.get(hashes[i])
+            if entry is not None:
+                self._summaries.move_to_end(hashes[i])
+                return entry
+        return 0, None
+
+    def _store(self, key: str, covered: int, summary: str) -> None:
+        self._summaries[key] = (covered, summary)
+        self._summaries.move_to_end(key)
+        while len(self._summaries) > self.max_entries:
+            self._summaries.popitem(last=False)
+
+    def compact(self, history: List[dict]) -> CompactedHistory:
+        self.compactions += 1
+        messages = [
+            ("user" if msg.get("role") == "user" else "assistant", str(msg.get("content") or ""))
+            for msg in history
+        ]
+        clipped = [(role, clip_to_tokens(content, self.message_tokens)) for role, content in messages]
+
+        # Newest first until the budget (minus room for the summary) runs out
+        recent_budget = self.budget_tokens - self.summary_tokens
+        recent: List[Tuple[str, str]] = []
+        used = 0
+        for role, content in reversed(clipped):
+            cost = estimate_tokens(content)
+            if len(recent) >= self.max_recent or (len(recent) >= self.min_recent and used + cost > recent_budget):
+                break
+            recent.append((role, content))
+            used += cost
+        recent.reverse()
+
+        older = len(messages) - len(recent)
+        summary = None
+        covered = 0
+        shown = 0
+        if older:
+            hashes = self._prefix_hashes(messages[:older])
+            covered, summary = self._lookup(hashes, older)
+            if summary is not None:
+                self.summary_hits += 1
+                summary = clip_to_tokens(summary, self.summary_tokens)
+                used += estimate_tokens(summary)
+            if covered < older:
+                self._schedule(hashes, messages[:older], covered, summary)
+                # Until the summary catches up, the newest uncovered turns use the room reserved for it
+                room = self.summary_tokens - (estimate_tokens(summary) if summary else 0)
+                bridge = clipped_tail(clipped[covered:older], room, self.message_tokens)
+                used += sum(estimate_tokens(content) for _, content in bridge)
+                recent = bridge + recent
+                shown = len(bridge)
+
+        return CompactedHistory(summary, recent, used, covered, older - covered - shown)
+
+    def _schedule(self, hashes: List[str], older: List[Tuple[str, str]], covered: int,
+                  previous: Optional[str]) -> None:
+        end = min(len(older), covered + self.max_summary_messages)
+        key = hashes[end - 1]
+        # A summary of this prefix, or of a shorter prefix of this same conversation, is on its way;
+        # the next turn extends from it rather than starting a parallel call
+        if any(h in self._pending for h in hashes):
+            return
+        self.summaries_started += 1
+
+        async def run() -> None:
+            try:
+                # Only the next turns the previous summary does not cover are sent
+                new_messages = [(role, clip_to_tokens(content, self.message_tokens))
+                                for role, content in older[covered:end]]
+                summary = await self.summarize(previous, new_messages)
+                self._store(key, end, summary.strip())
+            except Exception as e:
+                self.summary_failures += 1
+                log.warning("history_summary_failed", messages=end - covered, error=str(e))
+            finally:
+                self._pending.pop(key, None)
+
+        task = asyncio.create_task(run())
+        self._pending[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "cached_summaries": len(self._summaries),
+            "pending_summaries": len(self._pending),
+            "compactions": self.compactions,
+            "summary_hits": self.summary_hits,
+            "summaries_started": self.summaries_started,
+            "summary_failures": self.summary_failures,
+        }
@@ -0,0 +1,248 @@
+"""
+Tolerant parsing of JSON returned by the LLM
+Model output is often almost-JSON: wrapped in ```json fences, followed by a
+remark, with trailing commas, raw newlines inside strings, or cut off at the
+token limit. Repairing these locally is far cheaper than asking the model again.
+"""
+import json
+import re
+from collections import defaultdict
+from typing import Any, Dict, Optional, Tuple, Type, TypeVar
+
+from pydantic import BaseModel, ValidationError
+
+_FENCE_RE = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.DOTALL)
+_LITERAL_RE = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null")
+_BARE_TAIL_RE = re.compile(r"[A-Za-z0-9.+\-]+$")
+_VALID_ESCAPES = set('"\\/bfnrtu')
+
+Model = TypeVar("Model", bound=BaseModel)
+
+
+class LLMOutputError(ValueError):
+    """Model output that could not be repaired into JSON matching the expected schema"""
+
+
+class TruncatedOutputError(LLMOutputError):
+    """Output that was cut off and only parsed after closing it; ``value`` holds the repaired result.
+
+    Fields after the cut are missing even if the schema accepts what is left,
+    so such a result may be shown once but should not be cached.
+    """
+
+    def __init__(self, message: str, value: Any):
+        super().__init__(message)
+        self.value = value
+
+
+def _strip_wrapping(text: str) -> str:
+    text = text.strip()
+    fenced = _FENCE_RE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    return text[min(starts):].strip() if starts else text.strip()
+
+
+def _drop_trailing_comma(out: list) -> None:
+    i = len(out) - 1
+    while i >= 0 and out[i].isspace():
+        i -= 1
+    if i >= 0 and out[i] == ",":
+        del out[i]
+
+
+def _string_start(text: str) -> int:
+    """Index of the opening quote of the string literal that ends ``text``"""
+    i = len(text) - 2
+    while i >= 0:
+        if text[i] == '"':
+            backslashes = 0
+            j = i - 1
+            while j >= 0 and text[j] == "\\":
+                backslashes += 1
+                j -= 1
+            if backslashes % 2 == 0:
+                return i
+        i -= 1
+    return 0
+
+
+def _trim_dangling(text: str, in_object: bool) -> str:
+    """Drop an incomplete trailing member of a truncated document"""
+    while True:
+        text = text.rstrip()
+        if text.endswith(","):
+            text = text[:-1]
+            continue
+        if text.endswith(":"):
+            # Key without a value: drop the key too
+            text = text[:-1].rstrip()
+            text = text[:_string_start(text)] if text.endswith('"') else text
+            continue
+        if text.endswith('"') and in_object:
+            start = _string_start(text)
+            before = text[:start].rstrip()
+            if before.endswith(("{", ",")):
+                # A key whose value never arrived
+                text = before
+                continue
+            return text
+        bare = _BARE_TAIL_RE.search(text)
+        if bare and not _LITERAL_RE.fullmatch(bare.group(0)):
+            # Half-written number or literal, e.g. "12." or "tru"
+            text = text[:bare.start()]
+            continue
+        return text
+
+
+def repair_json(text: str) -> str:
+    """Best-effort rewrite of almost-JSON into something ``json.loads`` accepts"""
+    return _repair(text)[0]
+
+
+def _repair(text: str) -> Tuple[str, bool]:
+    """``repair_json`` plus whether the document was truncated and had to be closed"""
+    text = _strip_wrapping(text)
+    out = []
+    stack = []
+    starts = []  # index in ``out`` where each open container began
+    in_string = False
+    escape = False
+    for ch in text:
+        if in_string:
+            if escape:
+                if ch not in _VALID_ESCAPES:
+                    # "\alpha" and friends: keep the backslash literally
+                    out.append("\\")
+                out.append(ch)
+                escape = False
+            elif ch == "\\":
+                out.append(ch)
+                escape = True
+            elif ch == '"':
+                out.append(ch)
+                in_string = False
+            elif ch == "\n":
+                out.append("\\n")
+            elif ch == "\r":
+                out.append("\\r")
+            elif ch == "\t":
+                out.append("\\t")
+            elif ord(ch) < 0x20:
+                out.append(f"\\u{ord(ch):04x}")
+            else:
+                out.append(ch)
+            continue
+        if ch == '"':
+            in_string = True
+            out.append(ch)
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            starts.append(len(out))
+            out.append(ch)
+        elif ch in "}]":
+            _drop_trailing_comma(out)
+            if stack and stack[-1] == ch:
+                stack.pop()
+                starts.pop()
+                out.append(ch)
+                if not stack:
+                    # Ignore any commentary after the top-level value
+                    break
+        else:
+            out.append(ch)
+
+    if not stack:
+        return "".join(out), False
+
+    # Truncated output: close the open string, trim the partial member, close containers
+    if escape:
+        out.pop()
+    if in_string:
+        out.append('"')
+    for depth in range(1, len(stack)):
+        if stack[depth - 1] == "]":
+            # A container inside an array that never closed is a partial element, likely missing
+            # required fields; drop it rather than emit a stub that fails the schema
+            del out[starts[depth]:]
+            del stack[depth:]
+            break
+    repaired = _trim_dangling("".join(out), stack[-1] == "}")
+    return repaired + "".join(reversed(stack)), True
+
+
+class _ParseStats:
+    __slots__ = ("clean", "repaired", "truncated", "failed", "invalid")
+
+    def __init__(self):
+        self.clean = 0
+        self.repaired = 0
+        self.truncated = 0  # subset of repaired
+        self.failed = 0
+        self.invalid = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        parsed = self.clean + self.repaired
+        total = parsed + self.failed
+        return {
+            "clean": self.clean,
+            "repaired": self.repaired,
+            "truncated": self.truncated,
+            "failed": self.failed,
+            "schema_invalid": self.invalid,
+            # Share of responses that would have needed a retry without repair
+            "repair_rate": self.repaired / total if total else 0.0,
+        }
+
+
+_stats: Dict[str, _ParseStats] = defaultdict(_ParseStats)
+
+
+def parse_json(text: Optional[str], source: str = "default") -> Any:
+    """Parse model output as JSON, repairing it if needed; raises LLMOutputError"""
+    return _parse_json(text, source)[0]
+
+
+def _parse_json(text: Optional[str], source: str) -> Tuple[Any, bool]:
+    stats = _stats[source]
+    if not text or not text.strip():
+        stats.failed += 1
+        raise LLMOutputError("Empty response from AI")
+    try:
+        value = json.loads(text)
+        stats.clean += 1
+        return value, False
+    except ValueError:
+        pass
+    repaired, truncated = _repair(text)
+    try:
+        value = json.loads(repaired)
+    except ValueError as e:
+        stats.failed += 1
+        raise LLMOutputError(f"Unrecoverable JSON from AI: {e}") from e
+    stats.repaired += 1
+    stats.truncated += truncated
+    return value, truncated
+
+
+def parse_model(text: Optional[str], schema: Type[Model], source: str = "default",
+                allow_truncated: bool = True) -> Model:
+    """``parse_json`` plus validation against a pydantic schema.
+
+    With ``allow_truncated=False``, output that validates but had to be closed
+    after being cut off raises TruncatedOutputError carrying the model.
+    """
+    data, truncated = _parse_json(text, source)
+    try:
+        model = schema.model_validate(data)
+    except ValidationError as e:
+        _stats[source].invalid += 1
+        raise LLMOutputError(f"AI response does not match the expected structure: {e}") from e
+    if truncated and not allow_truncated:
+        raise TruncatedOutputError("AI response was cut off before it finished", model)
+    return model
+
+
+def parse_stats() -> Dict[str, Dict[str, Any]]:
+    return {source: stats.as_dict() for source, stats in sorted(_stats.items())}
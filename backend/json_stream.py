@@ -0,0 +1,128 @@
+"""
+Incremental parsing of a JSON object as it streams from the LLM
+Emits each top-level member as soon as its value is complete, and optionally
+each element of selected top-level arrays, so clients can render the first
+fields while the model is still writing the rest of the document.
+"""
+import json
+from typing import Any, Iterable, List, Optional, Tuple
+
+from json_repair import repair_json
+
+# ("field", name, value) or ("item", array name, index, value)
+Event = Tuple[Any, ...]
+
+
+def _load(fragment: str) -> Any:
+    try:
+        return json.loads(fragment)
+    except ValueError:
+        # Raw newlines inside strings and the like; the fragment itself is complete
+        return json.loads(repair_json(fragment))
+
+
+class IncrementalObjectParser:
+    """Feed text chunks with ``feed``; each call returns the events it completed.
+
+    Anything before the first ``{`` (code fences, preamble) is skipped and
+    parsing stops at the matching ``}``. Members that fail to parse are
+    skipped rather than aborting the stream; the caller still parses the full
+    text at the end for the authoritative result.
+    """
+
+    def __init__(self, stream_arrays: Iterable[str] = ()):
+        self.stream_arrays = set(stream_arrays)
+        self.buffer = ""
+        self.done = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._key: Optional[str] = None
+        self._expect_key = False
+        self._value_start: Optional[int] = None
+        self._item_start: Optional[int] = None
+        self._item_index = 0
+        self._streaming_array = False
+        self.emitted: List[str] = []
+
+    def feed(self, chunk: str) -> List[Event]:
+        self.buffer += chunk
+        events: List[Event] = []
+        buffer = self.buffer
+        i = self._pos
+        while i < len(buffer) and not self.done:
+            ch = buffer[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._expect_key:
+                        self._key = _load(buffer[self._string_start:i + 1])
+                        self._expect_key = False
+            elif self._depth == 0:
+                if ch == "{":
+                    self._depth = 1
+                    self._expect_key = True
+            elif ch == '"':
+                self._in_string = True
+                self._string_start = i
+                self._mark_value_start(i)
+            elif ch in "{[":
+                self._mark_value_start(i)
+                self._depth += 1
+                if self._depth == 2 and ch == "[" and self._key in self.stream_arrays:
+                    self._streaming_array = True
+                    self._item_start = None
+                    self._item_index = 0
+            elif ch in "}]":
+                if self._depth == 2 and self._streaming_array:
+                    self._end_item(i, events)
+                    self._streaming_array = False
+                self._depth -= 1
+                if self._depth == 0:
+                    self._end_field(i, events)
+                    self.done = True
+            elif ch == ",":
+                if self._depth == 1:
+                    self._end_field(i, events)
+                    self._expect_key = True
+                elif self._depth == 2 and self._streaming_array:
+                    self._end_item(i, events)
+            elif ch == ":":
+                pass
+            elif not ch.isspace():
+                self._mark_value_start(i)
+            i += 1
+        self._pos = i
+        return events
+
+    def _mark_value_start(self, i: int) -> None:
+        if self._depth == 1 and not self._expect_key and self._value_start is None:
+            self._value_start = i
+        elif self._depth == 2 and self._streaming_array and self._item_start is None:
+            self._item_start = i
+
+    def _end_item(self, i: int, events: List[Event]) -> None:
+        if self._item_start is None:
+            return
+        try:
+            events.append(("item", self._key, self._item_index, _load(self.buffer[self._item_start:i])))
+        except ValueError:
+            pass
+        self._item_index += 1
+        self._item_start = None
+
+    def _end_field(self, i: int, events: List[Event]) -> None:
+        if self._key is not None and self._value_start is not None:
+            try:
+                events.append(("field", self._key, _load(self.buffer[self._value_start:i])))
+                self.emitted.append(self._key)
+            except ValueError:
+                pass
+        self._key = None
+        self._value_start = None
@@ -0,0 +1,547 @@
+"""
+Shared async LLM execution layer
+Every LLM call in the backend goes through here so that no request handler
+blocks the event loop while waiting on the model.
+
+Calls name a route ("chat", "quiz_pool", ...) and each route is served by a
+provider chosen by configuration:
+
+    LLM_PROVIDERS=gemini,ollama        providers eligible for "fastest" routing
+    LLM_ROUTE_DEFAULT=gemini           routes without their own setting
+    LLM_ROUTE_QUIZ_POOL=ollama         a single provider
+    LLM_ROUTE_REACTION=gemini,ollama   first healthy provider, failing over in order
+    LLM_ROUTE_CHAT=fastest             healthy provider with the lowest observed latency
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import deque
+from contextlib import aclosing, asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, NamedTuple, Optional, Tuple, Union
+
+import google.generativeai as genai
+import httpx
+
+import metrics
+from admission import LLM_MAX_QUEUED, ConcurrencyGate, UpstreamBusy, upstream_gate
+from structured_logging import get_logger
+
+log = get_logger("llm")
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2:3b-instruct-q4_K_M")
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+
+# Maximum number of upstream LLM calls (including open streams) in flight per worker
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))
+# A local Ollama model serves few requests at once; queue the rest here
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "4"))
+# How long Ollama keeps the model loaded after a request ("30m", "-1" for ever)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Load the model at startup so the first request does not pay for it
+OLLAMA_PRELOAD = os.getenv("OLLAMA_PRELOAD", "1") == "1"
+# Longest wait for the next byte (including the first token of a cold model)
+OLLAMA_READ_TIMEOUT_SECONDS = float(os.getenv("OLLAMA_READ_TIMEOUT_SECONDS", "120"))
+
+ENABLED_PROVIDERS = [p.strip() for p in os.getenv("LLM_PROVIDERS", "gemini").split(",") if p.strip()]
+DEFAULT_ROUTE = os.getenv("LLM_ROUTE_DEFAULT", ENABLED_PROVIDERS[0] if ENABLED_PROVIDERS else "gemini")
+
+# A provider that failed this many times in a row is skipped for the cooldown period
+PROVIDER_FAILURE_THRESHOLD = int(os.getenv("LLM_PROVIDER_FAILURE_THRESHOLD", "3"))
+PROVIDER_COOLDOWN_SECONDS = float(os.getenv("LLM_PROVIDER_COOLDOWN_SECONDS", "30"))
+
+# Rolling window of real upstream calls used for health reporting
+LLM_STATS_WINDOW_SECONDS = float(os.getenv("LLM_STATS_WINDOW_SECONDS", "300"))
+
+_calls: Deque[Tuple[float, float, bool]] = deque(maxlen=2000)  # (finished_at, latency, ok)
+
+
+def _record(started: float, ok: bool) -> None:
+    now = time.time()
+    _calls.append((now, now - started, ok))
+
+
+class Usage(NamedTuple):
+    prompt_tokens: int
+    output_tokens: int
+
+
+class Provider:
+    """Common interface: ``generate``, ``stream`` and ``probe``.
+
+    Generation options use the Gemini names (temperature, top_p, top_k,
+    max_output_tokens, response_mime_type); providers translate them.
+    ``response_mime_type="application/json"`` selects JSON mode.
+    ``_generate`` returns (text, usage or None); ``_stream`` yields text
+    chunks and may yield a final ``Usage``.
+    """
+
+    name = "provider"
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        # Its own bounded queue, so calls waiting here are refused with UpstreamBusy too
+        self.gate = ConcurrencyGate(max_concurrency, LLM_MAX_QUEUED)
+        # Generation latency, or time to first chunk for streams
+        self.latency_ewma: Optional[float] = None
+        self.calls = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.last_error_at = 0.0
+
+    @asynccontextmanager
+    async def _slot(self):
+        # Provider limit first, so a saturated local model cannot hold global slots other providers need
+        async with self.gate, upstream_gate:
+            started = time.time()
+            try:
+                yield
+            finally:
+                held = time.time() - started
+                self.gate.observe_hold(held)
+                upstream_gate.observe_hold(held)
+
+    @property
+    def healthy(self) -> bool:
+        return (self.consecutive_errors < PROVIDER_FAILURE_THRESHOLD
+                or time.time() - self.last_error_at > PROVIDER_COOLDOWN_SECONDS)
+
+    def observe(self, latency: Optional[float], ok: bool) -> None:
+        self.calls += 1
+        if not ok:
+            self.errors += 1
+            self.consecutive_errors += 1
+            self.last_error_at = time.time()
+            return
+        self.consecutive_errors = 0
+        if latency is not None:
+            self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+
+    async def _generate(self, prompt: str, **config) -> Tuple[str, Optional[Usage]]:
+        raise NotImplementedError
+
+    def _stream(self, prompt: str, **config) -> AsyncIterator[Union[str, Usage]]:
+        raise NotImplementedError
+
+    async def probe(self) -> None:
+        raise NotImplementedError
+
+    async def preload(self) -> None:
+        """Warm the model up before traffic arrives (optional)"""
+        return None
+
+    async def close(self) -> None:
+        """Release pooled connections (optional)"""
+        return None
+
+    async def generate(self, prompt: str, route: str = "default", **config) -> str:
+        async with self._slot():
+            started = time.time()
+            try:
+                text, usage = await self._generate(prompt, **config)
+            except Exception:
+                self.observe(None, False)
+                _record(started, False)
+                metrics.observe_llm_call(self.name, route, "generate", False, time.time() - started)
+                raise
+        duration = time.time() - started
+        self.observe(duration, True)
+        _record(started, True)
+        metrics.observe_llm_call(self.name, route, "generate", True, duration, usage=usage)
+        return text
+
+    async def stream(self, prompt: str, route: str = "default", **config) -> AsyncIterator[str]:
+        async with self._slot():
+            started = time.time()
+            first_chunk = None
+            usage = None
+            try:
+                # Closed explicitly so an abandoned stream frees its slot and connection at once
+                async with aclosing(self._stream(prompt, **config)) as chunks:
+                    async for item in chunks:
+                        if isinstance(item, Usage):
+                            usage = item
+                            continue
+                        if first_chunk is None:
+                            first_chunk = time.time() - started
+                        yield item
+            except Exception:
+                self.observe(None, False)
+                _record(started, False)
+                metrics.observe_llm_call(self.name, route, "stream", False, time.time() - started, first_chunk)
+                raise
+        self.observe(first_chunk, True)
+        _record(started, True)
+        metrics.observe_llm_call(self.name, route, "stream", True, time.time() - started, first_chunk, usage)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "healthy": self.healthy,
+            "calls": self.calls,
+            "errors": self.errors,
+            "consecutive_errors": self.consecutive_errors,
+            "latency_ewma_seconds": round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            "gate": self.gate.stats(),
+        }
+
+
+class GeminiProvider(Provider):
+    name = "gemini"
+
+    def __init__(self, model_name: str = GEMINI_MODEL, max_concurrency: int = LLM_MAX_CONCURRENCY):
+        super().__init__(max_concurrency)
+        self.model_name = model_name
+        self._model: Optional[genai.GenerativeModel] = None
+
+    def _get_model(self) -> genai.GenerativeModel:
+        if self._model is None:
+            self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    @staticmethod
+    def _usage(response) -> Optional[Usage]:
+        metadata = getattr(response, "usage_metadata", None)
+        if not metadata:
+            return None
+        return Usage(getattr(metadata, "prompt_token_count", 0) or 0,
+                     getattr(metadata, "candidates_token_count", 0) or 0)
+
+    async def _generate(self, prompt: str, **config) -> Tuple[str, Optional[Usage]]:
+        # Raises ValueError for blocked/empty responses when ``.text`` is read
+        response = await self._get_model().generate_content_async(
+            prompt, generation_config=genai.types.GenerationConfig(**config)
+        )
+        return response.text, self._usage(response)
+
+    async def _stream(self, prompt: str, **config) -> AsyncIterator[Union[str, Usage]]:
+        response = await self._get_model().generate_content_async(
+            prompt, stream=True, generation_config=genai.types.GenerationConfig(**config)
+        )
+        usage = None
+        async for chunk in response:
+            # Usage is cumulative; the last chunk carries the totals
+            usage = self._usage(chunk) or usage
+            if chunk.text:
+                yield chunk.text
+        if usage:
+            yield usage
+
+    async def probe(self) -> None:
+        # Fetches model metadata; generates nothing
+        await asyncio.to_thread(genai.get_model, f"models/{self.model_name}")
+
+
+class OllamaProvider(Provider):
+    """Ollama's HTTP API over a pooled keep-alive connection, with true async streaming"""
+
+    name = "ollama"
+
+    def __init__(self, model_name: str = OLLAMA_MODEL, host: str = OLLAMA_HOST,
+                 max_concurrency: int = OLLAMA_MAX_CONCURRENCY, keep_alive: str = OLLAMA_KEEP_ALIVE):
+        super().__init__(max_concurrency)
+        self.model_name = model_name
+        self.host = host.rstrip("/")
+        self.keep_alive = keep_alive
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Created lazily so it binds to the running server loop; one connection per concurrent call
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.host,
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency, keepalive_expiry=300),
+                timeout=httpx.Timeout(10.0, read=OLLAMA_READ_TIMEOUT_SECONDS),
+            )
+        return self._client
+
+    def _request(self, prompt: str, config: Dict[str, Any], stream: bool) -> Dict[str, Any]:
+        options = {key: config[key] for key in ("temperature", "top_p", "top_k") if key in config}
+        if "max_output_tokens" in config:
+            options["num_predict"] = config["max_output_tokens"]
+        request = {
+            "model": self.model_name,
+            "messages": [{"role": "user", "content": prompt}],
+            "options": options,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+        }
+        if config.get("response_mime_type") == "application/json":
+            request["format"] = "json"
+        return request
+
+    @staticmethod
+    def _raise_for_error(status_code: int, body: Any) -> None:
+        if isinstance(body, dict) and body.get("error"):
+            raise RuntimeError(f"Ollama error ({status_code}): {body['error']}")
+        if status_code >= 400:
+            raise RuntimeError(f"Ollama returned HTTP {status_code}")
+
+    @staticmethod
+    def _usage(response: Dict[str, Any]) -> Optional[Usage]:
+        if "eval_count" not in response:
+            return None
+        return Usage(response.get("prompt_eval_count", 0) or 0, response.get("eval_count", 0) or 0)
+
+    async def _generate(self, prompt: str, **config) -> Tuple[str, Optional[Usage]]:
+        response = await self._get_client().post("/api/chat", json=self._request(prompt, config, stream=False))
+        body = response.json()
+        self._raise_for_error(response.status_code, body)
+        return body["message"]["content"], self._usage(body)
+
+    async def _stream(self, prompt: str, **config) -> AsyncIterator[Union[str, Usage]]:
+        # Leaving the block (including on cancellation) closes the response and stops generation
+        async with self._get_client().stream("POST", "/api/chat", json=self._request(prompt, config, stream=True)) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                try:
+                    body = response.json()
+                except ValueError:
+                    body = None
+                self._raise_for_error(response.status_code, body)
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                self._raise_for_error(response.status_code, chunk)
+                text = chunk.get("message", {}).get("content")
+                if text:
+                    yield text
+                if chunk.get("done"):
+                    usage = self._usage(chunk)
+                    if usage:
+                        yield usage
+
+    async def probe(self) -> None:
+        response = await self._get_client().get("/api/tags")
+        response.raise_for_status()
+
+    async def preload(self) -> None:
+        if not OLLAMA_PRELOAD:
+            return
+        # A request without a prompt only loads the model and sets its keep-alive
+        response = await self._get_client().post(
+            "/api/generate", json={"model": self.model_name, "keep_alive": self.keep_alive}
+        )
+        self._raise_for_error(response.status_code, response.json())
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def _default_local_response(prompt: str, config: Dict[str, Any]) -> str:
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+    if config.get("response_mime_type") == "application/json":
+        return json.dumps({"provider": "local", "prompt_hash": digest})
+    return (f"This is a deterministic local response (prompt {digest}). "
+            "No language model was called; configure a Gemini or Ollama route for real answers.")
+
+
+class LocalProvider(Provider):
+    """Deterministic stand-in that needs no network or model.
+
+    The same prompt always yields the same text. ``respond(prompt, config)``
+    can be swapped for canned responses, and ``latency``/``chunk_delay``
+    simulate a slow upstream (used by the benchmark harness).
+    """
+
+    name = "local"
+
+    def __init__(self, respond: Optional[Callable[[str, Dict[str, Any]], str]] = None,
+                 latency: float = 0.0, chunk_delay: float = 0.0, chunk_size: int = 16,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY):
+        super().__init__(max_concurrency)
+        self.respond = respond or _default_local_response
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def estimate_usage(prompt: str, text: str) -> Usage:
+        # Roughly four characters per token
+        return Usage(len(prompt) // 4, len(text) // 4)
+
+    async def _generate(self, prompt: str, **config) -> Tuple[str, Optional[Usage]]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        text = self.respond(prompt, config)
+        return text, self.estimate_usage(prompt, text)
+
+    async def _stream(self, prompt: str, **config) -> AsyncIterator[Union[str, Usage]]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        text = self.respond(prompt, config)
+        for i in range(0, len(text), self.chunk_size):
+            if i and self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+            yield text[i:i + self.chunk_size]
+        yield self.estimate_usage(prompt, text)
+
+    async def probe(self) -> None:
+        return None
+
+
+PROVIDER_FACTORIES: Dict[str, Callable[[], Provider]] = {
+    "gemini": GeminiProvider,
+    "ollama": OllamaProvider,
+    "local": LocalProvider,
+}
+
+_providers: Dict[str, Provider] = {}
+_routes: Dict[str, str] = {
+    key[len("LLM_ROUTE_"):].lower(): value.strip()
+    for key, value in os.environ.items()
+    if key.startswith("LLM_ROUTE_") and key != "LLM_ROUTE_DEFAULT" and value.strip()
+}
+
+
+def get_provider(name: str) -> Provider:
+    provider = _providers.get(name)
+    if provider is None:
+        factory = PROVIDER_FACTORIES.get(name)
+        if factory is None:
+            raise ValueError(f"Unknown LLM provider: {name}")
+        provider = factory()
+        _providers[name] = provider
+    return provider
+
+
+def register_provider(provider: Provider) -> None:
+    """Install a provider instance (e.g. a configured LocalProvider) under its name"""
+    _providers[provider.name] = provider
+
+
+def set_route(route: str, spec: str) -> None:
+    _routes[route] = spec
+
+
+def candidates(route: str = "default") -> List[Provider]:
+    """Providers for a route, best first"""
+    spec = _routes.get(route, DEFAULT_ROUTE)
+    if spec == "fastest":
+        providers = [get_provider(name) for name in ENABLED_PROVIDERS]
+        # Untried providers sort first so every provider gets measured
+        providers.sort(key=lambda p: p.latency_ewma if p.latency_ewma is not None else -1.0)
+    else:
+        providers = [get_provider(name.strip()) for name in spec.split(",") if name.strip()]
+    healthy = [p for p in providers if p.healthy]
+    return healthy + [p for p in providers if not p.healthy]
+
+
+async def generate(prompt: str, route: str = "default", **generation_config) -> str:
+    """Run a single non-streaming generation and return the response text.
+
+    Tries the route's providers in order until one succeeds; the last error is
+    re-raised, so callers keep their existing handling.
+    """
+    providers = candidates(route)
+    for i, provider in enumerate(providers):
+        try:
+            return await provider.generate(prompt, route, **generation_config)
+        except UpstreamBusy:
+            # The gate is shared by every provider; trying the next one would not help
+            raise
+        except Exception as e:
+            if i == len(providers) - 1:
+                raise
+            metrics.LLM_FAILOVERS.inc(route, provider.name)
+            log.warning("provider_failover", route=route, provider=provider.name,
+                        next_provider=providers[i + 1].name, error=str(e))
+
+
+async def stream(prompt: str, route: str = "default", **generation_config) -> AsyncIterator[str]:
+    """Stream a generation, yielding text chunks as they arrive.
+
+    Fails over to the next provider only if nothing has been yielded yet. The
+    provider's concurrency slot is held for the lifetime of the stream and
+    released as soon as the consumer stops iterating (including on cancellation).
+    """
+    providers = candidates(route)
+    for i, provider in enumerate(providers):
+        started = False
+        try:
+            async with aclosing(provider.stream(prompt, route, **generation_config)) as chunks:
+                async for text in chunks:
+                    started = True
+                    yield text
+            return
+        except UpstreamBusy:
+            raise
+        except Exception as e:
+            if started or i == len(providers) - 1:
+                raise
+            metrics.LLM_FAILOVERS.inc(route, provider.name)
+            log.warning("provider_failover", route=route, provider=provider.name,
+                        next_provider=providers[i + 1].name, error=str(e))
+
+
+def last_success() -> Optional[float]:
+    """Timestamp of the most recent successful upstream call, if any is in the window"""
+    for finished_at, _, ok in reversed(_calls):
+        if ok:
+            return finished_at
+    return None
+
+
+def traffic_stats(window_seconds: float = LLM_STATS_WINDOW_SECONDS) -> Dict[str, Any]:
+    """Latency and error rate of real upstream calls over the recent window"""
+    cutoff = time.time() - window_seconds
+    recent = [(latency, ok) for finished_at, latency, ok in _calls if finished_at >= cutoff]
+    latencies = sorted(latency for latency, _ in recent)
+    errors = sum(1 for _, ok in recent if not ok)
+
+    def percentile(p: float) -> Optional[float]:
+        if not latencies:
+            return None
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3)
+
+    return {
+        "window_seconds": window_seconds,
+        "calls": len(recent),
+        "errors": errors,
+        "error_rate": errors / len(recent) if recent else 0.0,
+        "latency_p50_seconds": percentile(0.50),
+        "latency_p95_seconds": percentile(0.95),
+    }
+
+
+def provider_stats() -> Dict[str, Any]:
+    return {
+        "enabled": ENABLED_PROVIDERS,
+        "default_route": DEFAULT_ROUTE,
+        "routes": dict(_routes),
+        "providers": {name: provider.stats() for name, provider in _providers.items()},
+    }
+
+
+async def probe(route: str = "default") -> None:
+    """Cheap upstream reachability check for the route's preferred provider"""
+    await candidates(route)[0].probe()
+
+
+def _configured_provider_names() -> List[str]:
+    names = set(ENABLED_PROVIDERS)
+    for spec in [DEFAULT_ROUTE, *_routes.values()]:
+        names.update(name.strip() for name in spec.split(","))
+    return [name for name in names if name in PROVIDER_FACTORIES or name in _providers]
+
+
+async def preload() -> None:
+    """Warm up every configured provider that supports it (e.g. load the Ollama model)"""
+    for name in _configured_provider_names():
+        provider = get_provider(name)
+        started = time.time()
+        try:
+            await provider.preload()
+            log.info("provider_preloaded", provider=name, seconds=round(time.time() - started, 2))
+        except Exception as e:
+            log.warning("provider_preload_failed", provider=name, error=str(e))
+
+
+async def close() -> None:
+    for provider in list(_providers.values()):
+        await provider.close()
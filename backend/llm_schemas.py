@@ -0,0 +1,71 @@
+"""
+Expected shapes of structured LLM responses
+Only the fields the handlers rely on are constrained; anything else the model
+adds is kept (extra="allow") so responses reach the frontend unchanged.
+"""
+from typing import Any, Dict, List, Optional, Union
+
+from pydantic import BaseModel, ConfigDict, Field
+
+
+class _LLMResponse(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+
+class ProductInfo(_LLMResponse):
+    name: str
+
+
+class ReactionAnalysis(_LLMResponse):
+    # Required: an answer without these is not an analysis of the reaction
+    balancedEquation: str = Field(min_length=1)
+    reactionType: str = Field(min_length=1)
+    visualObservation: str = Field(min_length=1)
+    safety: Dict[str, Any] = Field(min_length=1)
+    productsInfo: List[ProductInfo] = []
+    explanation: Dict = {}
+
+
+class MoleculeAnalysis(_LLMResponse):
+    name: str
+    formula: str = ""
+
+
+class GeneratedAtom(_LLMResponse):
+    id: Union[str, int]
+    element: str
+    x: float
+    y: float
+    z: float
+
+
+class GeneratedBond(_LLMResponse):
+    from_: Union[str, int] = Field(alias="from")
+    to: Union[str, int]
+
+
+class GeneratedMolecule(_LLMResponse):
+    name: str
+    atoms: List[GeneratedAtom] = Field(min_length=1)
+    bonds: List[GeneratedBond] = []
+
+
+class GeneratedQuestion(_LLMResponse):
+    question: str = Field(min_length=1)
+    correct_answer: str = Field(min_length=1)
+    explanation: str = ""
+    topic: Optional[str] = None
+
+
+class GeneratedMCQ(GeneratedQuestion):
+    options: List[str] = Field(min_length=2)
+    option_feedback: Any = None  # sanitized against the options by the caller
+
+
+class SuggestionEntry(_LLMResponse):
+    question_id: int
+    suggestions: str = ""
+
+
+class SuggestionBatch(_LLMResponse):
+    suggestions: List[SuggestionEntry] = []
@@ -1,23 +1,52 @@
 """
 FastAPI Backend for Chemistry Teaching Avatar
-Pure Gemini API implementation - no Ollama dependency
+LLM calls go through llm.py, which routes each endpoint to Gemini, Ollama or a
+local stand-in by configuration (see LLM_ROUTE_* there)
 """
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict
 import google.generativeai as genai
 import json
 import asyncio
 import os
+from contextlib import aclosing, suppress
 from dotenv import load_dotenv
 
-# Load environment variables
+# Load environment variables (before the local modules below read their settings)
 load_dotenv()
 
+from structured_logging import RequestIdMiddleware, configure_logging, dropped_records, get_logger, new_request_id, request_id
+
+configure_logging()
+
+import admission
+import llm
+from result_cache import ResultCache, make_key, prompt_version
+from molecule_graph import canonical_molecule_hash
+from molecule_library import MoleculeLibrary, normalize_name
+from question_pool import QuestionPool
+from question_similarity import SimilarityIndex, UserQuestionHistory, is_near_duplicate
+from session_store import CompactQuestion, CompactSession, QuizSessionStore, compact_question
+from single_flight import SingleFlight
+from health import UpstreamProber
+from json_repair import TruncatedOutputError, parse_model, parse_stats
+from json_stream import IncrementalObjectParser
+from history_compaction import HistoryCompactor, clipped_tail, estimate_tokens
+from conversation_store import Conversation, ConversationStore
+from stream_coalescing import coalesce
+from metrics import ASGIMetricsMiddleware, FALLBACKS, RETRIES, registry
+from llm_schemas import (
+    GeneratedMCQ, GeneratedMolecule, GeneratedQuestion, MoleculeAnalysis, ReactionAnalysis, SuggestionBatch
+)
+
 app = FastAPI(title="Chemistry Avatar API", version="1.0.0")
 
+log = get_logger("api")
+quiz_log = get_logger("quiz")
+
 # Configure Gemini API
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 if not GEMINI_API_KEY:
@@ -26,14 +55,14 @@ if not GEMINI_API_KEY:
     pass
 
 if not GEMINI_API_KEY:
-    print("Warning: GEMINI_API_KEY not found in environment variables.")
+    log.warning("gemini_api_key_missing")
     
 try:
     genai.configure(api_key=GEMINI_API_KEY)
 except Exception as e:
-    print(f"Error configuring Gemini API: {e}")
+    log.error("gemini_configure_failed", error=str(e))
 
-GEMINI_MODEL = "gemini-2.0-flash"
+GEMINI_MODEL = llm.GEMINI_MODEL
 
 # CORS configuration
 app.add_middleware(
@@ -43,19 +72,46 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Outermost, so CORS preflights and errors are timed and tagged too
+app.add_middleware(RequestIdMiddleware)
+app.add_middleware(ASGIMetricsMiddleware)
 
 # Models
 class MessageHistory(BaseModel):
     role: str
     content: str
 
+# Longest client-held history accepted per chat request; longer chats use a server-held conversation
+CHAT_HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "400"))
+
 class ChatRequest(BaseModel):
     message: str
     context: Optional[str] = None
     chemicals: Optional[List[str]] = None
     equipment: Optional[List[str]] = None
+    history: Optional[List[MessageHistory]] = Field(default=None, max_length=CHAT_HISTORY_MAX_MESSAGES)
+    # Server-held conversation (POST /chat/conversations); replaces ``history``
+    conversation_id: Optional[str] = None
+
+class ConversationCreateRequest(BaseModel):
     history: Optional[List[MessageHistory]] = None
 
+def admit(http_request: Request, endpoint: str, units: float = 1) -> None:
+    """Refuse with 429 + Retry-After, before any LLM work, if the server or this client is over its limit"""
+    key = admission.client_key(http_request.client.host if http_request.client else None, http_request.headers)
+    try:
+        refused = admission.check(key, endpoint, units)
+    except admission.RequestTooLarge as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if refused is not None:
+        detail, retry_after = refused
+        raise HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(retry_after)})
+
+@app.exception_handler(admission.UpstreamBusy)
+async def upstream_busy_handler(request: Request, exc: admission.UpstreamBusy):
+    # The gate's queue filled up after the request was admitted
+    return JSONResponse(status_code=429, content={"detail": str(exc)}, headers={"Retry-After": str(exc.retry_after)})
+
 # Health check
 class MoleculeGenerationRequest(BaseModel):
     query: str
@@ -79,22 +135,8 @@ class MoleculeAnalysisRequest(BaseModel):
     atoms: List[AtomRequest]
     bonds: List[BondRequest]
 
-@app.post("/analyze-molecule")
-async def analyze_molecule(request: MoleculeAnalysisRequest):
-    """Analyze a molecule structure using Gemini"""
-    start_time = time.time()
-    
-    # Log request details
-    request_id = str(int(time.time() * 1000))
-    print(f"[{request_id}] 🧪 ANALYSIS REQUEST STARTED")
-    print(f"[{request_id}] Atoms: {len(request.atoms)}, Bonds: {len(request.bonds)}")
-    
-    try:
-        # Construct a description of the molecule from the atoms and bonds
-        atom_list = ", ".join([f"{a.element} (ID: {a.id})" for a in request.atoms])
-        bond_list = ", ".join([f"{b.type} bond between {b.from_id} and {b.to_id}" for b in request.bonds])
-        
-        prompt = f"""Analyze this molecular structure:
+# Molecule analysis prompt; atom IDs are only used to describe connectivity
+MOLECULE_ANALYSIS_PROMPT_TEMPLATE = """Analyze this molecular structure:
         Atoms: {atom_list}
         Bonds: {bond_list}
         
@@ -133,42 +175,119 @@ async def analyze_molecule(request: MoleculeAnalysisRequest):
         3. If it's a novel/theoretical molecule, estimate properties based on chemical principles.
         4. Return ONLY valid JSON.
         """
+
+MOLECULE_ANALYSIS_PROMPT_VERSION = prompt_version(MOLECULE_ANALYSIS_PROMPT_TEMPLATE)
+
+# Identical in-flight requests share one upstream call per endpoint
+molecule_analysis_flight = SingleFlight("analyze-molecule")
+molecule_generation_flight = SingleFlight("generate-molecule")
+reaction_flight = SingleFlight("analyze-reaction")
+
+# Analysis results keyed by the canonical graph hash of the molecule
+molecule_cache = ResultCache(
+    "analyze-molecule",
+    max_entries=int(os.getenv("MOLECULE_CACHE_MAX_ENTRIES", "5000")),
+    ttl_seconds=float(os.getenv("MOLECULE_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+)
+
+def molecule_cache_key(request: MoleculeAnalysisRequest) -> str:
+    """Key invariant to atom IDs, coordinates and list order"""
+    graph_hash = canonical_molecule_hash(
+        [(a.id, a.element) for a in request.atoms],
+        [(b.from_id, b.to_id, b.type) for b in request.bonds],
+    )
+    return make_key(MOLECULE_ANALYSIS_PROMPT_VERSION, graph_hash)
+
+@app.post("/analyze-molecule")
+async def analyze_molecule(request: MoleculeAnalysisRequest, http_request: Request):
+    """Analyze a molecule structure using Gemini"""
+    start_time = time.time()
+    log.info("molecule_analysis_started", atoms=len(request.atoms), bonds=len(request.bonds))
+    
+    # Canonical hashing is CPU work on client-supplied graphs, so it is charged like the
+    # analysis and runs off the event loop
+    admit(http_request, "analyze-molecule")
+    # Same molecule built in a different order or position hits the same entry
+    cache_key = await asyncio.to_thread(molecule_cache_key, request)
+    cached = await molecule_cache.get(cache_key)
+    if cached is not None:
+        log.info("cache_hit", cache="analyze-molecule", molecule=cached.get("name"),
+                 duration_ms=round((time.time() - start_time) * 1000, 1))
+        return cached
+    
+    return await molecule_analysis_flight.do(
+        cache_key, lambda: run_molecule_analysis(request, cache_key, start_time)
+    )
+
+async def run_molecule_analysis(request: MoleculeAnalysisRequest, cache_key: str, start_time: float):
+    """LLM part of /analyze-molecule; result is cached and shared with coalesced callers"""
+    try:
+        # Construct a description of the molecule from the atoms and bonds
+        atom_list = ", ".join([f"{a.element} (ID: {a.id})" for a in request.atoms])
+        bond_list = ", ".join([f"{b.type} bond between {b.from_id} and {b.to_id}" for b in request.bonds])
+        
+        prompt = MOLECULE_ANALYSIS_PROMPT_TEMPLATE.format(atom_list=atom_list, bond_list=bond_list)
         
-        model = genai.GenerativeModel(GEMINI_MODEL)
-        response = model.generate_content(
+        response_text = await llm.generate(
             prompt,
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.2,
-                response_mime_type="application/json"
-            )
+            route="molecule",
+            temperature=0.2,
+            response_mime_type="application/json"
         )
         
-        if response.text:
-            text = response.text.strip()
-            if text.startswith("```json"): text = text[7:]
-            if text.startswith("```"): text = text[3:]
-            if text.endswith("```"): text = text[:-3]
-            
-            data = json.loads(text.strip())
-            
-            # Log success
-            duration = time.time() - start_time
-            print(f"[{request_id}] ✓ ANALYSIS COMPLETE in {duration:.2f}s")
-            print(f"[{request_id}] Result: {data.get('name')} ({data.get('formula')})")
-            
-            return data
-            
-        raise HTTPException(status_code=500, detail="Empty response from AI")
+        try:
+            analysis = parse_model(response_text, MoleculeAnalysis, "analyze-molecule", allow_truncated=False)
+            cacheable = True
+        except TruncatedOutputError as e:
+            # Served once, but a cut-off analysis is not kept for the cache TTL
+            analysis, cacheable = e.value, False
+        data = analysis.model_dump(exclude_unset=True)
         
+        log.info("molecule_analysis_complete", molecule=data.get("name"), formula=data.get("formula"),
+                 cached=cacheable, duration_ms=round((time.time() - start_time) * 1000, 1))
+        
+        if cacheable:
+            await molecule_cache.set(cache_key, data)
+        return data
+        
+    except admission.UpstreamBusy:
+        raise
     except Exception as e:
-        duration = time.time() - start_time
-        print(f"[{request_id}] ✗ ANALYSIS FAILED in {duration:.2f}s: {e}")
+        log.error("molecule_analysis_failed", error=str(e), duration_ms=round((time.time() - start_time) * 1000, 1))
         raise HTTPException(status_code=500, detail=str(e))
 
+# Validated structures from earlier generations and imported bundles
+molecule_library = MoleculeLibrary()
+
+@app.on_event("startup")
+async def load_molecule_library():
+    """Load the structure library and import any configured bundles"""
+    try:
+        count = await molecule_library.load()
+        for bundle_path in filter(None, os.getenv("MOLECULE_LIBRARY_BUNDLES", "").split(os.pathsep)):
+            imported = await molecule_library.import_bundle(bundle_path)
+            log.info("library_bundle_imported", path=bundle_path, molecules=imported)
+        log.info("library_ready", molecules=count)
+    except Exception as e:
+        log.error("library_load_failed", error=str(e))
+
 @app.post("/generate-molecule")
-async def generate_molecule(request: MoleculeGenerationRequest):
+async def generate_molecule(request: MoleculeGenerationRequest, http_request: Request):
     """Generate 3D molecule structure from query using Gemini"""
-    print(f"🧪 Generating molecule for query: '{request.query}'")
+    # Common queries resolve from the local library without an LLM call
+    stored = molecule_library.lookup(request.query)
+    if stored is not None:
+        log.info("library_hit", query=request.query, molecule=stored.get("name"))
+        return stored
+    
+    admit(http_request, "generate-molecule")
+    return await molecule_generation_flight.do(
+        normalize_name(request.query), lambda: run_molecule_generation(request)
+    )
+
+async def run_molecule_generation(request: MoleculeGenerationRequest):
+    """LLM part of /generate-molecule; result is stored in the library and shared with coalesced callers"""
+    log.info("molecule_generation_started", query=request.query)
     prompt = f"""Generate the 3D molecular structure for: {request.query}
     
     Return a valid JSON object with this EXACT structure:
@@ -197,29 +316,27 @@ async def generate_molecule(request: MoleculeGenerationRequest):
     """
     
     try:
-        model = genai.GenerativeModel(GEMINI_MODEL)
-        response = model.generate_content(
+        response_text = await llm.generate(
             prompt,
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.1,
-                response_mime_type="application/json"
-            )
+            route="molecule",
+            temperature=0.1,
+            response_mime_type="application/json"
         )
         
-        if response.text:
-            text = response.text.strip()
-            if text.startswith("```json"): text = text[7:]
-            if text.startswith("```"): text = text[3:]
-            if text.endswith("```"): text = text[:-3]
-            
-            data = json.loads(text.strip())
-            print(f"✓ Generated: {data.get('name')}")
-            return data
-            
-        raise HTTPException(status_code=500, detail="Empty response from AI")
+        data = parse_model(response_text, GeneratedMolecule, "generate-molecule").model_dump(by_alias=True, exclude_unset=True)
+        log.info("molecule_generated", query=request.query, molecule=data.get("name"))
         
+        # Write back so the next request for this query is served locally
+        try:
+            await molecule_library.add(data, aliases=[request.query])
+        except Exception as e:
+            log.warning("library_store_failed", molecule=data.get("name"), error=str(e))
+        return data
+        
+    except admission.UpstreamBusy:
+        raise
     except Exception as e:
-        print(f"Error generating molecule: {e}")
+        log.error("molecule_generation_failed", query=request.query, error=str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/")
@@ -231,28 +348,138 @@ async def root():
         "model": GEMINI_MODEL
     }
 
+# Upstream status is probed in the background; health endpoints only read the cached result
+upstream_prober = UpstreamProber(
+    llm.probe,
+    interval=float(os.getenv("HEALTH_PROBE_INTERVAL_SECONDS", "30")),
+    timeout=float(os.getenv("HEALTH_PROBE_TIMEOUT_SECONDS", "5")),
+    failure_threshold=int(os.getenv("HEALTH_PROBE_FAILURE_THRESHOLD", "3")),
+    last_success=llm.last_success,
+)
+
+@app.on_event("startup")
+async def start_upstream_prober():
+    upstream_prober.start()
+
+@app.on_event("shutdown")
+async def stop_upstream_prober():
+    await upstream_prober.stop()
+
+@app.on_event("startup")
+async def preload_llm_providers():
+    # In the background: a cold local model can take a while to load
+    app.state.llm_preload = asyncio.create_task(llm.preload())
+
+@app.on_event("shutdown")
+async def close_llm_providers():
+    await llm.close()
+
+@app.get("/health/live")
+async def liveness():
+    """Process is up and serving; no upstream I/O"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    """Ready when the last background probe (or real traffic) reached Gemini"""
+    body = {
+        "status": "ready" if upstream_prober.ready else "not_ready",
+        "model": GEMINI_MODEL,
+        "upstream": upstream_prober.status(),
+        "traffic": llm.traffic_stats()
+    }
+    return JSONResponse(body, status_code=200 if upstream_prober.ready else 503)
+
 @app.get("/health")
 async def health_check():
-    """Check if Gemini API is available"""
-    try:
-        # Test API connection
-        model = genai.GenerativeModel(GEMINI_MODEL)
-        response = model.generate_content("test", stream=False)
+    """Cached Gemini status; never calls the model itself"""
+    status = upstream_prober.status()
+    if status["ready"]:
         return {
             "status": "healthy",
             "gemini": "connected",
-            "model": GEMINI_MODEL
-        }
-    except Exception as e:
-        return {
-            "status": "degraded",
-            "gemini": "disconnected",
-            "error": str(e)
+            "model": GEMINI_MODEL,
+            "upstream": status,
+            "traffic": llm.traffic_stats()
         }
+    return {
+        "status": "degraded",
+        "gemini": "disconnected" if status["checked_at"] else "unknown",
+        "error": status["last_error"],
+        "upstream": status,
+        "traffic": llm.traffic_stats()
+    }
 
-async def generate_stream(query: str, context: str = "", chemicals: List[str] = None, equipment: List[str] = None, history: List[dict] = None):
-    """Generate streaming response from Gemini"""
-    
+HISTORY_SUMMARY_PROMPT_TEMPLATE = """Summarize this chemistry tutoring conversation between a student and ERA, their tutor.
+Keep the topics covered, what the student asked, key facts and answers given, and anything the student misunderstood.
+Write at most {max_words} words of plain prose, no preamble.
+{previous_summary}
+Conversation:
+{conversation}"""
+
+async def summarize_history(previous_summary: Optional[str], messages: List[tuple]) -> str:
+    """Fold older chat turns into the conversation's rolling summary"""
+    conversation = "\n".join(f"{'Student' if role == 'user' else 'ERA'}: {content}" for role, content in messages)
+    prompt = HISTORY_SUMMARY_PROMPT_TEMPLATE.format(
+        max_words=CHAT_SUMMARY_TOKENS * 3 // 4,
+        previous_summary=f"\nSummary of the conversation so far:\n{previous_summary}\n" if previous_summary else "",
+        conversation=conversation,
+    )
+    return await llm.generate(
+        prompt,
+        route="summary",
+        temperature=0.2,
+        max_output_tokens=CHAT_SUMMARY_TOKENS,
+    )
+
+# Prompt budget for chat history: recent turns verbatim, older ones as a cached summary
+CHAT_SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", "250"))
+history_compactor = HistoryCompactor(
+    summarize_history,
+    budget_tokens=int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "1200")),
+    message_tokens=int(os.getenv("CHAT_HISTORY_MESSAGE_TOKENS", "300")),
+    summary_tokens=CHAT_SUMMARY_TOKENS,
+    max_recent=int(os.getenv("CHAT_HISTORY_MAX_RECENT", "6")),
+    max_summary_messages=int(os.getenv("CHAT_SUMMARY_MAX_MESSAGES", "40")),
+)
+
+# Server-side conversation state, so clients send only the new message
+conversations = ConversationStore(
+    history_compactor,
+    max_entries=int(os.getenv("CHAT_CONVERSATIONS_MAX", "20000")),
+    idle_ttl_seconds=float(os.getenv("CHAT_CONVERSATION_TTL_SECONDS", "3600")),
+    max_seed_messages=int(os.getenv("CHAT_CONVERSATION_MAX_SEED_MESSAGES", "40")),
+)
+
+def conversation_units(history: List[dict]) -> float:
+    """Admission units for creating a conversation: seeded turns beyond the window cost summary calls"""
+    return 1 + min(len(history), conversations.max_seed_messages) / 10
+
+@app.post("/chat/conversations")
+async def create_conversation(http_request: Request, request: Optional[ConversationCreateRequest] = None):
+    """Start a server-held conversation, optionally seeded with the client's history so far"""
+    history = [h.model_dump() for h in (request.history or [])] if request else []
+    admit(http_request, "conversation", units=conversation_units(history))
+    return {"conversation_id": conversations.create(history).conversation_id}
+
+@app.delete("/chat/conversations/{conversation_id}")
+async def delete_conversation(conversation_id: str):
+    if not conversations.discard(conversation_id):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return {"deleted": True}
+
+def render_conversation_context(summary: Optional[str], messages) -> str:
+    """Prompt section for the earlier turns of a conversation"""
+    conversation_context = "\n\nPrevious conversation context:\n"
+    if summary:
+        conversation_context += f"Summary of earlier conversation: {summary}\n"
+    for role, content in messages:
+        conversation_context += f"{'Student' if role == 'user' else 'ERA'}: {content}\n"
+    return conversation_context
+
+def build_chat_prompt(query: str, context: str = "", chemicals: List[str] = None, history: List[dict] = None,
+                      conversation: Optional[Conversation] = None) -> str:
+    """Tutor prompt for a chat turn, including the compacted conversation"""
     # Build system prompt - More detailed and educational
     system_prompt = """You are ERA, an expert chemistry teacher and tutor. Your role is to:
 1. Answer chemistry questions thoroughly and accurately
@@ -267,14 +494,20 @@ async def generate_stream(query: str, context: str = "", chemicals: List[str] =
 Format your responses naturally - use paragraphs, bullet points, or whatever format best explains the concept.
 Be thorough but concise. Aim for clarity over brevity."""
 
-    # Build conversation context
+    # Build conversation context, bounded by the history token budget
     conversation_context = ""
-    if history and len(history) > 2:
-        conversation_context = "\n\nPrevious conversation context:\n"
-        for msg in history[-6:]:
-            role = "Student" if msg.get('role') == 'user' else "ERA"
-            content = msg.get('content', '')
-            conversation_context += f"{role}: {content}\n"
+    if conversation is not None:
+        # Rendered once per change, not per request
+        if conversation.context is None:
+            # Turns still waiting for the summary are shown clipped in the room reserved for it
+            room = history_compactor.summary_tokens - (estimate_tokens(conversation.summary) if conversation.summary else 0)
+            messages = clipped_tail(conversation.unsummarized, room, history_compactor.message_tokens) + list(conversation.recent)
+            conversation.context = render_conversation_context(conversation.summary, messages) \
+                if messages or conversation.summary else ""
+        conversation_context = conversation.context
+    elif history and len(history) > 2:
+        compacted = history_compactor.compact(history)
+        conversation_context = render_conversation_context(compacted.summary, compacted.messages)
 
     # Build user prompt
     user_prompt = f"Student question: {query}"
@@ -284,60 +517,84 @@ Be thorough but concise. Aim for clarity over brevity."""
         user_prompt += f"\nChemicals involved: {', '.join(chemicals[:5])}"
     if conversation_context:
         user_prompt += conversation_context
+    return f"{system_prompt}\n\n{user_prompt}"
 
+async def chat_tokens(query: str, context: str = "", chemicals: List[str] = None, history: List[dict] = None,
+                      conversation: Optional[Conversation] = None):
+    """Text chunks of the tutor's answer as the model produces them.
+
+    Closing this generator (or cancelling its consumer) closes the upstream
+    stream and frees its provider slot right away. With a ``conversation``
+    the question and the answer (as far as it got) are appended to it.
+    """
+    prompt = build_chat_prompt(query, context, chemicals, history, conversation)
+    if conversation is not None:
+        conversations.append(conversation, "user", query)
+    reply: List[str] = []
     try:
-        model = genai.GenerativeModel(GEMINI_MODEL)
-        
         # Create streaming response with higher token limit for detailed answers
-        response = model.generate_content(
-            f"{system_prompt}\n\n{user_prompt}",
-            stream=True,
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.7,
-                max_output_tokens=1000,
-                top_p=0.9,
-                top_k=40,
-            )
-        )
-        
-        # Stream tokens as they come
-        for chunk in response:
-            if chunk.text:
+        async with aclosing(llm.stream(
+            prompt,
+            route="chat",
+            temperature=0.7,
+            max_output_tokens=1000,
+            top_p=0.9,
+            top_k=40,
+        )) as response:
+            async for chunk_text in response:
+                reply.append(chunk_text)
+                yield chunk_text
+    finally:
+        if conversation is not None and reply:
+            conversations.append(conversation, "assistant", "".join(reply))
+
+async def generate_stream(query: str, context: str = "", chemicals: List[str] = None, equipment: List[str] = None, history: List[dict] = None,
+                          conversation: Optional[Conversation] = None):
+    """Generate streaming response from Gemini"""
+    try:
+        # Stream tokens as they come, merged into fewer lines when they arrive quickly
+        async with aclosing(coalesce(chat_tokens(query, context, chemicals, history, conversation))) as tokens:
+            async for chunk_text in tokens:
                 # Send each chunk as a complete token
-                yield json.dumps({"token": chunk.text}) + "\n"
+                yield json.dumps({"token": chunk_text}) + "\n"
         
+    except admission.UpstreamBusy:
+        # Raised before the first token; callers turn it into 429 / a rate_limited frame
+        raise
     except Exception as e:
         error_msg = f"Error: {str(e)}"
         yield json.dumps({"token": error_msg, "error": True}) + "\n"
 
 @app.post("/chat")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     """HTTP endpoint for streaming chat"""
+    admit(http_request, "chat")
+    conversation = None
+    if request.conversation_id:
+        conversation = conversations.get(request.conversation_id)
+        if conversation is None:
+            # Expired or from before a restart; the client starts a new one (seeded with its history)
+            raise HTTPException(status_code=404, detail="Conversation not found")
     history = [h.dict() if hasattr(h, 'dict') else h for h in (request.history or [])]
-    return StreamingResponse(
-        generate_stream(request.message, request.context, request.chemicals, request.equipment, history),
-        media_type="application/x-ndjson"
-    )
-
-@app.post("/analyze-reaction")
-async def analyze_reaction(request: ChatRequest):
-    """Specialized endpoint for reaction analysis"""
-    if not request.chemicals or len(request.chemicals) < 2:
-        raise HTTPException(status_code=400, detail="At least 2 chemicals required")
-    
-    chemicals_str = ', '.join(request.chemicals[:2])
-    
-    # Build equipment context
-    equipment_context = ""
-    if request.equipment and len(request.equipment) > 0:
-        equipment_list = ', '.join(request.equipment)
-        equipment_context = f"\n\nLab Equipment Being Used: {equipment_list}\nIMPORTANT: Consider how this equipment affects the reaction (temperature, mixing, reaction rate, etc.)"
-        print(f"✓ Equipment: {equipment_list}")
-    else:
-        print(f"✓ No equipment specified")
-    
-    # Detailed prompt requesting JSON structure
-    prompt = f"""Analyze this chemical reaction:
+    lines = generate_stream(request.message, request.context, request.chemicals, request.equipment, history, conversation)
+    # Wait for the first line before answering, so a full upstream queue is still a 429
+    try:
+        first_line = await anext(lines, None)
+    except admission.UpstreamBusy:
+        await lines.aclose()
+        raise
+    return StreamingResponse(resume_stream(first_line, lines), media_type="application/x-ndjson")
+
+async def resume_stream(first_line: Optional[str], lines):
+    """``first_line`` followed by the rest of ``lines``, closing them when done"""
+    async with aclosing(lines):
+        if first_line is not None:
+            yield first_line
+        async for line in lines:
+            yield line
+
+# Detailed prompt requesting JSON structure
+REACTION_PROMPT_TEMPLATE = """Analyze this chemical reaction:
 Chemicals: {chemicals_str}{equipment_context}
 
 Respond with a valid JSON object containing the following structure. 
@@ -398,14 +655,194 @@ IMPORTANT:
 If no instrument is used, set instrumentAnalysis to null.
 """
 
+REACTION_PROMPT_VERSION = prompt_version(REACTION_PROMPT_TEMPLATE)
+
+# Reaction results keyed by normalized chemicals + equipment + prompt version
+reaction_cache = ResultCache(
+    "analyze-reaction",
+    max_entries=int(os.getenv("REACTION_CACHE_MAX_ENTRIES", "5000")),
+    ttl_seconds=float(os.getenv("REACTION_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+)
+
+def reaction_cache_key(chemicals: List[str], equipment: Optional[List[str]]) -> str:
+    """Order-insensitive key for a reaction request"""
+    # Formulas are case-sensitive (Co vs CO), so only whitespace is normalized
+    normalized_chemicals = sorted(" ".join(c.split()) for c in chemicals[:2])
+    normalized_equipment = sorted(" ".join(e.split()).lower() for e in (equipment or []))
+    return make_key(REACTION_PROMPT_VERSION, normalized_chemicals, normalized_equipment)
+
+@app.on_event("startup")
+async def prune_result_caches():
+    """Drop expired cache rows left over from previous runs"""
     try:
-        model = genai.GenerativeModel(GEMINI_MODEL)
-        
-        # Retry logic for robustness
+        removed = 0
+        for cache in (reaction_cache, molecule_cache):
+            removed += await cache.prune()
+        log.info("result_cache_ready", pruned=removed)
+    except Exception as e:
+        log.error("result_cache_prune_failed", error=str(e))
+
+# Sizes are read only when /metrics is scraped
+registry.gauge("result_cache_memory_entries", "Entries in the in-memory LLM result caches", lambda: {
+    "analyze-reaction": reaction_cache.stats()["memory_entries"],
+    "analyze-molecule": molecule_cache.stats()["memory_entries"],
+}, ("cache",))
+registry.gauge("result_cache_lookups", "LLM result cache lookups by outcome since start", lambda: {
+    (cache.namespace, outcome): cache.stats()[key]
+    for cache in (reaction_cache, molecule_cache)
+    for outcome, key in (("memory_hit", "memory_hits"), ("disk_hit", "disk_hits"), ("miss", "misses"))
+}, ("cache", "outcome"))
+registry.gauge("molecule_library_molecules", "Molecules in the generated-molecule library",
+               lambda: molecule_library.stats()["molecules"])
+registry.gauge("quiz_sessions", "Quiz sessions held in memory", lambda: quiz_sessions.stats()["sessions"])
+registry.gauge("quiz_sessions_evicted", "Quiz sessions evicted since start, by reason", lambda: {
+    reason: quiz_sessions.stats()[f"evicted_{reason}"] for reason in ("ttl", "lru", "memory")
+}, ("reason",))
+registry.gauge("quiz_sessions_bytes", "Approximate memory used by quiz sessions",
+               lambda: quiz_sessions.stats()["approx_bytes"])
+registry.gauge("question_pool_questions", "Pre-generated questions waiting in the pool",
+               lambda: question_pool.stats()["pooled_questions"])
+registry.gauge("question_history_users", "Users with a tracked question history",
+               lambda: user_question_history.stats()["users"])
+registry.gauge("coalescing_in_flight", "Upstream calls currently shared by coalesced requests", lambda: {
+    flight.name: flight.stats()["in_flight"]
+    for flight in (reaction_flight, molecule_analysis_flight, molecule_generation_flight)
+}, ("flight",))
+registry.gauge("coalesced_requests", "Requests served by another caller's upstream call since start", lambda: {
+    flight.name: flight.stats()["coalesced"]
+    for flight in (reaction_flight, molecule_analysis_flight, molecule_generation_flight)
+}, ("flight",))
+registry.gauge("chat_conversations", "Server-held chat conversations", lambda: len(conversations))
+registry.gauge("chat_history_summaries", "Cached rolling summaries of chat history",
+               lambda: history_compactor.stats()["cached_summaries"])
+registry.gauge("log_records_dropped", "Log records dropped because the log writer fell behind", dropped_records)
+registry.gauge("llm_json_responses", "LLM JSON responses by parse outcome", lambda: {
+    (source, outcome): count
+    for source, counts in parse_stats().items()
+    for outcome, count in counts.items()
+    if outcome in ("clean", "repaired", "failed", "schema_invalid")
+}, ("source", "outcome"))
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus text exposition of request/LLM latency, token counts and store sizes"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+# Full stats() snapshots (provider routing, cache and store counters) beyond what
+# /metrics exports; unauthenticated, so only served when explicitly enabled
+if os.getenv("DEBUG_STATS_ENABLED", "false").lower() in ("1", "true", "yes"):
+    @app.get("/debug/stats")
+    async def debug_stats():
+        """Per-component stats, keyed by component"""
+        return {
+            "cache": {
+                "analyze_reaction": reaction_cache.stats(),
+                "analyze_molecule": molecule_cache.stats(),
+                "generate_molecule": molecule_library.stats()
+            },
+            "llm_providers": llm.provider_stats(),
+            "parsing": parse_stats(),
+            "coalescing": {
+                flight.name: flight.stats()
+                for flight in (reaction_flight, molecule_analysis_flight, molecule_generation_flight)
+            },
+            "admission": admission.stats(),
+            "chat_history": history_compactor.stats(),
+            "chat_conversations": conversations.stats(),
+            "quiz_sessions": quiz_sessions.stats(),
+            "question_pool": question_pool.stats(),
+        }
+
+def reaction_prompt_inputs(request: ChatRequest):
+    """Chemicals string and equipment context for REACTION_PROMPT_TEMPLATE"""
+    chemicals_str = ', '.join(request.chemicals[:2])
+    
+    # Build equipment context
+    equipment_context = ""
+    if request.equipment and len(request.equipment) > 0:
+        equipment_list = ', '.join(request.equipment)
+        equipment_context = f"\n\nLab Equipment Being Used: {equipment_list}\nIMPORTANT: Consider how this equipment affects the reaction (temperature, mixing, reaction rate, etc.)"
+    return chemicals_str, equipment_context
+
+@app.post("/analyze-reaction")
+async def analyze_reaction(request: ChatRequest, http_request: Request):
+    """Specialized endpoint for reaction analysis"""
+    if not request.chemicals or len(request.chemicals) < 2:
+        raise HTTPException(status_code=400, detail="At least 2 chemicals required")
+    
+    chemicals_str, equipment_context = reaction_prompt_inputs(request)
+    
+    # Serve repeated mixes from the cache before paying for an LLM call
+    cache_key = reaction_cache_key(request.chemicals, request.equipment)
+    cached = await reaction_cache.get(cache_key)
+    if cached is not None:
+        log.info("cache_hit", cache="analyze-reaction", chemicals=chemicals_str)
+        return cached
+    
+    admit(http_request, "analyze-reaction")
+    # A classroom sending the same mix at once shares one upstream call
+    return await reaction_flight.do(
+        cache_key, lambda: run_reaction_analysis(request, chemicals_str, equipment_context, cache_key)
+    )
+
+def normalize_reaction_result(data: dict) -> dict:
+    """Normalize the model's reaction JSON for the frontend"""
+    return {
+        "name": data.get("name", "Unknown Molecule"),
+        "formula": data.get("formula", "Unknown"),
+        "molecularWeight": data.get("molecularWeight", 0.0),
+        "structure": data.get("structure", {}),
+        "properties": data.get("properties", {}),
+        "stability": data.get("stability", "Unknown"),
+        "safety": data.get("safety", {}),
+        "uses": data.get("uses", []),
+        "description": data.get("description", ""),
+        "functionalGroups": data.get("functionalGroups", []),
+
+        # Keep existing fields just in case
+        "balancedEquation": data.get("balancedEquation", "Unknown equation"),
+        "reactionType": data.get("reactionType", "Unknown"),
+        "visualObservation": data.get("visualObservation", "Reaction occurred"),
+        "color": data.get("color", "unknown"),
+        "smell": data.get("smell", "none"),
+        "temperatureChange": data.get("temperatureChange", "none"),
+        "gasEvolution": data.get("gasEvolution"),
+        "emission": data.get("emission"),
+        "stateChange": data.get("stateChange"),
+        "phChange": data.get("phChange"),
+        "instrumentAnalysis": data.get("instrumentAnalysis"),
+        "productsInfo": data.get("productsInfo", []),
+        "explanation": data.get("explanation", {
+            "mechanism": "Unknown",
+            "bondBreaking": "Unknown",
+            "atomicLevel": "Analysis unavailable",
+            "keyConcept": "Unknown"
+        }),
+        "precipitate": data.get("precipitate", False),
+        "precipitateColor": data.get("precipitateColor"),
+        "confidence": data.get("confidence", 0.5),
+
+        # Legacy mapping
+        "products": [p["name"] for p in data.get("productsInfo", [])],
+        "observations": [data.get("visualObservation", "")],
+        "temperature": "increased" if data.get("temperatureChange") == "exothermic" else 
+                      "decreased" if data.get("temperatureChange") == "endothermic" else "unchanged",
+        "safetyNotes": [data.get("safety", {}).get("generalHazards", "Handle with care")]
+    }
+
+async def run_reaction_analysis(request: ChatRequest, chemicals_str: str, equipment_context: str, cache_key: str):
+    """LLM part of /analyze-reaction; result is cached and shared with coalesced callers"""
+    # Detailed prompt requesting JSON structure
+    prompt = REACTION_PROMPT_TEMPLATE.format(chemicals_str=chemicals_str, equipment_context=equipment_context)
+
+    try:
+        # Retry only when the response cannot be repaired locally
         for attempt in range(2):
             try:
                 # Configure generation with JSON enforcement
-                config = genai.types.GenerationConfig(
+                response_text = await llm.generate(
+                    prompt,
+                    route="reaction",
                     temperature=0.1,
                     max_output_tokens=4000,
                     top_p=0.8,
@@ -413,124 +850,334 @@ If no instrument is used, set instrumentAnalysis to null.
                     response_mime_type="application/json"
                 )
                 
-                response = model.generate_content(
-                    prompt,
-                    stream=False,
-                    generation_config=config
-                )
-                
-                if response.text:
-                    text = response.text.strip()
-                    # Clean up markdown if present
-                    if text.startswith("```json"):
-                        text = text[7:]
-                    if text.startswith("```"):
-                        text = text[3:]
-                    if text.endswith("```"):
-                        text = text[:-3]
-                    text = text.strip()
-                
-                    print(f"✓ Prompt: {chemicals_str} (Attempt {attempt+1})")
-                    if request.equipment and attempt == 0:
-                        print(f"✓ Lab Equipment: {', '.join(request.equipment)}")
-                    
-                    data = json.loads(text)
+                if response_text:
+                    # Fences, trailing commas and raw newlines are repaired here. A cut-off
+                    # answer may have lost its safety section, so it is retried, and on the
+                    # last attempt served once without being cached
+                    try:
+                        analysis = parse_model(response_text, ReactionAnalysis, "analyze-reaction",
+                                               allow_truncated=False)
+                        cacheable = True
+                    except TruncatedOutputError as e:
+                        if attempt == 0:
+                            raise
+                        analysis, cacheable = e.value, False
                     
-                    # Normalize data for frontend
-                    result = {
-                        "name": data.get("name", "Unknown Molecule"),
-                        "formula": data.get("formula", "Unknown"),
-                        "molecularWeight": data.get("molecularWeight", 0.0),
-                        "structure": data.get("structure", {}),
-                        "properties": data.get("properties", {}),
-                        "stability": data.get("stability", "Unknown"),
-                        "safety": data.get("safety", {}),
-                        "uses": data.get("uses", []),
-                        "description": data.get("description", ""),
-                        "functionalGroups": data.get("functionalGroups", []),
-                        
-                        # Keep existing fields just in case
-                        "balancedEquation": data.get("balancedEquation", "Unknown equation"),
-                        "reactionType": data.get("reactionType", "Unknown"),
-                        "visualObservation": data.get("visualObservation", "Reaction occurred"),
-                        "color": data.get("color", "unknown"),
-                        "smell": data.get("smell", "none"),
-                        "temperatureChange": data.get("temperatureChange", "none"),
-                        "gasEvolution": data.get("gasEvolution"),
-                        "emission": data.get("emission"),
-                        "stateChange": data.get("stateChange"),
-                        "phChange": data.get("phChange"),
-                        "instrumentAnalysis": data.get("instrumentAnalysis"),
-                        "productsInfo": data.get("productsInfo", []),
-                        "explanation": data.get("explanation", {
-                            "mechanism": "Unknown",
-                            "bondBreaking": "Unknown",
-                            "atomicLevel": "Analysis unavailable",
-                            "keyConcept": "Unknown"
-                        }),
-                        "precipitate": data.get("precipitate", False),
-                        "precipitateColor": data.get("precipitateColor"),
-                        "confidence": data.get("confidence", 0.5),
-                        
-                        # Legacy mapping
-                        "products": [p["name"] for p in data.get("productsInfo", [])],
-                        "observations": [data.get("visualObservation", "")],
-                        "temperature": "increased" if data.get("temperatureChange") == "exothermic" else 
-                                      "decreased" if data.get("temperatureChange") == "endothermic" else "unchanged",
-                        "safetyNotes": [data.get("safety", {}).get("generalHazards", "Handle with care")]
-                    }
+                    result = normalize_reaction_result(analysis.model_dump(exclude_unset=True))
                     
-                    print(f"✓ Parsed JSON successfully")
+                    log.info("reaction_analysis_complete", chemicals=chemicals_str,
+                             equipment=request.equipment or [], attempt=attempt + 1, cached=cacheable)
+                    if cacheable:
+                        await reaction_cache.set(cache_key, result)
                     return result
             
+            except admission.UpstreamBusy:
+                # Retrying would only add to the queue that just refused us
+                raise
             except Exception as e:
-                print(f"✗ Attempt {attempt+1} failed: {e}")
+                log.warning("reaction_attempt_failed", chemicals=chemicals_str, attempt=attempt + 1, error=str(e))
                 if attempt == 1: # Last attempt
                     raise HTTPException(status_code=500, detail=f"Failed to generate valid analysis: {str(e)}")
+                RETRIES.inc("analyze-reaction")
         
         raise HTTPException(status_code=500, detail="No valid response from AI")
 
+    except (admission.UpstreamBusy, HTTPException):
+        raise
     except Exception as e:
-        print(f"✗ Error: {str(e)}")
+        log.error("reaction_analysis_failed", chemicals=chemicals_str, error=str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/analyze-reaction/stream")
+async def analyze_reaction_stream(request: ChatRequest, http_request: Request):
+    """Reaction analysis as NDJSON, emitting each field as soon as the model completes it"""
+    if not request.chemicals or len(request.chemicals) < 2:
+        raise HTTPException(status_code=400, detail="At least 2 chemicals required")
+    
+    chemicals_str, equipment_context = reaction_prompt_inputs(request)
+    cache_key = reaction_cache_key(request.chemicals, request.equipment)
+    cached = await reaction_cache.get(cache_key)
+    if cached is None:
+        admit(http_request, "analyze-reaction")
+    
+    return StreamingResponse(
+        stream_reaction_analysis(chemicals_str, equipment_context, cache_key, cached),
+        media_type="application/x-ndjson"
+    )
+
+def reaction_event_line(event: tuple) -> str:
+    if event[0] == "item":
+        _, name, index, value = event
+        return json.dumps({"type": "item", "name": name, "index": index, "value": value}) + "\n"
+    _, name, value = event
+    return json.dumps({"type": "field", "name": name, "value": value}) + "\n"
+
+def replay_reaction_result(result: dict, **flags) -> List[str]:
+    """Event lines for a finished result, as if it had been streamed"""
+    lines = []
+    for name, value in result.items():
+        if name == "productsInfo":
+            for index, item in enumerate(value):
+                lines.append(reaction_event_line(("item", name, index, item)))
+        lines.append(reaction_event_line(("field", name, value)))
+    lines.append(json.dumps({"type": "done", **flags, "result": result}) + "\n")
+    return lines
+
+async def stream_reaction_analysis(chemicals_str: str, equipment_context: str, cache_key: str, cached: Optional[dict] = None):
+    """Yield field/item events while the model writes, then the normalized result.
+
+    Lines are {"type": "field", "name", "value"} for each top-level field,
+    {"type": "item", "name": "productsInfo", "index", "value"} for each product,
+    and finally {"type": "done", "result"} or {"type": "error", "detail"}.
+    
+    The upstream call is shared through ``reaction_flight``: a request for a
+    mix already being analysed (streamed or not) waits for that result and
+    replays it instead of starting its own call.
+    """
+    if cached is not None:
+        log.info("cache_hit", cache="analyze-reaction", chemicals=chemicals_str, stream=True)
+        for line in replay_reaction_result(cached, cached=True):
+            yield line
+        return
+    
+    prompt = REACTION_PROMPT_TEMPLATE.format(chemicals_str=chemicals_str, equipment_context=equipment_context)
+    # Parser events for the caller that started the call; None marks the end
+    events: asyncio.Queue = asyncio.Queue()
+    
+    async def produce() -> dict:
+        parser = IncrementalObjectParser(stream_arrays=["productsInfo"])
+        start_time = time.time()
+        first_field_time = None
+        try:
+            # Closed explicitly, so cancelling this task ends the upstream request at once
+            async with aclosing(llm.stream(
+                prompt,
+                route="reaction",
+                temperature=0.1,
+                max_output_tokens=4000,
+                top_p=0.8,
+                top_k=20,
+                response_mime_type="application/json"
+            )) as chunks:
+                async for chunk_text in chunks:
+                    for event in parser.feed(chunk_text):
+                        if first_field_time is None:
+                            first_field_time = time.time() - start_time
+                            log.debug("reaction_first_field", chemicals=chemicals_str, field=event[1],
+                                      seconds=round(first_field_time, 3))
+                        events.put_nowait(event)
+        finally:
+            events.put_nowait(None)
+        
+        # The full document (repaired if needed) is the authoritative result; a cut-off one is not cached
+        try:
+            analysis = parse_model(parser.buffer, ReactionAnalysis, "analyze-reaction-stream", allow_truncated=False)
+            cacheable = True
+        except TruncatedOutputError as e:
+            analysis, cacheable = e.value, False
+        result = normalize_reaction_result(analysis.model_dump(exclude_unset=True))
+        if cacheable:
+            await reaction_cache.set(cache_key, result)
+        log.info("reaction_stream_complete", chemicals=chemicals_str, cached=cacheable,
+                 duration_ms=round((time.time() - start_time) * 1000, 1))
+        return result
+    
+    task, started = reaction_flight.start(cache_key, produce)
+    try:
+        if not started:
+            # Same mix already in flight: wait for it rather than paying for a second call
+            result = await asyncio.shield(task)
+            for line in replay_reaction_result(result, joined=True):
+                yield line
+            return
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield reaction_event_line(event)
+        result = await asyncio.shield(task)
+        yield json.dumps({"type": "done", "result": result}) + "\n"
+    except Exception as e:
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        log.error("reaction_stream_failed", chemicals=chemicals_str, error=str(detail))
+        yield json.dumps({"type": "error", "detail": detail}) + "\n"
+    finally:
+        # The client went away; stop the upstream once nobody else is waiting on it
+        reaction_flight.abandon(cache_key, task)
+
+# Concurrent chat streams allowed on one WebSocket connection
+WS_MAX_STREAMS = int(os.getenv("WS_MAX_STREAMS", "4"))
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket endpoint for real-time streaming"""
+    """WebSocket endpoint for real-time streaming.
+
+    A chat message with an "id" starts a stream that runs alongside any
+    others on the socket; {"type": "cancel", "id": ...} aborts it and stops
+    the upstream generation. Frames for a stream carry its id: {"id", "token"}
+    chunks, then {"id", "done": true} ("cancelled": true when aborted) or
+    {"id", "error"}. Messages without an id keep the original protocol
+    ({"token"} frames, then {"done": true}); a new one replaces the running one.
+    
+    A message with a "conversation_id" continues that server-held conversation
+    and needs no "history". {"type": "conversation", "id", "history"?} starts
+    one and is answered with {"id", "conversation_id"}; an unknown id gets
+    {"id", "error", "code": "conversation_not_found"}. Messages over the
+    client's rate limit or arriving while the server is saturated get
+    {"id", "error", "code": "rate_limited", "retry_after"}; one costing more
+    than the client's whole bucket gets {"id", "error", "code": "too_large"}.
+    """
     await websocket.accept()
+    streams: Dict[Optional[str], asyncio.Task] = {}
+    send_lock = asyncio.Lock()
+    
+    async def send_text(text: str) -> None:
+        # Streams share the socket; whole frames only
+        async with send_lock:
+            await websocket.send_text(text)
+    
+    async def send_frame(frame: dict) -> None:
+        await send_text(json.dumps(frame) + "\n")
+    
+    async def admit_ws(stream_id: Optional[str], endpoint: str, units: float = 1) -> bool:
+        """Charge this connection's client; on refusal send an error frame and return False"""
+        try:
+            refused = admission.check(
+                admission.client_key(websocket.client.host if websocket.client else None, websocket.headers),
+                endpoint, units
+            )
+        except admission.RequestTooLarge as e:
+            # The HTTP endpoints answer 400; keep the socket open for the client's other requests
+            await send_frame({"id": stream_id, "error": str(e), "code": "too_large"})
+            return False
+        if refused is not None:
+            await send_frame({"id": stream_id, "error": refused[0], "code": "rate_limited", "retry_after": refused[1]})
+            return False
+        return True
+    
+    async def stop_stream(stream_id: Optional[str]) -> bool:
+        task = streams.pop(stream_id, None)
+        if task is None:
+            return False
+        task.cancel()
+        # Wait for it to unwind so no frame for this id follows the acknowledgement
+        await asyncio.wait([task])
+        return True
+    
+    async def run_stream(stream_id: Optional[str], message_data: dict) -> None:
+        # Each stream is its own request for log correlation
+        request_id.set(new_request_id())
+        query = message_data.get('message', '')
+        context = message_data.get('context', '')
+        chemicals = message_data.get('chemicals', [])
+        equipment = message_data.get('equipment', [])
+        history = message_data.get('history', [])
+        conversation = None
+        if message_data.get('conversation_id'):
+            conversation = conversations.get(str(message_data['conversation_id']))
+            if conversation is None:
+                with suppress(Exception):
+                    await send_frame({"id": stream_id, "error": "Conversation not found", "code": "conversation_not_found"})
+                return
+            history = []
+        log.info("ws_message", stream_id=stream_id, chars=len(query), history=len(history),
+                 conversation_id=conversation.conversation_id if conversation else None)
+        try:
+            if stream_id is None:
+                # Stream response back to client
+                async with aclosing(generate_stream(query, context, chemicals, equipment, history, conversation)) as lines:
+                    async for token_data in lines:
+                        await send_text(token_data)
+                # Send completion signal
+                await send_frame({"done": True})
+                return
+            # Text keeps arriving while this stream waits on the socket and goes out in larger frames
+            async with aclosing(coalesce(chat_tokens(query, context, chemicals, history, conversation), "ws")) as tokens:
+                async for chunk_text in tokens:
+                    await send_frame({"id": stream_id, "token": chunk_text})
+            await send_frame({"id": stream_id, "done": True})
+        except asyncio.CancelledError:
+            log.info("ws_stream_cancelled", stream_id=stream_id)
+            raise
+        except admission.UpstreamBusy as e:
+            with suppress(Exception):
+                await send_frame({"id": stream_id, "error": str(e), "code": "rate_limited", "retry_after": e.retry_after})
+        except Exception as e:
+            log.warning("ws_stream_failed", stream_id=stream_id, error=str(e))
+            with suppress(Exception):
+                await send_frame({"id": stream_id, "error": str(e)})
+        finally:
+            if streams.get(stream_id) is asyncio.current_task():
+                del streams[stream_id]
     
     try:
         while True:
             data = await websocket.receive_text()
-            message_data = json.loads(data)
-            
-            query = message_data.get('message', '')
-            context = message_data.get('context', '')
-            chemicals = message_data.get('chemicals', [])
-            equipment = message_data.get('equipment', [])
-            history = message_data.get('history', [])
+            try:
+                message_data = json.loads(data)
+                if not isinstance(message_data, dict):
+                    raise ValueError("frame must be a JSON object")
+            except ValueError as e:
+                await send_frame({"error": f"Invalid message: {e}"})
+                continue
             
-            # Stream response back to client
-            async for token_data in generate_stream(query, context, chemicals, equipment, history):
-                await websocket.send_text(token_data)
+            stream_id = message_data.get('id')
+            stream_id = None if stream_id is None else str(stream_id)
+            if message_data.get('type') == 'cancel':
+                if await stop_stream(stream_id):
+                    await send_frame({"id": stream_id, "done": True, "cancelled": True})
+                continue
+            if message_data.get('type') == 'conversation':
+                history = message_data.get('history')
+                history = [h for h in history if isinstance(h, dict)] if isinstance(history, list) else []
+                if not await admit_ws(stream_id, "conversation", conversation_units(history)):
+                    continue
+                conversation = conversations.create(history)
+                await send_frame({"id": stream_id, "conversation_id": conversation.conversation_id})
+                continue
             
-            # Send completion signal
-            await websocket.send_text(json.dumps({"done": True}) + "\n")
+            history = message_data.get('history')
+            if isinstance(history, list) and len(history) > CHAT_HISTORY_MAX_MESSAGES:
+                await send_frame({"id": stream_id, "error": f"At most {CHAT_HISTORY_MAX_MESSAGES} history messages per request",
+                                  "code": "too_large"})
+                continue
+            if not await admit_ws(stream_id, "chat"):
+                continue
+            if stream_id is None:
+                await stop_stream(None)
+            elif stream_id in streams:
+                await send_frame({"id": stream_id, "error": "A stream with this id is already running"})
+                continue
+            elif len(streams) >= WS_MAX_STREAMS:
+                await send_frame({"id": stream_id, "error": f"At most {WS_MAX_STREAMS} concurrent streams per connection"})
+                continue
+            streams[stream_id] = asyncio.create_task(run_stream(stream_id, message_data))
             
     except WebSocketDisconnect:
         pass
     except Exception as e:
+        log.error("ws_failed", error=str(e))
         await websocket.close()
+    finally:
+        # Nobody is listening any more; stop paying for their tokens
+        for task in streams.values():
+            task.cancel()
+        if streams:
+            await asyncio.wait(list(streams.values()))
+
+# Largest quiz a single request may ask for (the quiz page offers up to 20)
+QUIZ_MAX_QUESTIONS = int(os.getenv("QUIZ_MAX_QUESTIONS", "20"))
 
 # Quiz Models
 class QuizConfig(BaseModel):
     difficulty: str  # easy, medium, hard
-    num_questions: int
+    num_questions: int = Field(ge=1, le=QUIZ_MAX_QUESTIONS)
     question_types: List[str]  # explanation, mcq, complete_reaction, balance_equation, guess_product, etc
     include_timer: bool
     time_limit_per_question: Optional[int] = None  # in seconds
     user_id: Optional[str] = None
     topics: Optional[List[str]] = None  # user-selected topics, empty list means all topics
+    lazy: bool = False  # return after the first question; generate the rest ahead of the student
 
 class QuizQuestion(BaseModel):
     id: int
@@ -540,6 +1187,7 @@ class QuizQuestion(BaseModel):
     correct_answer: str
     explanation: str
     topic: str
+    option_feedback: Optional[Dict[str, str]] = None  # for MCQ: learning suggestions per wrong option
 
 class UserAnswer(BaseModel):
     question_id: int
@@ -547,15 +1195,6 @@ class UserAnswer(BaseModel):
     time_taken: int  # in seconds
     suggestions: Optional[str] = None
 
-class QuizSession(BaseModel):
-    session_id: str
-    config: QuizConfig
-    questions: List[QuizQuestion]
-    current_question_index: int = 0
-    user_answers: Dict[int, UserAnswer] = {}
-    user_id: Optional[str] = None
-    completed: bool = False
-
 class QuizResult(BaseModel):
     question_id: int
     question_text: str
@@ -567,119 +1206,381 @@ class QuizResult(BaseModel):
     topic: str
     time_taken: int
     suggestions: str
+    suggestions_pending: bool = False  # free-text suggestions are still being generated
 
 # Store active quiz sessions (in production, use database)
-quiz_sessions = {}
+# Bounded by idle TTL, LRU order, entry count and approximate memory
+quiz_sessions = QuizSessionStore(
+    max_entries=int(os.getenv("QUIZ_SESSION_MAX_ENTRIES", "10000")),
+    max_bytes=int(os.getenv("QUIZ_SESSION_MAX_BYTES", str(256 * 1024 * 1024))),
+    idle_ttl_seconds=float(os.getenv("QUIZ_SESSION_IDLE_TTL_SECONDS", "7200")),
+    completed_ttl_seconds=float(os.getenv("QUIZ_SESSION_COMPLETED_TTL_SECONDS", "600")),
+)
 
-@app.post("/quiz/generate")
-async def generate_quiz(config: QuizConfig):
-    """Generate a new quiz with specified configuration"""
-    import uuid
-    import random
+# Maximum number of questions generated concurrently for a single quiz
+QUIZ_GENERATION_CONCURRENCY = int(os.getenv("QUIZ_GENERATION_CONCURRENCY", "8"))
+
+# Lazy quizzes keep this many questions generated ahead of the one being served
+QUIZ_PREFETCH_AHEAD = int(os.getenv("QUIZ_PREFETCH_AHEAD", "3"))
+
+# Near-duplicate detection within a quiz and across a user's recent sessions
+QUIZ_DUPLICATE_THRESHOLD = float(os.getenv("QUIZ_DUPLICATE_THRESHOLD", "0.6"))
+user_question_history = UserQuestionHistory(
+    per_user=int(os.getenv("QUIZ_USER_HISTORY_SIZE", "200")),
+    threshold=QUIZ_DUPLICATE_THRESHOLD,
+)
+QUIZ_CROSS_SESSION_DEDUP = os.getenv("QUIZ_CROSS_SESSION_DEDUP", "1") == "1"
+
+# The fixed quiz grid: every (topic, difficulty, question type) cell
+QUIZ_TOPICS = [
+    "Atomic Structure", "Periodic Table", "Chemical Bonding", "Stoichiometry", 
+    "States of Matter", "Thermodynamics", "Chemical Equilibrium", "Acids and Bases",
+    "Redox Reactions", "Electrochemistry", "Chemical Kinetics", "Organic Chemistry Basics",
+    "Hydrocarbons", "Alcohols and Ethers", "Aldehydes and Ketones", "Carboxylic Acids",
+    "Biomolecules", "Polymers", "Environmental Chemistry", "Nuclear Chemistry"
+]
+QUIZ_DIFFICULTIES = ["easy", "medium", "hard"]
+QUIZ_QUESTION_TYPES = ["mcq", "explanation", "complete_reaction", "balance_equation", "guess_product"]
+
+def is_valid_pool_question(question: QuizQuestion) -> bool:
+    """Only complete questions (and MCQs whose answer is one of the options) are pooled"""
+    if not question.question_text.strip() or not question.correct_answer.strip():
+        return False
+    if question.question_type == "mcq":
+        return bool(question.options) and len(question.options) >= 2 and question.correct_answer in question.options
+    return True
+
+# Pre-generated questions per grid cell, refilled in the background
+question_pool = QuestionPool(
+    lambda question_type, difficulty, topic: generate_question(
+        question_type, difficulty, topic, allow_fallback=False, route="quiz_pool"
+    ),
+    QUIZ_TOPICS,
+    QUIZ_DIFFICULTIES,
+    QUIZ_QUESTION_TYPES,
+    low_watermark=int(os.getenv("QUIZ_POOL_LOW_WATERMARK", "2")),
+    high_watermark=int(os.getenv("QUIZ_POOL_HIGH_WATERMARK", "5")),
+    concurrency=int(os.getenv("QUIZ_POOL_CONCURRENCY", "4")),
+    refill_interval=float(os.getenv("QUIZ_POOL_REFILL_INTERVAL_SECONDS", "30")),
+    prewarm=os.getenv("QUIZ_POOL_PREWARM", "0") == "1",
+    validate=is_valid_pool_question,
+    is_duplicate=lambda text, existing: is_duplicate_question(text, existing),
+)
+
+@app.on_event("startup")
+async def start_question_pool():
+    if os.getenv("QUIZ_POOL_ENABLED", "1") == "1":
+        question_pool.start()
+        quiz_log.info("pool_started")
+
+@app.on_event("shutdown")
+async def stop_question_pool():
+    await question_pool.stop()
+
+class QuizGenerator:
+    """Plans the (question type, topic) slots of one quiz and generates them"""
+
+    def __init__(self, config: QuizConfig):
+        import random
+        
+        self.config = config
+        
+        # Use selected topics or all topics if none selected
+        all_topics = QUIZ_TOPICS
+        
+        # Filter topics based on user selection
+        if config.topics and len(config.topics) > 0:
+            selected_topics = [t for t in config.topics if t in all_topics]
+            if not selected_topics:
+                selected_topics = all_topics
+        else:
+            selected_topics = all_topics
+        self.selected_topics = selected_topics
+        
+        # Shuffle and cycle through topics
+        topics_cycle = selected_topics.copy()
+        random.shuffle(topics_cycle)
+        
+        # Plan every slot up front so questions can be generated concurrently
+        self.slots = [
+            (random.choice(config.question_types), topics_cycle[i % len(topics_cycle)])
+            for i in range(config.num_questions)
+        ]
+        self.semaphore = asyncio.Semaphore(QUIZ_GENERATION_CONCURRENCY)
+        self.history = user_question_history.get(config.user_id) if QUIZ_CROSS_SESSION_DEDUP else None
+        self.pooled_index = SimilarityIndex(QUIZ_DUPLICATE_THRESHOLD)
     
-    session_id = str(uuid.uuid4())
+    def seen_before(self, question: QuizQuestion) -> bool:
+        # Cheap in-memory rejection, so pooled duplicates never cost an LLM retry
+        if self.history is not None and self.history.is_duplicate(question.question_text):
+            return True
+        return self.pooled_index.is_duplicate(question.question_text)
     
-    # Generate questions based on config
-    questions = []
+    async def generate_slot(self, index: int, avoid_list: List[str] = None) -> QuizQuestion:
+        question_type, topic = self.slots[index]
+        # Draw from the pre-generated pool first; generate live only if the cell is drained
+        pooled = question_pool.take(topic, self.config.difficulty, question_type, reject=self.seen_before)
+        if pooled is not None:
+            self.pooled_index.add(str(index), pooled.question_text)
+            return pooled
+        async with self.semaphore:
+            return await generate_question(question_type, self.config.difficulty, topic, avoid_list)
     
-    # Use selected topics or all topics if none selected
-    all_topics = [
-        "Atomic Structure", "Periodic Table", "Chemical Bonding", "Stoichiometry", 
-        "States of Matter", "Thermodynamics", "Chemical Equilibrium", "Acids and Bases",
-        "Redox Reactions", "Electrochemistry", "Chemical Kinetics", "Organic Chemistry Basics",
-        "Hydrocarbons", "Alcohols and Ethers", "Aldehydes and Ketones", "Carboxylic Acids",
-        "Biomolecules", "Polymers", "Environmental Chemistry", "Nuclear Chemistry"
-    ]
+    def log_created(self, session_id: str, mode: str = "eager") -> None:
+        quiz_log.info("session_created", session_id=session_id, mode=mode, questions=len(self.slots),
+                      difficulty=self.config.difficulty, topics=self.selected_topics[:3])
+
+class LazyQuizBuilder:
+    """Generates a session's questions on demand, prefetching a few ahead of the student"""
+
+    def __init__(self, session: CompactSession, generator: QuizGenerator):
+        self.session = session
+        self.generator = generator
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self.index = SimilarityIndex(QUIZ_DUPLICATE_THRESHOLD)
+        self.closed = False
     
-    # Filter topics based on user selection
-    if config.topics and len(config.topics) > 0:
-        selected_topics = [t for t in config.topics if t in all_topics]
-        if not selected_topics:
-            selected_topics = all_topics
-    else:
-        selected_topics = all_topics
+    def schedule(self, index: int) -> asyncio.Task:
+        task = self.tasks.get(index)
+        if task is None:
+            task = asyncio.create_task(self._build(index))
+            task.add_done_callback(lambda done: self._finished(index, done))
+            self.tasks[index] = task
+        return task
     
-    # Shuffle and cycle through topics
-    topics_cycle = selected_topics.copy()
-    random.shuffle(topics_cycle)
+    def _finished(self, index: int, task: asyncio.Task) -> None:
+        # A prefetch may fail before anyone awaits it; retrieve the error so asyncio does not warn
+        if not task.cancelled() and task.exception() is not None:
+            quiz_log.warning("question_prefetch_failed", session_id=self.session.session_id,
+                             question=index + 1, error=str(task.exception()))
     
-    # Keep track of generated question texts/hashes to enforce uniqueness
-    generated_questions_texts = []
+    def cancel(self) -> None:
+        """Stop generating; called when the session is evicted"""
+        self.closed = True
+        for task in self.tasks.values():
+            task.cancel()
+        self.tasks.clear()
     
-    for i in range(config.num_questions):
-        question_type = random.choice(config.question_types)
-        
-        # Select a unique topic for this question
-        topic = topics_cycle[i % len(topics_cycle)]
-        
-        # Try up to 3 times to generate a unique question
-        question = None
-        for attempt in range(3):
-            # Pass previously generated question texts to avoid
-            avoid_list = generated_questions_texts[-5:] # Keep it manageable
-            
-            if question_type == "mcq":
-                temp_q = await generate_mcq_question(config.difficulty, topic, avoid_list)
-            elif question_type == "explanation":
-                temp_q = await generate_explanation_question(config.difficulty, topic, avoid_list)
-            elif question_type == "complete_reaction":
-                temp_q = await generate_complete_reaction_question(config.difficulty, topic, avoid_list)
-            elif question_type == "balance_equation":
-                temp_q = await generate_balance_equation_question(config.difficulty, topic, avoid_list)
-            elif question_type == "guess_product":
-                temp_q = await generate_guess_product_question(config.difficulty, topic, avoid_list)
-            else:
-                temp_q = await generate_mcq_question(config.difficulty, topic, avoid_list)
-            
-            # Check uniqueness (simple fuzzy match or exact match)
-            is_duplicate = False
-            for existing_text in generated_questions_texts:
-                # Check for high similarity or exact match
-                if temp_q.question_text.lower().strip() == existing_text.lower().strip():
-                    is_duplicate = True
-                    break
-                # Basic containment check for very similar questions
-                if len(temp_q.question_text) > 10 and temp_q.question_text.lower() in existing_text.lower():
-                    is_duplicate = True
+    def prefetch(self, start: int, count: int = QUIZ_PREFETCH_AHEAD) -> None:
+        for i in range(start, min(start + count, self.session.total_questions)):
+            if self.session.questions[i] is None:
+                self.schedule(i)
+    
+    async def question(self, index: int) -> CompactQuestion:
+        """Wait for a specific question, generating it now if nobody has started it"""
+        if self.session.questions[index] is None:
+            task = self.schedule(index)
+            try:
+                # Shared with prefetch and other requests, so one client leaving must not cancel it
+                await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if not task.cancelled():
+                    raise
+                if self.closed:
+                    raise HTTPException(status_code=404, detail="Quiz session not found")
+                raise HTTPException(status_code=503, detail="Question is not available yet, please retry")
+        return self.session.questions[index]
+    
+    def _is_duplicate(self, text: str) -> bool:
+        history = self.generator.history
+        return history is not None and history.is_duplicate(text)
+    
+    async def _build(self, index: int) -> int:
+        session = self.session
+        try:
+            for attempt in range(3):
+                ready = [q.question_text for q in session.questions if q is not None]
+                question = await self.generator.generate_slot(index, ready[-5:])
+                if not self._is_duplicate(question.question_text) and \
+                        self.index.add_if_unique(str(index), question.question_text) is None:
                     break
-            
-            if not is_duplicate:
-                question = temp_q
-                break
+                quiz_log.info("duplicate_question_retry", session_id=session.session_id,
+                              question=index + 1, attempt=attempt + 1)
             else:
-                print(f"Duplicate generated, retrying ({attempt+1}/3): {temp_q.question_text[:30]}...")
+                # If still duplicate after retries, use it anyway but log it
+                quiz_log.warning("duplicate_question_kept", session_id=session.session_id, question=index + 1)
+                self.index.add(str(index), question.question_text)
+        except (Exception, asyncio.CancelledError):
+            # Let a later request retry this slot
+            if self.tasks.get(index) is asyncio.current_task():
+                del self.tasks[index]
+            raise
+        
+        question.id = index + 1
+        session.questions[index] = compact_question(question)
+        quiz_sessions.update(session)
         
-        # If still duplicate after retries, use it anyway but log it (or could fetch fallback)
-        if not question:
-            print("Warning: Could not generate unique question after retries")
-            question = temp_q
+        if all(q is not None for q in session.questions):
+            session.builder = None
+            if QUIZ_CROSS_SESSION_DEDUP:
+                user_question_history.record(session.user_id, [q.question_text for q in session.questions])
+        return index
+
+async def ensure_question(session: CompactSession, index: int) -> CompactQuestion:
+    """Return a session's question, waiting for lazy generation if it is not ready yet"""
+    question = session.questions[index]
+    if question is None and session.builder is not None:
+        try:
+            question = await session.builder.question(index)
+        except (admission.UpstreamBusy, HTTPException):
+            raise
+        except Exception as e:
+            quiz_log.error("question_generation_failed", session_id=session.session_id,
+                           question=index + 1, error=str(e))
+            raise HTTPException(status_code=503, detail="Question is not available yet, please retry")
+    return question
 
+def start_lazy_quiz(config: QuizConfig) -> CompactSession:
+    """Create a session with empty slots and start generating the first questions"""
+    import uuid
+    
+    generator = QuizGenerator(config)
+    session = CompactSession(str(uuid.uuid4()), [None] * len(generator.slots), user_id=config.user_id)
+    session.builder = LazyQuizBuilder(session, generator)
+    quiz_sessions.save(session)
+    
+    # Question 1 plus the look-ahead window start together
+    session.builder.prefetch(0, 1 + QUIZ_PREFETCH_AHEAD)
+    generator.log_created(session.session_id, mode="lazy")
+    return session
+
+@app.post("/quiz/generate")
+async def generate_quiz(config: QuizConfig, http_request: Request):
+    """Generate a new quiz with specified configuration"""
+    import uuid
+    admit(http_request, "quiz-question", units=config.num_questions)
+    
+    if config.lazy:
+        # Return as soon as question 1 exists; the rest are generated ahead of the student
+        session = start_lazy_quiz(config)
+        first_question = await ensure_question(session, 0) if session.total_questions else None
+        return {
+            "session_id": session.session_id,
+            "total_questions": session.total_questions,
+            "first_question": first_question.public_dict() if first_question else None
+        }
+    
+    session_id = str(uuid.uuid4())
+    generator = QuizGenerator(config)
+    history = generator.history
+    generate_slot = generator.generate_slot
+    
+    questions = list(await asyncio.gather(*(generate_slot(i) for i in range(len(generator.slots)))))
+    
+    # Reconciliation pass: regenerate only the questions that collide with an earlier one
+    for attempt in range(2):
+        duplicates = find_duplicate_questions([q.question_text for q in questions], history)
+        if not duplicates:
+            break
+        quiz_log.info("duplicate_questions_retry", duplicates=len(duplicates), attempt=attempt + 1)
+        unique_texts = [q.question_text for i, q in enumerate(questions) if i not in duplicates]
+        # Avoid the colliding text plus a few recent ones (keep it manageable)
+        regenerated = await asyncio.gather(*(
+            generate_slot(i, [questions[i].question_text] + unique_texts[-4:]) for i in duplicates
+        ))
+        for index, question in zip(duplicates, regenerated):
+            questions[index] = question
+    else:
+        # If still duplicate after retries, use it anyway but log it
+        if find_duplicate_questions([q.question_text for q in questions], history):
+            quiz_log.warning("duplicate_questions_kept")
+    
+    for i, question in enumerate(questions):
         question.id = i + 1
-        questions.append(question)
-        generated_questions_texts.append(question.question_text)
+    
+    if QUIZ_CROSS_SESSION_DEDUP:
+        user_question_history.record(config.user_id, [q.question_text for q in questions])
     
     # Create session
-    session = QuizSession(
-        session_id=session_id,
-        config=config,
-        questions=questions,
-        current_question_index=0,
+    session = CompactSession(
+        session_id,
+        [compact_question(q) for q in questions],
         user_id=config.user_id
     )
     
-    quiz_sessions[session_id] = session
-    
-    topics_info = f"Topics: {', '.join(selected_topics[:3])}{'...' if len(selected_topics) > 3 else ''}"
-    print(f"✓ Quiz session created: {session_id}")
-    print(f"✓ Questions: {len(questions)}, Difficulty: {config.difficulty}, {topics_info}")
+    quiz_sessions.save(session)
+    generator.log_created(session_id)
     
     return {
         "session_id": session_id,
         "total_questions": len(questions),
-        "first_question": questions[0].dict() if questions else None
+        "first_question": questions[0].dict(exclude={"option_feedback"}) if questions else None
+    }
+
+@app.post("/quiz/generate/stream")
+async def generate_quiz_stream(config: QuizConfig, http_request: Request):
+    """Create a quiz and stream its questions as NDJSON in the order they finish"""
+    admit(http_request, "quiz-question", units=config.num_questions)
+    session = start_lazy_quiz(config)
+    
+    async def stream_questions():
+        yield json.dumps({"session_id": session.session_id, "total_questions": session.total_questions}) + "\n"
+        builder = session.builder
+        if builder is not None:
+            tasks = [builder.schedule(i) for i in range(session.total_questions)]
+            for next_ready in asyncio.as_completed(tasks):
+                try:
+                    index = await next_ready
+                except asyncio.CancelledError:
+                    if not builder.closed:
+                        raise
+                    # The session was evicted mid-stream; its remaining questions will never arrive
+                    yield json.dumps({"error": True, "detail": "Quiz session not found"}) + "\n"
+                    break
+                except Exception as e:
+                    yield json.dumps({"error": True, "detail": str(e)}) + "\n"
+                    continue
+                yield json.dumps({
+                    "question_number": index + 1,
+                    "question": session.questions[index].public_dict()
+                }) + "\n"
+        yield json.dumps({"done": True}) + "\n"
+    
+    return StreamingResponse(stream_questions(), media_type="application/x-ndjson")
+
+def is_duplicate_question(text: str, existing_texts: List[str]) -> bool:
+    """Check a question text against a few earlier ones (near-duplicate or containment)"""
+    return is_near_duplicate(text, existing_texts, QUIZ_DUPLICATE_THRESHOLD)
+
+def find_duplicate_questions(texts: List[str], history: Optional[SimilarityIndex] = None) -> List[int]:
+    """Return indices of questions that duplicate an earlier question in the quiz or the user's history"""
+    index = SimilarityIndex(QUIZ_DUPLICATE_THRESHOLD)
+    duplicates = []
+    for i, text in enumerate(texts):
+        if history is not None and history.is_duplicate(text):
+            duplicates.append(i)
+        elif index.add_if_unique(str(i), text) is not None:
+            duplicates.append(i)
+    return duplicates
+
+async def generate_question(question_type: str, difficulty: str, topic: str = None, avoid_list: List[str] = None, allow_fallback: bool = True, route: str = "quiz") -> QuizQuestion:
+    """Dispatch to the generator for the given question type"""
+    if question_type == "mcq":
+        return await generate_mcq_question(difficulty, topic, avoid_list, allow_fallback, route)
+    elif question_type == "explanation":
+        return await generate_explanation_question(difficulty, topic, avoid_list, allow_fallback, route)
+    elif question_type == "complete_reaction":
+        return await generate_complete_reaction_question(difficulty, topic, avoid_list, allow_fallback, route)
+    elif question_type == "balance_equation":
+        return await generate_balance_equation_question(difficulty, topic, avoid_list, allow_fallback, route)
+    elif question_type == "guess_product":
+        return await generate_guess_product_question(difficulty, topic, avoid_list, allow_fallback, route)
+    else:
+        return await generate_mcq_question(difficulty, topic, avoid_list, allow_fallback, route)
+
+def clean_option_feedback(feedback, options: List[str], correct_answer: str) -> Optional[Dict[str, str]]:
+    """Keep feedback only for real wrong options, matched case-insensitively"""
+    if not isinstance(feedback, dict) or not options:
+        return None
+    by_key = {str(k).lower().strip(): str(v).strip() for k, v in feedback.items() if v}
+    cleaned = {
+        option: by_key[option.lower().strip()]
+        for option in options
+        if option.lower().strip() != correct_answer.lower().strip() and option.lower().strip() in by_key
     }
+    return cleaned or None
 
-async def generate_mcq_question(difficulty: str, topic: str = None, avoid_list: List[str] = None) -> QuizQuestion:
+async def generate_mcq_question(difficulty: str, topic: str = None, avoid_list: List[str] = None, allow_fallback: bool = True, route: str = "quiz") -> QuizQuestion:
     """Generate MCQ question"""
     import random
     
@@ -704,43 +1605,39 @@ async def generate_mcq_question(difficulty: str, topic: str = None, avoid_list:
     Return ONLY valid JSON (no other text).
     IMPORTANT: Ensure all strings are single-line and properly escaped. Do not use unescaped newlines.
     
+    For every WRONG option, also write 3 short, specific learning suggestions (as "- " bullet points in one string)
+    for a student who picked it, addressing the misconception behind that choice.
+    
     JSON Structure:
-    {{"question":"[question text]","options":["[option1]","[option2]","[option3]","[option4]"],"correct_answer":"[correct option]","explanation":"[detailed explanation]","topic":"{topic}"}}"""
+    {{"question":"[question text]","options":["[option1]","[option2]","[option3]","[option4]"],"correct_answer":"[correct option]","explanation":"[detailed explanation]","topic":"{topic}","option_feedback":{{"[wrong option]":"[suggestions]"}}}}"""
     
-    model = genai.GenerativeModel(GEMINI_MODEL)
-    response = model.generate_content(
-        prompt,
-        stream=False,
-        generation_config=genai.types.GenerationConfig(
+    try:
+        response_text = await llm.generate(
+            prompt,
+            route=route,
             temperature=0.7,
             max_output_tokens=2000,
             response_mime_type="application/json"
         )
-    )
-    
-    try:
-        text = response.text.strip()
-        # Clean up markdown code blocks if present
-        if text.startswith("```json"):
-            text = text[7:]
-        if text.startswith("```"):
-            text = text[3:]
-        if text.endswith("```"):
-            text = text[:-3]
-        text = text.strip()
-        
-        data = json.loads(text)
+        parsed = parse_model(response_text, GeneratedMCQ, "quiz:mcq")
         return QuizQuestion(
             id=0,
-            question_text=data.get("question", ""),
+            question_text=parsed.question,
             question_type="mcq",
-            options=data.get("options", []),
-            correct_answer=data.get("correct_answer", ""),
-            explanation=data.get("explanation", ""),
-            topic=data.get("topic", topic)
+            options=parsed.options,
+            correct_answer=parsed.correct_answer,
+            explanation=parsed.explanation,
+            topic=parsed.topic or topic,
+            option_feedback=clean_option_feedback(parsed.option_feedback, parsed.options, parsed.correct_answer)
         )
+    except admission.UpstreamBusy:
+        # Overload is reported to the client, not papered over with a canned question
+        raise
     except Exception as e:
-        print(f"Error generating MCQ: {e}")
+        quiz_log.warning("question_llm_failed", question_type="mcq", error=str(e))
+        if not allow_fallback:
+            raise
+        FALLBACKS.inc("quiz_question")
         # Fallback with random variation to avoid exact duplicates
         fallback_questions = [
             {
@@ -783,7 +1680,7 @@ async def generate_mcq_question(difficulty: str, topic: str = None, avoid_list:
             topic=q["top"]
         )
 
-async def generate_explanation_question(difficulty: str, topic: str = None, avoid_list: List[str] = None) -> QuizQuestion:
+async def generate_explanation_question(difficulty: str, topic: str = None, avoid_list: List[str] = None, allow_fallback: bool = True, route: str = "quiz") -> QuizQuestion:
     """Generate explanation question"""
     import random
     
@@ -805,39 +1702,30 @@ async def generate_explanation_question(difficulty: str, topic: str = None, avoi
     JSON Structure:
     {{"question":"[question text]","correct_answer":"[expected answer]","explanation":"[detailed explanation]","topic":"{topic}"}}"""
     
-    model = genai.GenerativeModel(GEMINI_MODEL)
-    response = model.generate_content(
-        prompt,
-        stream=False,
-        generation_config=genai.types.GenerationConfig(
+    try:
+        response_text = await llm.generate(
+            prompt,
+            route=route,
             temperature=0.7,
             max_output_tokens=1000,
             response_mime_type="application/json"
         )
-    )
-    
-    try:
-        text = response.text.strip()
-        # Clean up markdown code blocks if present
-        if text.startswith("```json"):
-            text = text[7:]
-        if text.startswith("```"):
-            text = text[3:]
-        if text.endswith("```"):
-            text = text[:-3]
-        text = text.strip()
-
-        data = json.loads(text)
+        parsed = parse_model(response_text, GeneratedQuestion, "quiz:explanation")
         return QuizQuestion(
             id=0,
-            question_text=data.get("question", ""),
+            question_text=parsed.question,
             question_type="explanation",
-            correct_answer=data.get("correct_answer", ""),
-            explanation=data.get("explanation", ""),
-            topic=data.get("topic", topic)
+            correct_answer=parsed.correct_answer,
+            explanation=parsed.explanation,
+            topic=parsed.topic or topic
         )
+    except admission.UpstreamBusy:
+        raise
     except Exception as e:
-        print(f"Error generating explanation question: {e}")
+        quiz_log.warning("question_llm_failed", question_type="explanation", error=str(e))
+        if not allow_fallback:
+            raise
+        FALLBACKS.inc("quiz_question")
         return QuizQuestion(
             id=0,
             question_text=f"Explain the concept of {topic} in detail.",
@@ -847,7 +1735,7 @@ async def generate_explanation_question(difficulty: str, topic: str = None, avoi
             topic=topic
         )
 
-async def generate_complete_reaction_question(difficulty: str, topic: str = None, avoid_list: List[str] = None) -> QuizQuestion:
+async def generate_complete_reaction_question(difficulty: str, topic: str = None, avoid_list: List[str] = None, allow_fallback: bool = True, route: str = "quiz") -> QuizQuestion:
     """Generate complete the reaction question"""
     import random
     
@@ -869,39 +1757,30 @@ async def generate_complete_reaction_question(difficulty: str, topic: str = None
     JSON Structure:
     {{"question":"[incomplete reaction equation]","correct_answer":"[complete equation]","explanation":"[explanation of the reaction]","topic":"{topic}"}}"""
     
-    model = genai.GenerativeModel(GEMINI_MODEL)
-    response = model.generate_content(
-        prompt,
-        stream=False,
-        generation_config=genai.types.GenerationConfig(
+    try:
+        response_text = await llm.generate(
+            prompt,
+            route=route,
             temperature=0.7,
             max_output_tokens=1000,
             response_mime_type="application/json"
         )
-    )
-    
-    try:
-        text = response.text.strip()
-        # Clean up markdown code blocks if present
-        if text.startswith("```json"):
-            text = text[7:]
-        if text.startswith("```"):
-            text = text[3:]
-        if text.endswith("```"):
-            text = text[:-3]
-        text = text.strip()
-
-        data = json.loads(text)
+        parsed = parse_model(response_text, GeneratedQuestion, "quiz:complete_reaction")
         return QuizQuestion(
             id=0,
-            question_text=data.get("question", ""),
+            question_text=parsed.question,
             question_type="complete_reaction",
-            correct_answer=data.get("correct_answer", ""),
-            explanation=data.get("explanation", ""),
-            topic=data.get("topic", topic)
+            correct_answer=parsed.correct_answer,
+            explanation=parsed.explanation,
+            topic=parsed.topic or topic
         )
+    except admission.UpstreamBusy:
+        raise
     except Exception as e:
-        print(f"Error generating complete reaction question: {e}")
+        quiz_log.warning("question_llm_failed", question_type="complete_reaction", error=str(e))
+        if not allow_fallback:
+            raise
+        FALLBACKS.inc("quiz_question")
         return QuizQuestion(
             id=0,
             question_text=f"Complete the reaction for {topic}...",
@@ -911,7 +1790,7 @@ async def generate_complete_reaction_question(difficulty: str, topic: str = None
             topic=topic
         )
 
-async def generate_balance_equation_question(difficulty: str, topic: str = None, avoid_list: List[str] = None) -> QuizQuestion:
+async def generate_balance_equation_question(difficulty: str, topic: str = None, avoid_list: List[str] = None, allow_fallback: bool = True, route: str = "quiz") -> QuizQuestion:
     """Generate balance equation question"""
     import random
     
@@ -933,39 +1812,30 @@ async def generate_balance_equation_question(difficulty: str, topic: str = None,
     JSON Structure:
     {{"question":"[unbalanced equation]","correct_answer":"[balanced equation]","explanation":"[explanation of balancing]","topic":"{topic}"}}"""
     
-    model = genai.GenerativeModel(GEMINI_MODEL)
-    response = model.generate_content(
-        prompt,
-        stream=False,
-        generation_config=genai.types.GenerationConfig(
+    try:
+        response_text = await llm.generate(
+            prompt,
+            route=route,
             temperature=0.7,
             max_output_tokens=1000,
             response_mime_type="application/json"
         )
-    )
-    
-    try:
-        text = response.text.strip()
-        # Clean up markdown code blocks if present
-        if text.startswith("```json"):
-            text = text[7:]
-        if text.startswith("```"):
-            text = text[3:]
-        if text.endswith("```"):
-            text = text[:-3]
-        text = text.strip()
-
-        data = json.loads(text)
+        parsed = parse_model(response_text, GeneratedQuestion, "quiz:balance_equation")
         return QuizQuestion(
             id=0,
-            question_text=data.get("question", ""),
+            question_text=parsed.question,
             question_type="balance_equation",
-            correct_answer=data.get("correct_answer", ""),
-            explanation=data.get("explanation", ""),
-            topic=data.get("topic", topic)
+            correct_answer=parsed.correct_answer,
+            explanation=parsed.explanation,
+            topic=parsed.topic or topic
         )
+    except admission.UpstreamBusy:
+        raise
     except Exception as e:
-        print(f"Error generating balance equation question: {e}")
+        quiz_log.warning("question_llm_failed", question_type="balance_equation", error=str(e))
+        if not allow_fallback:
+            raise
+        FALLBACKS.inc("quiz_question")
         return QuizQuestion(
             id=0,
             question_text=f"Balance the equation for {topic}",
@@ -975,7 +1845,7 @@ async def generate_balance_equation_question(difficulty: str, topic: str = None,
             topic=topic
         )
 
-async def generate_guess_product_question(difficulty: str, topic: str = None, avoid_list: List[str] = None) -> QuizQuestion:
+async def generate_guess_product_question(difficulty: str, topic: str = None, avoid_list: List[str] = None, allow_fallback: bool = True, route: str = "quiz") -> QuizQuestion:
     """Generate guess the product question"""
     import random
     
@@ -997,39 +1867,30 @@ async def generate_guess_product_question(difficulty: str, topic: str = None, av
     JSON Structure:
     {{"question":"[reactants given]","correct_answer":"[product]","explanation":"[explanation of the reaction]","topic":"{topic}"}}"""
     
-    model = genai.GenerativeModel(GEMINI_MODEL)
-    response = model.generate_content(
-        prompt,
-        stream=False,
-        generation_config=genai.types.GenerationConfig(
+    try:
+        response_text = await llm.generate(
+            prompt,
+            route=route,
             temperature=0.7,
             max_output_tokens=1000,
             response_mime_type="application/json"
         )
-    )
-    
-    try:
-        text = response.text.strip()
-        # Clean up markdown code blocks if present
-        if text.startswith("```json"):
-            text = text[7:]
-        if text.startswith("```"):
-            text = text[3:]
-        if text.endswith("```"):
-            text = text[:-3]
-        text = text.strip()
-
-        data = json.loads(text)
+        parsed = parse_model(response_text, GeneratedQuestion, "quiz:guess_product")
         return QuizQuestion(
             id=0,
-            question_text=data.get("question", ""),
+            question_text=parsed.question,
             question_type="guess_product",
-            correct_answer=data.get("correct_answer", ""),
-            explanation=data.get("explanation", ""),
-            topic=data.get("topic", topic)
+            correct_answer=parsed.correct_answer,
+            explanation=parsed.explanation,
+            topic=parsed.topic or topic
         )
+    except admission.UpstreamBusy:
+        raise
     except Exception as e:
-        print(f"Error generating guess product question: {e}")
+        quiz_log.warning("question_llm_failed", question_type="guess_product", error=str(e))
+        if not allow_fallback:
+            raise
+        FALLBACKS.inc("quiz_question")
         return QuizQuestion(
             id=0,
             question_text=f"What is the product of this {topic} reaction?",
@@ -1039,80 +1900,223 @@ async def generate_guess_product_question(difficulty: str, topic: str = None, av
             topic=topic
         )
 
+SUGGESTIONS_PROMPT_TEMPLATE = """The user answered incorrectly to this chemistry question:
+Question: {question}
+User's answer: {user_answer}
+Correct answer: {correct_answer}
+Topic: {topic}
+
+Provide 3 short, specific learning suggestions (bullet points) to help them understand this topic better. 
+Do not include any introductory text like "Here are suggestions". Start directly with the first suggestion."""
+
+async def generate_suggestions(question: CompactQuestion, user_answer: str) -> str:
+    """Live LLM suggestions for a wrong answer that has no precomputed feedback"""
+    prompt = SUGGESTIONS_PROMPT_TEMPLATE.format(
+        question=question.question_text,
+        user_answer=user_answer,
+        correct_answer=question.correct_answer,
+        topic=question.topic
+    )
+    return (await llm.generate(
+        prompt,
+        route="suggestions",
+        temperature=0.7,
+        max_output_tokens=300,
+    )).strip()
+
+# Wrong answers per batched suggestions prompt, and how many prompts/calls run at once
+SUGGESTION_BATCH_SIZE = int(os.getenv("SUGGESTION_BATCH_SIZE", "10"))
+SUGGESTION_CONCURRENCY = int(os.getenv("SUGGESTION_CONCURRENCY", "8"))
+
+SUGGESTIONS_BATCH_PROMPT_TEMPLATE = """A student answered these chemistry quiz questions incorrectly:
+{items}
+
+For EACH question, provide 3 short, specific learning suggestions (bullet points starting with "- ", in one string)
+to help them understand that topic better. Start directly with the first suggestion.
+
+Return ONLY valid JSON (no other text):
+{{"suggestions":[{{"question_id":1,"suggestions":"- ...\\n- ...\\n- ..."}}]}}"""
+
+async def _batched_suggestions(items: List[tuple]) -> Dict[int, str]:
+    described = "\n".join(
+        json.dumps({
+            "question_id": question_id,
+            "question": question.question_text,
+            "user_answer": user_answer,
+            "correct_answer": question.correct_answer,
+            "topic": question.topic,
+        })
+        for question_id, question, user_answer in items
+    )
+    response_text = await llm.generate(
+        SUGGESTIONS_BATCH_PROMPT_TEMPLATE.format(items=described),
+        route="suggestions",
+        temperature=0.7,
+        max_output_tokens=min(300 * len(items), 8192),
+        response_mime_type="application/json"
+    )
+    # A truncated batch is repaired locally; entries it lost are generated singly
+    batch = parse_model(response_text, SuggestionBatch, "finish-suggestions")
+    wanted = {question_id for question_id, _, _ in items}
+    results = {}
+    for entry in batch.suggestions:
+        suggestions = entry.suggestions.strip()
+        if entry.question_id in wanted and suggestions:
+            results[entry.question_id] = suggestions
+    return results
+
+async def generate_suggestions_batch(items: List[tuple]) -> Dict[int, str]:
+    """Suggestions for several wrong answers, keyed by question_id.
+
+    ``items`` are (question_id, question, user_answer). Answers are grouped into
+    batched structured prompts that run concurrently; anything a batch drops or
+    garbles is generated individually, still under the same concurrency bound.
+    """
+    if not items:
+        return {}
+    semaphore = asyncio.Semaphore(SUGGESTION_CONCURRENCY)
+    results: Dict[int, str] = {}
+    
+    async def run_batch(batch: List[tuple]) -> None:
+        async with semaphore:
+            try:
+                results.update(await _batched_suggestions(batch))
+            except admission.UpstreamBusy:
+                raise
+            except Exception as e:
+                quiz_log.warning("suggestions_batch_failed", answers=len(batch), error=str(e))
+    
+    async def run_single(question_id: int, question: CompactQuestion, user_answer: str) -> None:
+        async with semaphore:
+            try:
+                results[question_id] = await generate_suggestions(question, user_answer)
+            except admission.UpstreamBusy:
+                raise
+            except Exception as e:
+                quiz_log.warning("suggestions_failed", question_id=question_id, error=str(e))
+                FALLBACKS.inc("suggestions")
+                results[question_id] = "Review the topic materials."
+    
+    if len(items) > 1:
+        batches = [items[i:i + SUGGESTION_BATCH_SIZE] for i in range(0, len(items), SUGGESTION_BATCH_SIZE)]
+        await asyncio.gather(*(run_batch(batch) for batch in batches))
+    await asyncio.gather(*(run_single(*item) for item in items if item[0] not in results))
+    return results
+
+# In-flight background suggestion jobs, keyed by (session_id, question_id, user_answer)
+pending_suggestions: Dict[tuple, asyncio.Task] = {}
+
+def schedule_suggestions(session: CompactSession, question: CompactQuestion, answer: UserAnswer) -> asyncio.Task:
+    """Generate suggestions off the request path and store them on the session when ready"""
+    key = (session.session_id, answer.question_id, answer.user_answer)
+    
+    async def run() -> str:
+        try:
+            suggestions = await generate_suggestions(question, answer.user_answer)
+        except admission.UpstreamBusy:
+            # Left empty, so finishing the quiz generates them live instead of storing a canned line
+            return ""
+        except Exception as e:
+            quiz_log.warning("suggestions_failed", question_id=answer.question_id, error=str(e))
+            FALLBACKS.inc("suggestions")
+            suggestions = "Review the topic in your textbook."
+        # Only fill in the answer this job was started for; a resubmission replaces the job
+        stored = session.answers.get(answer.question_id)
+        if stored is not None and stored.user_answer == answer.user_answer:
+            session.record_answer(answer.question_id, stored.user_answer, stored.time_taken, suggestions)
+            quiz_sessions.update(session)
+        return suggestions
+    
+    task = asyncio.create_task(run())
+    pending_suggestions[key] = task
+    task.add_done_callback(lambda done: pending_suggestions.pop(key, None) if pending_suggestions.get(key) is done else None)
+    return task
+
+async def stored_suggestions(session: CompactSession, question_id: int) -> str:
+    """Suggestions recorded for an answer, waiting for a background job if one is running"""
+    answer = session.answers.get(question_id)
+    if answer is None:
+        return ""
+    task = pending_suggestions.get((session.session_id, question_id, answer.user_answer))
+    if task is not None:
+        await asyncio.shield(task)
+        answer = session.answers.get(question_id)
+    return (answer.suggestions or "") if answer else ""
+
 @app.get("/quiz/session/{session_id}/question/{question_index}")
 async def get_question(session_id: str, question_index: int):
     """Get a specific question from the quiz"""
-    if session_id not in quiz_sessions:
+    session = quiz_sessions.get(session_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Quiz session not found")
     
-    session = quiz_sessions[session_id]
-    if question_index < 0 or question_index >= len(session.questions):
+    if question_index < 0 or question_index >= session.total_questions:
         raise HTTPException(status_code=400, detail="Invalid question index")
     
-    question = session.questions[question_index]
+    question = await ensure_question(session, question_index)
     session.current_question_index = question_index
+    if session.builder is not None:
+        session.builder.prefetch(question_index + 1)
     
     # Get existing answer if any
     user_answer = None
-    if question.id in session.user_answers:
-        user_answer = session.user_answers[question.id].user_answer
+    if question.id in session.answers:
+        user_answer = session.answers[question.id].user_answer
 
     return {
         "question_number": question_index + 1,
-        "total_questions": len(session.questions),
-        "question": question.dict(),
+        "total_questions": session.total_questions,
+        "question": question.public_dict(),
         "user_answer": user_answer,
         "can_go_back": question_index > 0,
-        "can_go_forward": question_index < len(session.questions) - 1
+        "can_go_forward": question_index < session.total_questions - 1
     }
 
 @app.post("/quiz/session/{session_id}/submit-answer")
-async def submit_answer(session_id: str, answer: UserAnswer):
+async def submit_answer(session_id: str, answer: UserAnswer, http_request: Request):
     """Submit an answer and get feedback"""
-    if session_id not in quiz_sessions:
+    session = quiz_sessions.get(session_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Quiz session not found")
     
-    session = quiz_sessions[session_id]
-    if answer.question_id < 1 or answer.question_id > len(session.questions):
+    if answer.question_id < 1 or answer.question_id > session.total_questions:
         raise HTTPException(status_code=400, detail="Invalid question ID")
     
-    question = session.questions[answer.question_id - 1]
+    question = await ensure_question(session, answer.question_id - 1)
     
     # Check if answer is correct - normalize both strings
     user_ans = answer.user_answer.lower().strip()
     correct_ans = question.correct_answer.lower().strip()
     is_correct = user_ans == correct_ans
     
-    # Generate suggestions if wrong
+    # MCQ distractors carry feedback generated with the question; no LLM call on this path
     suggestions = ""
+    suggestions_pending = False
     if not is_correct:
-        prompt = f"""The user answered incorrectly to this chemistry question:
-Question: {question.question_text}
-User's answer: {answer.user_answer}
-Correct answer: {question.correct_answer}
-Topic: {question.topic}
-
-Provide 3 short, specific learning suggestions (bullet points) to help them understand this topic better. 
-Do not include any introductory text like "Here are suggestions". Start directly with the first suggestion."""
-        
-        try:
-            model = genai.GenerativeModel(GEMINI_MODEL)
-            response = model.generate_content(
-                prompt,
-                stream=False,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0.7,
-                    max_output_tokens=300,
-                )
-            )
-            suggestions = response.text.strip()
-        except Exception as e:
-            print(f"Error generating suggestions: {e}")
-            suggestions = "Review the topic in your textbook."
+        suggestions = question.feedback_for(answer.user_answer) or ""
+        previous = session.answers.get(answer.question_id)
+        if not suggestions and previous is not None and previous.user_answer == answer.user_answer:
+            # Resubmitting the same answer keeps what was already generated for it
+            suggestions = previous.suggestions or ""
 
     # Update answer with suggestions and store in session
     answer.suggestions = suggestions
-    session.user_answers[answer.question_id] = answer
+    session.record_answer(answer.question_id, answer.user_answer, answer.time_taken, suggestions or None)
+    quiz_sessions.save(session)
+    
+    if not is_correct and not suggestions:
+        # Free-text answers: generate in the background, fetch via GET .../suggestions/{question_id}
+        if (session.session_id, answer.question_id, answer.user_answer) in pending_suggestions:
+            suggestions_pending = True
+        else:
+            try:
+                admit(http_request, "quiz-suggestions")
+                schedule_suggestions(session, question, answer)
+                suggestions_pending = True
+            except HTTPException as e:
+                # Over the limit: finishing the quiz generates (and charges for) them instead
+                quiz_log.info("suggestions_deferred", session_id=session.session_id,
+                              question_id=answer.question_id, status=e.status_code)
     
     result = QuizResult(
         question_id=answer.question_id,
@@ -1124,30 +2128,47 @@ Do not include any introductory text like "Here are suggestions". Start directly
         explanation=question.explanation,
         topic=question.topic,
         time_taken=answer.time_taken,
-        suggestions=suggestions
+        suggestions=suggestions,
+        suggestions_pending=suggestions_pending
     )
     
     return result.dict()
 
+@app.get("/quiz/session/{session_id}/suggestions/{question_id}")
+async def get_suggestions(session_id: str, question_id: int):
+    """Suggestions for a submitted answer, waiting for background generation if needed"""
+    session = quiz_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Quiz session not found")
+    
+    if question_id not in session.answers:
+        raise HTTPException(status_code=404, detail="No answer submitted for this question")
+    
+    return {
+        "question_id": question_id,
+        "suggestions": await stored_suggestions(session, question_id)
+    }
+
 @app.post("/quiz/session/{session_id}/finish")
-async def finish_quiz(session_id: str, answers: List[UserAnswer]):
+async def finish_quiz(session_id: str, answers: List[UserAnswer], http_request: Request):
     """Finish quiz and get comprehensive results"""
-    if session_id not in quiz_sessions:
+    session = quiz_sessions.get(session_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Quiz session not found")
     
-    session = quiz_sessions[session_id]
     if session.completed:
         raise HTTPException(status_code=400, detail="Quiz already completed")
         
     results = []
     correct_count = 0
     total_time = 0
+    graded = []
     
     for answer in answers:
-        if answer.question_id < 1 or answer.question_id > len(session.questions):
+        if answer.question_id < 1 or answer.question_id > session.total_questions:
             continue
             
-        question = session.questions[answer.question_id - 1]
+        question = await ensure_question(session, answer.question_id - 1)
         
         # Normalize and compare answers
         user_ans = answer.user_answer.lower().strip()
@@ -1158,40 +2179,35 @@ async def finish_quiz(session_id: str, answers: List[UserAnswer]):
             correct_count += 1
         
         total_time += answer.time_taken
-        
-        # Get suggestions from existing session data or client data, or generate if missing
-        suggestions = answer.suggestions or ""
-        
-        # Check if we already have it in session (from submit-answer)
-        if not suggestions and answer.question_id in session.user_answers:
-             suggestions = session.user_answers[answer.question_id].suggestions or ""
-             
-        # Generate if still missing and incorrect
+        graded.append((answer, question, is_correct))
+    
+    # Get suggestions from client data or existing session data (from submit-answer,
+    # possibly still generating in the background); wait for those jobs together
+    known = [answer.suggestions or "" for answer, _, _ in graded]
+    stored = [
+        i for i, (answer, _, _) in enumerate(graded)
+        if not answer.suggestions and answer.question_id in session.answers
+    ]
+    for i, suggestions in zip(stored, await asyncio.gather(*(
+        stored_suggestions(session, graded[i][0].question_id) for i in stored
+    ))):
+        known[i] = suggestions
+    suggestions_by_id = {}
+    missing = []
+    for (answer, question, is_correct), suggestions in zip(graded, known):
+        # Precomputed MCQ feedback for the chosen option
         if not is_correct and not suggestions:
-            try:
-                prompt = f"""The user answered incorrectly to this chemistry question:
-Question: {question.question_text}
-User's answer: {answer.user_answer}
-Correct answer: {question.correct_answer}
-Topic: {question.topic}
-
-Provide 3 short, specific learning suggestions (bullet points) to help them understand this topic better. 
-Do not include any introductory text like "Here are suggestions". Start directly with the first suggestion."""
-                
-                model = genai.GenerativeModel(GEMINI_MODEL)
-                response = model.generate_content(
-                    prompt,
-                    stream=False,
-                    generation_config=genai.types.GenerationConfig(
-                        temperature=0.7,
-                        max_output_tokens=300,
-                    )
-                )
-                suggestions = response.text.strip()
-            except Exception as e:
-                print(f"Error generating suggestions in finish: {e}")
-                suggestions = "Review the topic materials."
-        
+            suggestions = question.feedback_for(answer.user_answer) or ""
+        if not is_correct and not suggestions:
+            missing.append((answer.question_id, question, answer.user_answer))
+        suggestions_by_id[answer.question_id] = suggestions
+    if missing:
+        admit(http_request, "quiz-suggestions", units=len(missing))
+    
+    # Generate everything still missing in one round trip instead of one call per answer
+    suggestions_by_id.update(await generate_suggestions_batch(missing))
+    
+    for answer, question, is_correct in graded:
         result = QuizResult(
             question_id=answer.question_id,
             question_text=question.question_text,
@@ -1202,13 +2218,13 @@ Do not include any introductory text like "Here are suggestions". Start directly
             explanation=question.explanation,
             topic=question.topic,
             time_taken=answer.time_taken,
-            suggestions=suggestions
+            suggestions=suggestions_by_id.get(answer.question_id, "")
         )
         results.append(result.dict())
     
-    # Clean up session
-    # del quiz_sessions[session_id]
+    # Completed sessions are kept briefly (shorter TTL) so a repeated finish still gets a 400
     session.completed = True
+    quiz_sessions.save(session)
     
     score_percentage = (correct_count / len(answers)) * 100 if answers else 0
     
@@ -0,0 +1,221 @@
+"""
+Prometheus-format metrics without external dependencies
+Counters and histograms are plain dict updates on the event loop thread, so
+recording a sample costs a dict lookup and a bisect; gauges for cache and
+session sizes are computed only when /metrics is scraped.
+"""
+import bisect
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+Labels = Tuple[str, ...]
+
+# Seconds; covers cache hits (ms) through long LLM generations (tens of seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)
+RATE_BUCKETS = (5, 10, 20, 40, 60, 80, 120, 160, 240, 400)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        super().__init__(name, help_text, label_names)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _samples(self) -> Iterable[str]:
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [bucket counts..., +Inf count], sum
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = ([0] * (len(self.buckets) + 1), [0.0])
+            self._values[labels] = entry
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1][0] += value
+
+    def _samples(self) -> Iterable[str]:
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.label_names, labels)} {_format_value(total[0])}"
+            yield f"{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}"
+
+
+class Gauge(_Metric):
+    """Value computed at scrape time; ``collect`` returns a number or {labels: number}"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, collect: Callable[[], Any], label_names: Sequence[str] = ()):
+        super().__init__(name, help_text, label_names)
+        self.collect = collect
+
+    def _samples(self) -> Iterable[str]:
+        value = self.collect()
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for labels, sample in items:
+            if sample is None:
+                continue
+            labels = labels if isinstance(labels, tuple) else (labels,)
+            yield f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(sample)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help_text, label_names))
+
+    def histogram(self, name: str, help_text: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, label_names, buckets))
+
+    def gauge(self, name: str, help_text: str, collect: Callable[[], Any], label_names: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help_text, collect, label_names))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # One broken collector must not take down the whole scrape
+                lines.append(f"# {metric.name} unavailable: {_escape(str(e))}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency until the last body byte, by route template",
+    ("method", "route", "status"),
+)
+LLM_REQUEST_SECONDS = registry.histogram(
+    "llm_request_duration_seconds", "Upstream LLM call duration", ("provider", "route", "mode", "outcome"),
+)
+LLM_TTFT_SECONDS = registry.histogram(
+    "llm_time_to_first_token_seconds", "Time to the first streamed chunk", ("provider", "route"),
+)
+LLM_STREAM_TOKENS_PER_SECOND = registry.histogram(
+    "llm_stream_tokens_per_second", "Output token rate of streams after the first chunk", ("provider", "route"),
+    buckets=RATE_BUCKETS,
+)
+LLM_TOKENS = registry.counter(
+    "llm_tokens_total", "Prompt and output tokens from response usage metadata", ("provider", "route", "kind"),
+)
+LLM_FAILOVERS = registry.counter(
+    "llm_failovers_total", "Calls retried on the next provider of a route", ("route", "from_provider"),
+)
+RETRIES = registry.counter(
+    "llm_retries_total", "Whole-call retries made by an endpoint after an unusable response", ("endpoint",),
+)
+FALLBACKS = registry.counter(
+    "fallback_responses_total", "Canned responses served instead of model output", ("kind",),
+)
+
+
+class ASGIMetricsMiddleware:
+    """Times every HTTP request until its final body chunk (so streams count in full)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                self._observe(scope, status["code"], started)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            self._observe(scope, 500, started)
+            raise
+
+    @staticmethod
+    def _observe(scope, status: int, started: float) -> None:
+        # Route templates (/quiz/session/{session_id}/...) keep label cardinality bounded
+        route = getattr(scope.get("route"), "path", None) or "unmatched"
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, scope["method"], route, str(status))
+
+
+def observe_llm_call(provider: str, route: str, mode: str, ok: bool, duration: float,
+                     ttft: Optional[float] = None, usage: Optional[Tuple[int, int]] = None) -> None:
+    LLM_REQUEST_SECONDS.observe(duration, provider, route, mode, "ok" if ok else "error")
+    if ttft is not None:
+        LLM_TTFT_SECONDS.observe(ttft, provider, route)
+    if usage is not None:
+        prompt_tokens, output_tokens = usage
+        if prompt_tokens:
+            LLM_TOKENS.inc(provider, route, "prompt", amount=prompt_tokens)
+        if output_tokens:
+            LLM_TOKENS.inc(provider, route, "output", amount=output_tokens)
+            if ttft is not None and duration > ttft:
+                LLM_STREAM_TOKENS_PER_SECOND.observe(output_tokens / (duration - ttft), provider, route)
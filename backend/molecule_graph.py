@@ -0,0 +1,216 @@
+"""
+Canonical hashing of molecule graphs
+Builds a key that depends only on elements, connectivity and bond types, so the
+same molecule drawn with different atom IDs, coordinates or list order maps to
+the same cache entry.
+"""
+import hashlib
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def _digest(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()[:16]
+
+
+def normalize_element(element: str) -> str:
+    """'cl', 'CL' and ' Cl ' all become 'Cl'"""
+    element = element.strip()
+    return element[:1].upper() + element[1:].lower()
+
+
+def normalize_bond_type(bond_type: str) -> str:
+    return bond_type.strip().lower()
+
+
+# Larger graphs get a cheap key in input order instead (a cache miss per drawing, never a wrong hit)
+MAX_CANONICAL_ATOMS = 200
+# Atoms and bonds visited per connected component (roughly 50 ms) before
+# settling for the best labelling found so far
+CANONICAL_SEARCH_BUDGET = 100_000
+# Automorphisms kept for orbit pruning; each one costs a pass per branch
+MAX_STORED_AUTOMORPHISMS = 32
+
+_Graph = Tuple[List[str], List[List[Tuple[str, int]]]]  # elements, adjacency as (bond_type, atom)
+
+
+def _refine(graph: _Graph, colors: List[int]) -> Tuple[List[int], int]:
+    """Equitable refinement: split colour classes by neighbour colours until stable.
+
+    Colours are ranks of label-free signatures, so the result does not depend
+    on atom order. Also returns the work done, in atoms and bonds visited.
+    """
+    _, adjacency = graph
+    count = len(set(colors))
+    size = len(colors) + sum(len(neighbours) for neighbours in adjacency)
+    work = 0
+    while True:
+        work += size
+        signatures = [
+            (colors[v], tuple(sorted((bond_type, colors[u]) for bond_type, u in adjacency[v])))
+            for v in range(len(colors))
+        ]
+        ranks = {signature: rank for rank, signature in enumerate(sorted(set(signatures)))}
+        colors = [ranks[signature] for signature in signatures]
+        if len(ranks) == count:
+            return colors, work
+        count = len(ranks)
+
+
+def _individualize(colors: List[int], atom: int) -> List[int]:
+    # ``atom`` goes first in its class; every other class keeps its relative order
+    return [2 * c + (0 if v == atom else 1) for v, c in enumerate(colors)]
+
+
+def _certificate(graph: _Graph, order: List[int]) -> tuple:
+    """The graph written out with its atoms in ``order``"""
+    elements, adjacency = graph
+    position = {v: rank for rank, v in enumerate(order)}
+    edges = sorted(
+        (position[v], position[u], bond_type)
+        for v in order for bond_type, u in adjacency[v]
+        if position[v] <= position[u]
+    )
+    return tuple(elements[v] for v in order), tuple(edges)
+
+
+def _orbits(automorphisms: List[List[int]], fixed: List[int], size: int) -> List[int]:
+    """Orbit representative of each atom under the automorphisms that fix ``fixed``"""
+    parent = list(range(size))
+
+    def find(v: int) -> int:
+        while parent[v] != v:
+            parent[v] = parent[parent[v]]
+            v = parent[v]
+        return v
+
+    for mapping in automorphisms:
+        if all(mapping[v] == v for v in fixed):
+            for v, image in enumerate(mapping):
+                parent[find(v)] = find(image)
+    return [find(v) for v in range(size)]
+
+
+def _canonical_certificate(graph: _Graph) -> tuple:
+    """Smallest certificate over the individualization-refinement search tree.
+
+    Equal certificates mean isomorphic graphs, and vice versa. Leaves with the
+    best certificate so far give automorphisms, and branches in the same orbit
+    as one already explored are skipped, as are atoms with the same element and
+    neighbours as one already tried (e.g. the hydrogens of a methyl group).
+    """
+    elements, adjacency = graph
+    size = len(elements)
+    twin_key = [(elements[v], tuple(sorted(adjacency[v]))) for v in range(size)]
+    initial = sorted(set(elements))
+    best: Optional[tuple] = None
+    best_order: List[int] = []
+    automorphisms: List[List[int]] = []
+    budget = CANONICAL_SEARCH_BUDGET
+
+    def search(refined: Tuple[List[int], int], path: List[int]) -> None:
+        nonlocal best, best_order, budget
+        colors, work = refined
+        budget -= work
+        classes: Dict[int, List[int]] = defaultdict(list)
+        for v, c in enumerate(colors):
+            classes[c].append(v)
+        target = min((c for c, members in classes.items() if len(members) > 1), default=None)
+        if target is None:
+            budget -= work
+            order = sorted(range(size), key=colors.__getitem__)
+            certificate = _certificate(graph, order)
+            if best is None or certificate < best:
+                best, best_order = certificate, order
+            elif certificate == best and len(automorphisms) < MAX_STORED_AUTOMORPHISMS:
+                mapping = [0] * size
+                for a, b in zip(best_order, order):
+                    mapping[a] = b
+                automorphisms.append(mapping)
+            return
+        tried_twins = set()
+        tried_orbits = set()
+        orbit, known = list(range(size)), 0
+        for v in classes[target]:
+            if budget <= 0 and best is not None:
+                # Still a faithful labelling of this graph, so equal hashes still mean
+                # equal molecules; only another drawing of it may hash differently
+                return
+            if twin_key[v] in tried_twins:
+                continue
+            if known < len(automorphisms):
+                orbit, known = _orbits(automorphisms, path, size), len(automorphisms)
+                budget -= known * size
+            if any(orbit[v] == orbit[u] for u in tried_orbits):
+                continue
+            tried_twins.add(twin_key[v])
+            tried_orbits.add(v)
+            search(_refine(graph, _individualize(colors, v)), path + [v])
+
+    if size:
+        search(_refine(graph, [initial.index(element) for element in elements]), [])
+    return best if best is not None else ((), ())
+
+
+def _components(graph: _Graph) -> List[_Graph]:
+    """Connected components, each renumbered from 0"""
+    elements, adjacency = graph
+    seen = [False] * len(elements)
+    components = []
+    for root in range(len(elements)):
+        if seen[root]:
+            continue
+        seen[root] = True
+        members = [root]
+        for v in members:
+            for _, u in adjacency[v]:
+                if not seen[u]:
+                    seen[u] = True
+                    members.append(u)
+        local = {v: i for i, v in enumerate(members)}
+        components.append((
+            [elements[v] for v in members],
+            [[(bond_type, local[u]) for bond_type, u in adjacency[v]] for v in members],
+        ))
+    return components
+
+
+def canonical_molecule_hash(atoms: Iterable[Tuple[str, str]], bonds: Iterable[Tuple[str, str, str]]) -> str:
+    """Hash a molecule graph by its canonical form.
+
+    ``atoms`` is a sequence of ``(atom_id, element)`` and ``bonds`` a sequence
+    of ``(from_id, to_id, bond_type)``. Atom IDs are only used to resolve the
+    bonds; they never contribute to the hash. Bonds that reference unknown atoms
+    are ignored.
+
+    Two molecules get the same hash exactly when their graphs are isomorphic
+    (elements and bond types included), so molecules that colour refinement
+    alone cannot tell apart, such as decalin and bicyclopentyl, hash
+    differently. Each connected component is canonicalised on its own.
+    Graphs over MAX_CANONICAL_ATOMS are keyed in input order: still exact, but
+    the same molecule drawn differently gets a different key.
+    """
+    index: Dict[str, int] = {}
+    elements: List[str] = []
+    for atom_id, element in atoms:
+        if atom_id in index:
+            elements[index[atom_id]] = normalize_element(element)
+            continue
+        index[atom_id] = len(elements)
+        elements.append(normalize_element(element))
+
+    adjacency: List[List[Tuple[str, int]]] = [[] for _ in elements]
+    for from_id, to_id, bond_type in bonds:
+        if from_id not in index or to_id not in index:
+            continue
+        bond_type = normalize_bond_type(bond_type)
+        a, b = index[from_id], index[to_id]
+        adjacency[a].append((bond_type, b))
+        if a != b:
+            adjacency[b].append((bond_type, a))
+
+    graph = (elements, adjacency)
+    if len(elements) > MAX_CANONICAL_ATOMS:
+        return _digest("graph-raw|" + repr(_certificate(graph, list(range(len(elements))))))
+    certificates = sorted(_canonical_certificate(component) for component in _components(graph))
+    return _digest("graph-v3|" + repr(certificates))
@@ -0,0 +1,328 @@
+"""
+Local molecule structure library for /generate-molecule
+Validated structures are kept in SQLite and indexed in memory by normalized
+name/alias and Hill formula, so common queries resolve without an LLM call.
+A formula shared by several stored isomers (C2H6O: ethanol, dimethyl ether)
+does not resolve; it is generated like any unknown query.
+
+Bundles can be imported at startup (MOLECULE_LIBRARY_BUNDLES) or from the
+command line:
+
+    python molecule_library.py import molecules.json
+    python molecule_library.py export molecules.json
+"""
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from result_cache import CACHE_DIR
+from structured_logging import get_logger
+
+log = get_logger("molecule_library")
+
+LIBRARY_DB_PATH = os.getenv("MOLECULE_LIBRARY_DB", os.path.join(CACHE_DIR, "molecules.sqlite3"))
+
+_FORMULA_RE = re.compile(r"^(?:[A-Z][a-z]?\d*|\(|\)\d*)+$")
+_FORMULA_TOKEN_RE = re.compile(r"([A-Z][a-z]?|\(|\))(\d*)")
+_FILLER_WORDS = {"a", "an", "the", "molecule", "structure", "of", "3d", "show", "me", "generate"}
+
+
+def normalize_name(query: str) -> str:
+    """'  Ethyl-Alcohol ' -> 'ethyl alcohol'; filler words like 'the molecule' are dropped"""
+    words = re.sub(r"[\s_\-]+", " ", query.strip().lower()).strip(" .?!").split()
+    kept = [w for w in words if w not in _FILLER_WORDS]
+    return " ".join(kept or words)
+
+
+def looks_like_formula(query: str) -> bool:
+    """'C2H6O' and 'NaCl' look like formulas; 'Caffeine' does not"""
+    query = query.strip()
+    if not _FORMULA_RE.match(query):
+        return False
+    return any(c.isdigit() for c in query) or sum(c.isupper() for c in query) > 1
+
+
+def _hill(counts: Counter) -> str:
+    """Hill order: C, H, then the rest alphabetically (alphabetical if no carbon)"""
+    def part(element):
+        n = counts[element]
+        return f"{element}{n if n > 1 else ''}"
+
+    elements = [e for e in counts if counts[e] > 0]
+    if "C" in elements:
+        ordered = ["C"] + (["H"] if "H" in elements else []) + sorted(e for e in elements if e not in ("C", "H"))
+    else:
+        ordered = sorted(elements)
+    return "".join(part(e) for e in ordered)
+
+
+def hill_formula(formula: str) -> Optional[str]:
+    """Parse a formula (parentheses allowed) into Hill notation, or None if unparseable"""
+    formula = re.sub(r"\s+", "", formula or "")
+    if not formula or not _FORMULA_RE.match(formula):
+        return None
+    stack = [Counter()]
+    for element, count in _FORMULA_TOKEN_RE.findall(formula):
+        n = int(count) if count else 1
+        if element == "(":
+            stack.append(Counter())
+        elif element == ")":
+            if len(stack) == 1:
+                return None
+            group = stack.pop()
+            for e, c in group.items():
+                stack[-1][e] += c * n
+        else:
+            stack[-1][element] += n
+    if len(stack) != 1:
+        return None
+    return _hill(stack[0])
+
+
+def formula_from_atoms(atoms: List[Dict[str, Any]]) -> str:
+    counts = Counter()
+    for atom in atoms:
+        element = str(atom.get("element", "")).strip()
+        counts[element[:1].upper() + element[1:].lower()] += 1
+    return _hill(counts)
+
+
+def validate_structure(data: Dict[str, Any]) -> Optional[str]:
+    """Return a reason the structure is unusable, or None if it can be stored"""
+    if not isinstance(data, dict) or not str(data.get("name", "")).strip():
+        return "missing name"
+    atoms = data.get("atoms")
+    bonds = data.get("bonds", [])
+    if not isinstance(atoms, list) or not atoms:
+        return "no atoms"
+    if not isinstance(bonds, list):
+        return "bonds is not a list"
+    atom_ids = set()
+    for atom in atoms:
+        if not isinstance(atom, dict) or not atom.get("id") or not atom.get("element"):
+            return "atom without id/element"
+        if not all(isinstance(atom.get(axis), (int, float)) for axis in ("x", "y", "z")):
+            return f"atom {atom.get('id')} has non-numeric coordinates"
+        if atom["id"] in atom_ids:
+            return f"duplicate atom id {atom['id']}"
+        atom_ids.add(atom["id"])
+    for bond in bonds:
+        if not isinstance(bond, dict) or bond.get("from") not in atom_ids or bond.get("to") not in atom_ids:
+            return "bond references an unknown atom"
+    declared = hill_formula(str(data.get("formula", "")))
+    if declared and declared != formula_from_atoms(atoms):
+        return f"formula {data.get('formula')} does not match atoms ({formula_from_atoms(atoms)})"
+    return None
+
+
+class MoleculeLibrary:
+    """In-memory index over a SQLite table of validated structures"""
+
+    def __init__(self, db_path: str = LIBRARY_DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._molecules: Dict[int, Dict[str, Any]] = {}
+        self._by_alias: Dict[str, int] = {}
+        # Hill formula -> every stored structure with it; only unambiguous ones resolve
+        self._by_formula: Dict[str, Set[int]] = {}
+        self.loaded = False
+        self.hits = 0
+        self.misses = 0
+        self.ambiguous = 0
+        self.writes = 0
+        self.rejected = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS molecules ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " name TEXT NOT NULL UNIQUE,"
+                " formula TEXT NOT NULL,"
+                " data TEXT NOT NULL,"
+                " source TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS aliases ("
+                " alias TEXT PRIMARY KEY,"
+                " molecule_id INTEGER NOT NULL REFERENCES molecules(id))"
+            )
+            self._conn = conn
+        return self._conn
+
+    # --- storage (runs in a worker thread from async code; never touches the in-memory index) ---
+
+    def _read_sync(self) -> Tuple[list, list]:
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute("SELECT id, name, formula, data FROM molecules ORDER BY id").fetchall()
+            aliases = conn.execute("SELECT alias, molecule_id FROM aliases").fetchall()
+        return [(molecule_id, name, formula, json.loads(data)) for molecule_id, name, formula, data in rows], aliases
+
+    def _write_sync(self, data: Dict[str, Any], aliases: List[str] = (),
+                    source: str = "generated") -> Optional[Tuple[int, Dict[str, Any], Set[str], str]]:
+        """Validate and store a structure; returns what to index, or None if rejected"""
+        reason = validate_structure(data)
+        if reason:
+            self.rejected += 1
+            log.info("library_rejected", molecule=data.get("name") if isinstance(data, dict) else None, reason=reason)
+            return None
+        name = str(data["name"]).strip()
+        formula = formula_from_atoms(data["atoms"])
+        # A formula names no particular isomer, so it is never kept as an alias (not even as the name)
+        all_aliases = {normalize_name(a) for a in [name, *aliases] if a and a.strip() and not looks_like_formula(a)}
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT id, formula FROM molecules WHERE name = ?", (name,)).fetchone()
+            if row:
+                # The first stored structure for a name is kept; index what is actually stored
+                molecule_id, formula = row
+            else:
+                cursor = conn.execute(
+                    "INSERT INTO molecules (name, formula, data, source, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (name, formula, json.dumps(data, ensure_ascii=False), source, time.time()),
+                )
+                molecule_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT OR REPLACE INTO aliases (alias, molecule_id) VALUES (?, ?)",
+                [(alias, molecule_id) for alias in all_aliases],
+            )
+            conn.commit()
+            stored = json.loads(conn.execute("SELECT data FROM molecules WHERE id = ?", (molecule_id,)).fetchone()[0])
+        return molecule_id, stored, all_aliases, formula
+
+    def _import_sync(self, path: str) -> list:
+        """Store a JSON bundle: a list of structures or {"molecules": [...]}; entries may carry "aliases" """
+        with open(path, encoding="utf-8") as f:
+            bundle = json.load(f)
+        entries = bundle.get("molecules", []) if isinstance(bundle, dict) else bundle
+        records = []
+        for entry in entries:
+            entry = dict(entry)
+            aliases = entry.pop("aliases", [])
+            record = self._write_sync(entry, aliases, source=f"bundle:{os.path.basename(path)}")
+            if record is not None:
+                records.append(record)
+        return records
+
+    def export_bundle_sync(self, path: str) -> int:
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute("SELECT id, data FROM molecules ORDER BY id").fetchall()
+            aliases = conn.execute("SELECT alias, molecule_id FROM aliases").fetchall()
+        alias_map: Dict[int, List[str]] = {}
+        for alias, molecule_id in aliases:
+            alias_map.setdefault(molecule_id, []).append(alias)
+        molecules = [dict(json.loads(data), aliases=sorted(alias_map.get(mid, []))) for mid, data in rows]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"molecules": molecules}, f, ensure_ascii=False, indent=2)
+        return len(molecules)
+
+    # --- in-memory index (updated on the event loop, where ``lookup`` reads it) ---
+
+    def _apply_loaded(self, rows: list, aliases: list) -> int:
+        for molecule_id, name, formula, data in rows:
+            self._molecules[molecule_id] = data
+            if not looks_like_formula(name):
+                self._by_alias.setdefault(normalize_name(name), molecule_id)
+            self._by_formula.setdefault(formula, set()).add(molecule_id)
+        for alias, molecule_id in aliases:
+            if molecule_id in self._molecules:
+                self._by_alias[alias] = molecule_id
+        self.loaded = True
+        return len(self._molecules)
+
+    def _index(self, molecule_id: int, stored: Dict[str, Any], aliases: Set[str], formula: str) -> int:
+        self._molecules[molecule_id] = stored
+        for alias in aliases:
+            self._by_alias[alias] = molecule_id
+        self._by_formula.setdefault(formula, set()).add(molecule_id)
+        self.writes += 1
+        return molecule_id
+
+    # --- synchronous API (command line, tests) ---
+
+    def load_sync(self) -> int:
+        return self._apply_loaded(*self._read_sync())
+
+    def add_sync(self, data: Dict[str, Any], aliases: List[str] = (), source: str = "generated") -> Optional[int]:
+        """Validate and store a structure; returns its id, or None if rejected"""
+        record = self._write_sync(data, aliases, source)
+        return self._index(*record) if record is not None else None
+
+    def import_bundle_sync(self, path: str) -> int:
+        records = self._import_sync(path)
+        for record in records:
+            self._index(*record)
+        return len(records)
+
+    # --- async API used by the request handlers ---
+
+    def lookup(self, query: str) -> Optional[Dict[str, Any]]:
+        """Resolve a query from memory by alias, then by unambiguous formula; never touches disk"""
+        molecule_id = self._by_alias.get(normalize_name(query))
+        if molecule_id is None and looks_like_formula(query):
+            formula = hill_formula(query)
+            candidates = self._by_formula.get(formula, ()) if formula else ()
+            if len(candidates) == 1:
+                molecule_id = next(iter(candidates))
+            elif candidates:
+                self.ambiguous += 1
+                log.info("library_formula_ambiguous", formula=formula, structures=len(candidates))
+        if molecule_id is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._molecules[molecule_id]
+
+    async def load(self) -> int:
+        return self._apply_loaded(*await asyncio.to_thread(self._read_sync))
+
+    async def add(self, data: Dict[str, Any], aliases: List[str] = (), source: str = "generated") -> Optional[int]:
+        record = await asyncio.to_thread(self._write_sync, data, list(aliases), source)
+        return self._index(*record) if record is not None else None
+
+    async def import_bundle(self, path: str) -> int:
+        records = await asyncio.to_thread(self._import_sync, path)
+        for record in records:
+            self._index(*record)
+        return len(records)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "molecules": len(self._molecules),
+            "aliases": len(self._by_alias),
+            "formulas": len(self._by_formula),
+            "hits": self.hits,
+            "misses": self.misses,
+            "ambiguous_formulas": self.ambiguous,
+            "writes": self.writes,
+            "rejected": self.rejected,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in ("import", "export"):
+        print("Usage: python molecule_library.py import|export <bundle.json>")
+        sys.exit(1)
+    library = MoleculeLibrary()
+    if sys.argv[1] == "import":
+        print(f"✓ Imported {library.import_bundle_sync(sys.argv[2])} molecule(s) into {library.db_path}")
+    else:
+        print(f"✓ Exported {library.export_bundle_sync(sys.argv[2])} molecule(s) to {sys.argv[2]}")
@@ -0,0 +1,185 @@
+"""
+Background pool of pre-generated quiz questions
+Keeps a small stock of validated questions for each (topic, difficulty,
+question type) cell so /quiz/generate can hand them out without waiting on
+the LLM. Cells are refilled in the background between low/high watermarks.
+"""
+import asyncio
+import random
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from structured_logging import get_logger
+
+log = get_logger("quiz.pool")
+
+Cell = Tuple[str, str, str]  # (topic, difficulty, question_type)
+
+
+class QuestionPool:
+    """Replenishing per-cell question stock.
+
+    Only cells that have been requested at least once are kept stocked, unless
+    ``prewarm`` is set, in which case the whole grid is filled on start.
+    ``generate(question_type, difficulty, topic)`` must raise instead of
+    returning a canned fallback, so only real questions enter the pool.
+    """
+
+    def __init__(
+        self,
+        generate: Callable[[str, str, str], Awaitable[Any]],
+        topics: Iterable[str],
+        difficulties: Iterable[str],
+        question_types: Iterable[str],
+        low_watermark: int = 2,
+        high_watermark: int = 5,
+        concurrency: int = 4,
+        refill_interval: float = 30.0,
+        prewarm: bool = False,
+        validate: Optional[Callable[[Any], bool]] = None,
+        is_duplicate: Optional[Callable[[str, List[str]], bool]] = None,
+    ):
+        self.generate = generate
+        self.topics = list(topics)
+        self.difficulties = list(difficulties)
+        self.question_types = list(question_types)
+        self.low_watermark = low_watermark
+        self.high_watermark = max(high_watermark, low_watermark)
+        self.concurrency = concurrency
+        self.refill_interval = refill_interval
+        self.prewarm = prewarm
+        self.validate = validate or (lambda question: True)
+        self.is_duplicate = is_duplicate or (lambda text, existing: False)
+
+        self._cells: Dict[Cell, Deque[Any]] = {}
+        self._active: Set[Cell] = set()
+        self._refilling: Set[Cell] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._worker: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.rejected = 0
+        self.failures = 0
+
+    def _in_grid(self, cell: Cell) -> bool:
+        topic, difficulty, question_type = cell
+        return topic in self.topics and difficulty in self.difficulties and question_type in self.question_types
+
+    def _request_refill(self, cell: Cell) -> None:
+        if not self._in_grid(cell):
+            return
+        self._active.add(cell)
+        if self._wakeup is not None and len(self._cells.get(cell, ())) < self.low_watermark:
+            self._wakeup.set()
+
+    def take(self, topic: str, difficulty: str, question_type: str,
+             reject: Optional[Callable[[Any], bool]] = None) -> Optional[Any]:
+        """Pop a ready question for the cell, or None if it is drained.
+
+        Questions matching ``reject`` (e.g. ones the user has already seen) are
+        skipped and left in the pool for other callers.
+        """
+        cell = (topic, difficulty, question_type)
+        stock = self._cells.get(cell)
+        question = None
+        for i, candidate in enumerate(stock or ()):
+            if reject is None or not reject(candidate):
+                question = candidate
+                del stock[i]
+                break
+        if question is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        self._request_refill(cell)
+        return question
+
+    def start(self) -> None:
+        if self._worker is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        if self.prewarm:
+            self._active.update(
+                (t, d, q) for t in self.topics for d in self.difficulties for q in self.question_types
+            )
+        self._worker = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    async def stop(self) -> None:
+        tasks = list(self._tasks) + ([self._worker] if self._worker else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.refill_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            needing = [
+                cell for cell in self._active
+                if cell not in self._refilling and len(self._cells.get(cell, ())) < self.low_watermark
+            ]
+            # Spread work across cells instead of always filling the same ones first
+            random.shuffle(needing)
+            for cell in needing:
+                self._refilling.add(cell)
+                task = asyncio.create_task(self._refill(cell))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _refill(self, cell: Cell) -> None:
+        topic, difficulty, question_type = cell
+        stock = self._cells.setdefault(cell, deque())
+        attempts = 0
+        try:
+            # Bound attempts so a model that keeps repeating itself cannot spin forever
+            while len(stock) < self.high_watermark and attempts < 2 * self.high_watermark:
+                attempts += 1
+                async with self._semaphore:
+                    try:
+                        question = await self.generate(question_type, difficulty, topic)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        # Give up on this cell until the next wakeup rather than hammering a failing upstream
+                        self.failures += 1
+                        log.warning("pool_refill_failed", cell=cell, error=str(e))
+                        return
+                if not self.validate(question) or self.is_duplicate(
+                    question.question_text, [q.question_text for q in stock]
+                ):
+                    self.rejected += 1
+                    continue
+                stock.append(question)
+                self.generated += 1
+        finally:
+            self._refilling.discard(cell)
+
+    def stats(self) -> Dict[str, Any]:
+        sizes = [len(stock) for stock in self._cells.values()]
+        lookups = self.hits + self.misses
+        return {
+            "running": self._worker is not None,
+            "grid_cells": len(self.topics) * len(self.difficulties) * len(self.question_types),
+            "active_cells": len(self._active),
+            "refilling_cells": len(self._refilling),
+            "pooled_questions": sum(sizes),
+            "empty_active_cells": sum(1 for cell in self._active if not self._cells.get(cell)),
+            "low_watermark": self.low_watermark,
+            "high_watermark": self.high_watermark,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "generated": self.generated,
+            "rejected": self.rejected,
+            "failures": self.failures,
+        }
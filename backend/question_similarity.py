@@ -0,0 +1,236 @@
+"""
+Near-duplicate detection for quiz question texts
+Character-shingle MinHash signatures bucketed with LSH, so a new question is
+compared only against the handful of earlier questions that share a band
+instead of every question seen so far. Formulas and numbers are compared on
+their own: two questions about different reactions share most of their
+shingles ("Complete the reaction: ..."), so they only match when the
+formulas they mention match too.
+"""
+import hashlib
+import re
+import zlib
+from collections import OrderedDict, defaultdict
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+# 31-bit Mersenne prime keeps the permutation arithmetic in small ints
+_MERSENNE_PRIME = (1 << 31) - 1
+
+NUM_PERMUTATIONS = 32
+NUM_BANDS = 16  # 16 bands x 2 rows: >99.9% recall at 0.6 Jaccard; candidates are verified exactly
+DEFAULT_THRESHOLD = 0.6
+# Texts up to this many normalized characters are checked for containment in every entry, not just LSH candidates
+CONTAINMENT_SCAN_CHARS = 120
+
+
+def _seeded_coefficients(count: int) -> List[Tuple[int, int]]:
+    # Deterministic across processes so signatures are comparable between workers
+    coefficients = []
+    for i in range(count):
+        digest = hashlib.blake2b(f"minhash-{i}".encode(), digest_size=16).digest()
+        a = int.from_bytes(digest[:8], "little") % _MERSENNE_PRIME or 1
+        b = int.from_bytes(digest[8:], "little") % _MERSENNE_PRIME
+        coefficients.append((a, b))
+    return coefficients
+
+
+_COEFFICIENTS = _seeded_coefficients(NUM_PERMUTATIONS)
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def shingles(text: str, size: int = 5) -> FrozenSet[str]:
+    """Character n-grams of the normalized text.
+
+    Character shingles tolerate spelling variants (hybridisation/hybridization)
+    and small rewordings far better than word shingles on one-line questions.
+    """
+    normalized = normalize_text(text)
+    if len(normalized) <= size:
+        return frozenset([normalized]) if normalized else frozenset()
+    return frozenset(normalized[i:i + size] for i in range(len(normalized) - size + 1))
+
+
+_TOKEN = re.compile(r"[A-Za-z0-9]+(?:\.\d+)?")
+_FORMULA = re.compile(r"\d*(?:[A-Z][a-z]?\d*)+")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def formula_terms(text: str) -> FrozenSet[str]:
+    """Chemical formulas (CH4, 2O2, NaCl) and numbers in the original, case-sensitive text"""
+    terms = set()
+    for token in _TOKEN.findall(text):
+        if _NUMBER.fullmatch(token):
+            terms.add(token)
+        elif _FORMULA.fullmatch(token) and (
+            any(c.isdigit() for c in token) or sum(c.isupper() for c in token) >= 2
+        ):
+            terms.add(token)
+    return frozenset(terms)
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def minhash(shingle_set: Iterable[str]) -> Tuple[int, ...]:
+    hashes = [zlib.crc32(s.encode()) for s in shingle_set]
+    if not hashes:
+        return tuple([_MERSENNE_PRIME] * NUM_PERMUTATIONS)
+    return tuple(min([(a * h + b) % _MERSENNE_PRIME for h in hashes]) for a, b in _COEFFICIENTS)
+
+
+class Fingerprint(NamedTuple):
+    normalized: str
+    shingles: FrozenSet[str]
+    terms: FrozenSet[str]
+    signature: Tuple[int, ...]
+
+
+def fingerprint(text: str) -> Fingerprint:
+    shingle_set = shingles(text)
+    return Fingerprint(normalize_text(text), shingle_set, formula_terms(text), minhash(shingle_set))
+
+
+def _contains(short: str, long: str) -> bool:
+    # Whole words only, so "co" is not found inside "co2"
+    return len(short) > 10 and f" {short} " in f" {long} "
+
+
+def is_match(a: Fingerprint, b: Fingerprint, threshold: float) -> bool:
+    """Whether ``a`` duplicates ``b``: equal, contained in it, or similar with the same formulas"""
+    if a.normalized == b.normalized:
+        return True
+    if _contains(a.normalized, b.normalized) and a.terms <= b.terms:
+        return True
+    return a.terms == b.terms and jaccard(a.shingles, b.shingles) >= threshold
+
+
+class SimilarityIndex:
+    """LSH index over question texts with optional LRU capacity.
+
+    ``find`` returns the key of an indexed text that equals the query after
+    normalization, or one that ``is_match`` accepts: an LSH candidate, or for
+    short queries any entry that contains the query.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, capacity: Optional[int] = None):
+        self.threshold = threshold
+        self.capacity = capacity
+        self._rows = NUM_PERMUTATIONS // NUM_BANDS
+        self._entries: "OrderedDict[str, Fingerprint]" = OrderedDict()
+        self._buckets: List[Dict[Tuple[int, ...], Set[str]]] = [defaultdict(set) for _ in range(NUM_BANDS)]
+        self._exact: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _bands(self, signature: Tuple[int, ...]):
+        for band in range(NUM_BANDS):
+            yield band, signature[band * self._rows:(band + 1) * self._rows]
+
+    def _insert(self, key: str, entry: Fingerprint) -> None:
+        if key in self._entries:
+            self.remove(key)
+        self._entries[key] = entry
+        self._exact[entry.normalized] = key
+        for band, value in self._bands(entry.signature):
+            self._buckets[band][value].add(key)
+        if self.capacity is not None:
+            while len(self._entries) > self.capacity:
+                self.remove(next(iter(self._entries)))
+
+    def add(self, key: str, text: str) -> None:
+        self._insert(key, fingerprint(text))
+
+    def remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        if self._exact.get(entry.normalized) == key:
+            del self._exact[entry.normalized]
+        for band, value in self._bands(entry.signature):
+            bucket = self._buckets[band].get(value)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band][value]
+
+    def _find(self, query: Fingerprint) -> Optional[str]:
+        if query.normalized in self._exact:
+            return self._exact[query.normalized]
+        candidates: Set[str] = set()
+        for band, value in self._bands(query.signature):
+            candidates.update(self._buckets[band].get(value, ()))
+        for key in candidates:
+            if is_match(query, self._entries[key], self.threshold):
+                return key
+        if len(query.normalized) <= CONTAINMENT_SCAN_CHARS:
+            # A short question inside a much longer one shares too few shingles to land in a common band
+            for key, entry in self._entries.items():
+                if key not in candidates and is_match(query, entry, self.threshold):
+                    return key
+        return None
+
+    def find(self, text: str) -> Optional[str]:
+        return self._find(fingerprint(text))
+
+    def add_if_unique(self, key: str, text: str) -> Optional[str]:
+        """Index ``text`` unless it duplicates an entry; returns the duplicate's key if so"""
+        query = fingerprint(text)
+        duplicate = self._find(query)
+        if duplicate is None:
+            self._insert(key, query)
+        return duplicate
+
+    def is_duplicate(self, text: str) -> bool:
+        return self.find(text) is not None
+
+
+def is_near_duplicate(text: str, existing_texts: Iterable[str], threshold: float = DEFAULT_THRESHOLD) -> bool:
+    """Pairwise check for small collections where building an index is not worth it"""
+    query = fingerprint(text)
+    return any(is_match(query, fingerprint(existing), threshold) for existing in existing_texts)
+
+
+class UserQuestionHistory:
+    """Per-user similarity indexes over recently served questions, LRU-bounded by user"""
+
+    def __init__(self, per_user: int = 200, max_users: int = 10000, threshold: float = DEFAULT_THRESHOLD):
+        self.per_user = per_user
+        self.max_users = max_users
+        self.threshold = threshold
+        self._users: "OrderedDict[str, SimilarityIndex]" = OrderedDict()
+        self._counter = 0
+
+    def get(self, user_id: Optional[str]) -> Optional[SimilarityIndex]:
+        if not user_id:
+            return None
+        index = self._users.get(user_id)
+        if index is not None:
+            self._users.move_to_end(user_id)
+        return index
+
+    def record(self, user_id: Optional[str], texts: Iterable[str]) -> None:
+        if not user_id:
+            return
+        index = self._users.get(user_id)
+        if index is None:
+            index = SimilarityIndex(self.threshold, capacity=self.per_user)
+            self._users[user_id] = index
+        self._users.move_to_end(user_id)
+        for text in texts:
+            self._counter += 1
+            index.add(str(self._counter), text)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "users": len(self._users),
+            "questions": sum(len(index) for index in self._users.values()),
+        }
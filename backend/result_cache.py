@@ -0,0 +1,205 @@
+"""
+Two-level result cache for LLM responses
+In-process LRU with TTL in front of a SQLite store that survives restarts.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from structured_logging import get_logger
+
+log = get_logger("cache")
+
+CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache"))
+CACHE_DB_PATH = os.getenv("RESULT_CACHE_DB", os.path.join(CACHE_DIR, "results.sqlite3"))
+
+
+def make_key(*parts: Any) -> str:
+    """Build a stable cache key from JSON-serialisable parts"""
+    payload = json.dumps(parts, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def prompt_version(template: str) -> str:
+    """Short hash of a prompt template, so edits to the prompt invalidate old entries"""
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()[:12]
+
+
+class _SQLiteStore:
+    """Shared on-disk store; one connection guarded by a lock, used from worker threads"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " namespace TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            self._conn = conn
+        return self._conn
+
+    def get(self, namespace: str, key: str) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, expires_at FROM results WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+            if row and row[1] < time.time():
+                conn.execute("DELETE FROM results WHERE namespace = ? AND key = ?", (namespace, key))
+                conn.commit()
+                return None
+            return row
+
+    def set(self, namespace: str, key: str, value: str, expires_at: float) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO results (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, value, expires_at),
+            )
+            conn.commit()
+
+    def count(self, namespace: str) -> int:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT COUNT(*) FROM results WHERE namespace = ?", (namespace,)
+            ).fetchone()
+            return row[0]
+
+    def prune(self) -> int:
+        with self._lock:
+            conn = self._connect()
+            cursor = conn.execute("DELETE FROM results WHERE expires_at < ?", (time.time(),))
+            conn.commit()
+            return cursor.rowcount
+
+
+_stores: Dict[str, _SQLiteStore] = {}
+
+
+def _get_store(path: str) -> _SQLiteStore:
+    store = _stores.get(path)
+    if store is None:
+        store = _SQLiteStore(path)
+        _stores[path] = store
+    return store
+
+
+class ResultCache:
+    """LRU + TTL cache of JSON results, backed by SQLite.
+
+    Memory hits are served synchronously without leaving the event loop; disk
+    lookups and writes run in a worker thread. Cached values are shared, so
+    callers must treat them as read-only.
+    """
+
+    def __init__(self, namespace: str, max_entries: int = 1000, ttl_seconds: float = 86400,
+                 db_path: Optional[str] = CACHE_DB_PATH):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._store = _get_store(db_path) if db_path else None
+        self._memory: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+
+    def get_memory(self, key: str) -> Optional[Any]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    def _put_memory(self, key: str, value: Any, expires_at: float) -> None:
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = self.get_memory(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+
+        if self._store is not None:
+            try:
+                row = await asyncio.to_thread(self._store.get, self.namespace, key)
+            except Exception as e:
+                self.errors += 1
+                log.warning("cache_read_failed", cache=self.namespace, error=str(e))
+                row = None
+            if row is not None:
+                value = json.loads(row[0])
+                self._put_memory(key, value, row[1])
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Any) -> None:
+        expires_at = time.time() + self.ttl_seconds
+        self._put_memory(key, value, expires_at)
+        self.writes += 1
+        if self._store is not None:
+            try:
+                payload = json.dumps(value, ensure_ascii=False)
+                await asyncio.to_thread(self._store.set, self.namespace, key, payload, expires_at)
+            except Exception as e:
+                self.errors += 1
+                log.warning("cache_write_failed", cache=self.namespace, error=str(e))
+
+    async def prune(self) -> int:
+        """Drop expired rows from disk"""
+        now = time.time()
+        for key in [k for k, (expires_at, _) in self._memory.items() if expires_at < now]:
+            del self._memory[key]
+        if self._store is None:
+            return 0
+        return await asyncio.to_thread(self._store.prune)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        hits = self.memory_hits + self.disk_hits
+        return {
+            "namespace": self.namespace,
+            "memory_entries": len(self._memory),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "errors": self.errors,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,235 @@
+"""
+Bounded in-memory store for quiz sessions
+Sessions are kept in a compact tuple-based form and evicted by idle TTL, LRU
+order, an entry cap and an approximate memory cap, so a long-running worker's
+memory stays flat under sustained traffic.
+"""
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+
+class CompactQuestion(NamedTuple):
+    id: int
+    question_text: str
+    question_type: str
+    options: Optional[Tuple[str, ...]]
+    correct_answer: str
+    explanation: str
+    topic: str
+    # MCQ only: learning suggestions aligned with ``options`` ("" for the correct one)
+    option_feedback: Optional[Tuple[str, ...]] = None
+
+    def feedback_for(self, answer: str) -> Optional[str]:
+        """Precomputed suggestions for a chosen option, or None if there are none"""
+        if not self.options or not self.option_feedback:
+            return None
+        chosen = answer.lower().strip()
+        for option, feedback in zip(self.options, self.option_feedback):
+            if option.lower().strip() == chosen:
+                return feedback or None
+        return None
+
+    def public_dict(self) -> Dict[str, Any]:
+        """Client-facing form; per-option feedback stays on the server"""
+        data = self._asdict()
+        del data["option_feedback"]
+        return data
+
+
+class CompactAnswer(NamedTuple):
+    user_answer: str
+    time_taken: int
+    suggestions: Optional[str]
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    # Question types and topics repeat across every session; share one copy
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def compact_question(question: Any) -> CompactQuestion:
+    """Pack a QuizQuestion (or anything with the same attributes) into a tuple"""
+    feedback = getattr(question, "option_feedback", None)
+    return CompactQuestion(
+        id=question.id,
+        question_text=question.question_text,
+        question_type=_intern(question.question_type),
+        options=tuple(question.options) if question.options else None,
+        correct_answer=question.correct_answer,
+        explanation=question.explanation,
+        topic=_intern(question.topic),
+        option_feedback=tuple(feedback.get(o, "") for o in question.options)
+        if feedback and question.options else None,
+    )
+
+
+def _approx_size(values: Iterable[Any]) -> int:
+    size = 0
+    for value in values:
+        if isinstance(value, tuple):
+            size += sys.getsizeof(value) + _approx_size(value)
+        elif isinstance(value, str):
+            size += sys.getsizeof(value)
+        elif value is not None:
+            size += 28
+    return size
+
+
+class CompactSession:
+    __slots__ = (
+        "session_id", "user_id", "questions", "answers", "current_question_index",
+        "completed", "created_at", "last_access", "size", "builder",
+    )
+
+    def __init__(self, session_id: str, questions: List[Optional[CompactQuestion]], user_id: Optional[str] = None):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.questions = questions
+        self.answers: Dict[int, CompactAnswer] = {}
+        self.current_question_index = 0
+        self.completed = False
+        self.created_at = time.time()
+        self.last_access = self.created_at
+        self.size = 0
+        # Set while questions are still being generated lazily (None slots in ``questions``);
+        # its cancel() is called when the session is dropped
+        self.builder: Optional[Any] = None
+
+    @property
+    def total_questions(self) -> int:
+        return len(self.questions)
+
+    def record_answer(self, question_id: int, user_answer: str, time_taken: int, suggestions: Optional[str]) -> None:
+        self.answers[question_id] = CompactAnswer(user_answer, time_taken, suggestions)
+
+    def approx_size(self) -> int:
+        size = 256 + sys.getsizeof(self.questions) + sys.getsizeof(self.answers)
+        size += _approx_size(self.questions) + _approx_size(self.answers.values())
+        return size
+
+
+class QuizSessionStore:
+    """LRU + idle-TTL session store with entry and memory caps"""
+
+    SWEEP_INTERVAL_SECONDS = 60
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 256 * 1024 * 1024,
+                 idle_ttl_seconds: float = 7200, completed_ttl_seconds: float = 600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.completed_ttl_seconds = completed_ttl_seconds
+        self._sessions: "OrderedDict[str, CompactSession]" = OrderedDict()
+        self._bytes = 0
+        self._last_sweep = time.time()
+        self.created = 0
+        self.evicted_ttl = 0
+        self.evicted_lru = 0
+        self.evicted_memory = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _ttl(self, session: CompactSession) -> float:
+        return self.completed_ttl_seconds if session.completed else self.idle_ttl_seconds
+
+    def _drop(self, session_id: str) -> None:
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._bytes -= session.size
+            if session.builder is not None:
+                # Nobody can fetch this session's questions any more
+                session.builder.cancel()
+                session.builder = None
+
+    def _expire(self, now: float) -> None:
+        # Entries are ordered by last access, so expired ones sit at the front.
+        # Completed sessions have a shorter TTL and may sit behind live ones;
+        # they are caught on access or by the periodic sweep.
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_access <= self._ttl(session):
+                break
+            self._drop(session_id)
+            self.evicted_ttl += 1
+
+    def _enforce_caps(self) -> None:
+        while len(self._sessions) > self.max_entries:
+            self._drop(next(iter(self._sessions)))
+            self.evicted_lru += 1
+        while self._bytes > self.max_bytes and len(self._sessions) > 1:
+            self._drop(next(iter(self._sessions)))
+            self.evicted_memory += 1
+
+    def get(self, session_id: str) -> Optional[CompactSession]:
+        now = time.time()
+        self._expire(now)
+        session = self._sessions.get(session_id)
+        if session is not None and now - session.last_access > self._ttl(session):
+            self._drop(session_id)
+            self.evicted_ttl += 1
+            session = None
+        if session is None:
+            self.misses += 1
+            return None
+        session.last_access = now
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def save(self, session: CompactSession) -> None:
+        """Insert or re-account a session after it changed"""
+        now = time.time()
+        if session.session_id not in self._sessions:
+            self.created += 1
+        else:
+            self._bytes -= self._sessions[session.session_id].size
+        session.size = session.approx_size()
+        session.last_access = now
+        self._sessions[session.session_id] = session
+        self._sessions.move_to_end(session.session_id)
+        self._bytes += session.size
+        self._expire(now)
+        if now - self._last_sweep > self.SWEEP_INTERVAL_SECONDS:
+            self.sweep(now)
+        self._enforce_caps()
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Full pass dropping every expired session (including completed ones behind live ones)"""
+        now = now or time.time()
+        self._last_sweep = now
+        expired = [sid for sid, s in self._sessions.items() if now - s.last_access > self._ttl(s)]
+        for session_id in expired:
+            self._drop(session_id)
+        self.evicted_ttl += len(expired)
+        return len(expired)
+
+    def update(self, session: CompactSession) -> None:
+        """Re-account a session that changed in the background, without reviving it if evicted"""
+        stored = self._sessions.get(session.session_id)
+        if stored is not session:
+            return
+        self._bytes -= session.size
+        session.size = session.approx_size()
+        self._bytes += session.size
+        self._enforce_caps()
+
+    def discard(self, session_id: str) -> None:
+        self._drop(session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "approx_bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "idle_ttl_seconds": self.idle_ttl_seconds,
+            "completed_ttl_seconds": self.completed_ttl_seconds,
+            "created": self.created,
+            "misses": self.misses,
+            "evicted_ttl": self.evicted_ttl,
+            "evicted_lru": self.evicted_lru,
+            "evicted_memory": self.evicted_memory,
+        }
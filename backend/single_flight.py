@@ -0,0 +1,96 @@
+"""
+Single-flight coalescing of identical in-flight requests
+When many callers ask for the same thing at once (a whole classroom mixing the
+same chemicals), only the first one runs the upstream call; the others await
+its result instead of each paying for their own.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+class SingleFlight:
+    """Share one running call per key among all concurrent callers.
+
+    The shared call runs as its own task, so a caller that disconnects does
+    not cancel the work for everyone else. Results and exceptions are handed
+    to every caller waiting on the key; nothing is kept once the call ends.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.peak_waiters = 0
+        self._waiters: Dict[str, int] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task, _ = self.start(key, fn)
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self.leave(key, task)
+
+    def start(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[asyncio.Task, bool]:
+        """``do`` without waiting: the shared task for ``key`` and whether this call started it.
+
+        The caller counts as a waiter until it calls ``leave``.
+        """
+        self.calls += 1
+        task = self._in_flight.get(key)
+        started = task is None
+        if started:
+            self.executions += 1
+            task = asyncio.create_task(fn())
+            self._in_flight[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.coalesced += 1
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        self.peak_waiters = max(self.peak_waiters, self._waiters[key])
+        return task, started
+
+    def leave(self, key: str, task: asyncio.Task) -> int:
+        """Stop waiting on ``task``; returns how many callers are still waiting on it"""
+        if self._in_flight.get(key) is not task:
+            # Already finished (or replaced by a newer call for the key)
+            return 0
+        self._waiters[key] -= 1
+        return self._waiters[key]
+
+    def abandon(self, key: str, task: asyncio.Task) -> None:
+        """``leave``, cancelling ``task`` if this was its last waiter.
+
+        The key is released at once, so a call arriving while the cancellation
+        unwinds starts fresh instead of joining a task that is being cancelled.
+        """
+        if self.leave(key, task) == 0 and not task.done():
+            if self._in_flight.get(key) is task:
+                del self._in_flight[key]
+                self._waiters.pop(key, None)
+            task.cancel()
+
+    def waiters(self, key: str) -> int:
+        """Callers currently waiting on the call in flight for ``key`` (0 if none)"""
+        return self._waiters.get(key, 0)
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+            self._waiters.pop(key, None)
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every caller went away
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "upstream_executions": self.executions,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+            "peak_waiters": self.peak_waiters,
+            # Share of calls that piggybacked on another caller's request
+            "coalescing_ratio": self.coalesced / self.calls if self.calls else 0.0,
+        }
@@ -0,0 +1,103 @@
+"""
+Adaptive coalescing of streamed LLM text
+Upstream chunks are often a few characters each; sending every one as its own
+frame costs a syscall and a client render per chunk. Chunks are merged until
+STREAM_FLUSH_BYTES have accumulated or STREAM_FLUSH_INTERVAL_MS has passed
+since the last flush. A stream that has been quiet for longer than the
+interval is flushed at once, so a slow model (and the first token) gets no
+added latency. The upstream is read by its own task, so a slow client never
+stalls the model: text piles up and goes out in larger frames, and past
+STREAM_MAX_BUFFER_BYTES the stream is shed.
+"""
+import asyncio
+import os
+from contextlib import aclosing
+from typing import AsyncIterator, List, Optional
+
+from metrics import registry
+
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL_MS", "30")) / 1000
+STREAM_FLUSH_BYTES = int(os.getenv("STREAM_FLUSH_BYTES", "256"))
+STREAM_MAX_BUFFER_BYTES = int(os.getenv("STREAM_MAX_BUFFER_BYTES", "262144"))
+
+STREAM_FLUSHES = registry.counter("stream_flushes_total", "Coalesced frames sent to clients", ("stream",))
+STREAM_CHUNKS = registry.counter("stream_upstream_chunks_total", "Upstream chunks merged into frames", ("stream",))
+STREAM_SHED = registry.counter(
+    "stream_shed_total", "Streams aborted because the client fell too far behind", ("stream",),
+)
+
+
+class SlowConsumerError(RuntimeError):
+    """The client stopped reading while the model kept writing"""
+
+
+async def coalesce(
+    chunks: AsyncIterator[str],
+    name: str = "chat",
+    flush_interval: float = STREAM_FLUSH_INTERVAL,
+    flush_bytes: int = STREAM_FLUSH_BYTES,
+    max_buffer_bytes: int = STREAM_MAX_BUFFER_BYTES,
+) -> AsyncIterator[str]:
+    """Yield ``chunks`` merged into fewer, larger pieces.
+
+    Upstream errors are raised after the text received before them has been
+    yielded. Closing this generator closes ``chunks``.
+    """
+    loop = asyncio.get_running_loop()
+    buffer: List[str] = []
+    buffered = 0
+    last_flush = 0.0  # the first chunk is always flushed immediately
+    done = False
+    error: Optional[BaseException] = None
+    wake = asyncio.Event()
+    timer: Optional[asyncio.TimerHandle] = None
+
+    async def pump() -> None:
+        nonlocal buffered, done, error, timer
+        try:
+            async with aclosing(chunks) as upstream:
+                async for chunk in upstream:
+                    if not chunk:
+                        continue
+                    buffer.append(chunk)
+                    buffered += len(chunk.encode("utf-8"))
+                    if buffered > max_buffer_bytes:
+                        STREAM_SHED.inc(name)
+                        raise SlowConsumerError(f"Client is more than {max_buffer_bytes} bytes behind")
+                    since_flush = loop.time() - last_flush
+                    if buffered >= flush_bytes or since_flush >= flush_interval:
+                        wake.set()
+                    elif timer is None:
+                        timer = loop.call_later(flush_interval - since_flush, wake.set)
+        except Exception as e:
+            error = e
+        finally:
+            done = True
+            wake.set()
+
+    reader = asyncio.create_task(pump())
+    try:
+        while True:
+            await wake.wait()
+            wake.clear()
+            if timer is not None:
+                timer.cancel()
+                timer = None
+            if buffer:
+                text = "".join(buffer)
+                STREAM_CHUNKS.inc(name, amount=len(buffer))
+                STREAM_FLUSHES.inc(name)
+                buffer.clear()
+                buffered = 0
+                last_flush = loop.time()
+                yield text
+            if done and not buffer:
+                if error is not None:
+                    raise error
+                return
+    finally:
+        if timer is not None:
+            timer.cancel()
+        if not reader.done():
+            reader.cancel()
+            await asyncio.wait([reader])
@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+import admission
+from admission import ConcurrencyGate, RateLimiter, RequestTooLarge, UpstreamBusy, client_key
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    """A small bucket (5 units, 60 per minute) and an idle gate for each test"""
+    rate_limiter = RateLimiter(per_minute=60, burst=5, max_clients=100)
+    monkeypatch.setattr(admission, "rate_limiter", rate_limiter)
+    monkeypatch.setattr(admission, "upstream_gate", ConcurrencyGate(limit=2, max_queued=1))
+    return rate_limiter
+
+
+def test_forwarded_for_from_an_untrusted_peer_is_ignored():
+    assert client_key("203.0.113.5", {"x-forwarded-for": "198.51.100.7"}) == "ip:203.0.113.5"
+
+
+def test_trusted_proxy_reports_the_nearest_untrusted_hop():
+    assert client_key("127.0.0.1", {"x-forwarded-for": "198.51.100.7"}) == "ip:198.51.100.7"
+    # Trusted hops between the client and us are skipped
+    assert client_key("127.0.0.1", {"x-forwarded-for": "198.51.100.7, 127.0.0.1"}) == "ip:198.51.100.7"
+
+
+def test_forged_entries_left_of_the_first_untrusted_hop_are_ignored():
+    headers = {"x-forwarded-for": "127.0.0.1, 10.9.9.9, 198.51.100.7"}
+    assert client_key("127.0.0.1", headers) == "ip:198.51.100.7"
+
+
+def test_missing_or_unparseable_peer():
+    assert client_key(None, {}) == "ip:unknown"
+    assert client_key("testclient", {"x-forwarded-for": "198.51.100.7"}) == "ip:testclient"
+
+
+def test_request_costing_more_than_the_burst_is_too_large(limiter):
+    with pytest.raises(RequestTooLarge):
+        admission.check("ip:a", "quiz-question", units=6)
+    # Nothing was charged
+    assert admission.check("ip:a", "quiz-question", units=5) is None
+
+
+def test_bucket_refuses_with_retry_after_once_spent(limiter):
+    assert admission.check("ip:a", "chat", units=5) is None
+    reason, retry_after = admission.check("ip:a", "chat")
+    assert "Rate limit" in reason
+    assert retry_after >= 1
+    # Other clients have their own bucket
+    assert admission.check("ip:b", "chat") is None
+
+
+def test_check_refuses_while_the_gate_is_saturated(limiter):
+    gate = admission.upstream_gate
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def hold():
+            async with gate:
+                await release.wait()
+
+        holders = [asyncio.create_task(hold()) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert gate.running == 2 and gate.waiting == 1
+        refused = admission.check("ip:a", "chat")
+        with pytest.raises(UpstreamBusy) as busy:
+            async with gate:
+                pass
+        release.set()
+        await asyncio.gather(*holders)
+        return refused, busy.value
+
+    refused, busy = asyncio.run(scenario())
+    assert refused is not None and refused[1] >= 1
+    assert busy.retry_after >= 1
+    assert gate.rejected == 1
+    assert admission.check("ip:a", "chat") is None
+
+
+def test_http_refusals_carry_retry_after(limiter):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    client = TestClient(main.app)
+    # Creating a conversation is admitted before any LLM work and costs one unit
+    for _ in range(5):
+        assert client.post("/chat/conversations", json={}).status_code == 200
+    response = client.post("/chat/conversations", json={})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+    busy = asyncio.run(main.upstream_busy_handler(None, UpstreamBusy(7)))
+    assert busy.status_code == 429
+    assert busy.headers["Retry-After"] == "7"
@@ -0,0 +1,71 @@
+import asyncio
+
+from history_compaction import HistoryCompactor
+
+
+def conversation(tag, turns=6):
+    opening = [{"role": "user", "content": "hi"}]
+    return opening + [
+        {"role": "assistant" if i % 2 else "user", "content": f"{tag} turn {i} " * 10} for i in range(turns)
+    ]
+
+
+def test_conversations_with_the_same_opening_get_their_own_summaries():
+    async def scenario():
+        summarized = []
+
+        async def summarize(previous, messages):
+            summarized.append(messages)
+            return f"summary of {len(messages)}"
+
+        compactor = HistoryCompactor(summarize, max_recent=2, min_recent=2)
+        compactor.compact(conversation("first"))
+        compactor.compact(conversation("second"))
+        await asyncio.sleep(0.01)
+        return summarized, compactor
+
+    summarized, compactor = asyncio.run(scenario())
+    assert len(summarized) == 2
+    assert compactor.stats()["cached_summaries"] == 2
+
+
+def test_uncovered_turns_stay_in_the_prompt_while_the_summary_is_pending():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def summarize(previous, messages):
+            await release.wait()
+            return "summary"
+
+        compactor = HistoryCompactor(summarize, max_recent=2, min_recent=2)
+        compacted = compactor.compact(conversation("first"))
+        release.set()
+        await asyncio.sleep(0.01)
+        return compacted
+
+    compacted = asyncio.run(scenario())
+    assert compacted.summary is None
+    assert len(compacted.messages) > 2
+    assert compacted.messages[-1][1].startswith("first turn 5")
+    assert compacted.tokens <= 1200
+
+
+def test_long_backlog_is_summarized_in_bounded_batches():
+    async def scenario():
+        batches = []
+
+        async def summarize(previous, messages):
+            batches.append(len(messages))
+            return f"summary of {sum(batches)}"
+
+        compactor = HistoryCompactor(summarize, max_recent=2, min_recent=2, max_summary_messages=10)
+        history = conversation("long", turns=34)
+        compacted = None
+        for _ in range(4):
+            compacted = compactor.compact(history)
+            await asyncio.sleep(0.01)
+        return batches, compacted
+
+    batches, compacted = asyncio.run(scenario())
+    assert batches == [10, 10, 10, 3]
+    assert compacted.summarized_messages == 30
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+from json_repair import (
+    LLMOutputError,
+    TruncatedOutputError,
+    parse_json,
+    parse_model,
+    repair_json,
+)
+from llm_schemas import ReactionAnalysis
+
+REACTION = {
+    "balancedEquation": "NaOH + HCl -> NaCl + H2O",
+    "reactionType": "Neutralization",
+    "visualObservation": "No visible change",
+    "safety": {"hazards": "Corrosive"},
+}
+
+
+def reaction_json(**extra):
+    return json.dumps(dict(REACTION, **extra))
+
+
+def test_clean_json_is_parsed_as_is():
+    assert parse_json('{"a": [1, 2]}') == {"a": [1, 2]}
+
+
+def test_code_fence_and_trailing_commentary_are_stripped():
+    text = 'Here you go:\n```json\n{"a": 1}\n```\nLet me know if you need more.'
+    assert parse_json(text) == {"a": 1}
+    assert parse_json('{"a": 1} I hope this helps!') == {"a": 1}
+
+
+def test_trailing_commas_are_dropped():
+    assert parse_json('{"a": [1, 2, ], "b": {"c": 3,},}') == {"a": [1, 2], "b": {"c": 3}}
+
+
+def test_raw_control_characters_inside_strings_are_escaped():
+    assert parse_json('{"a": "line one\nline two\tend"}') == {"a": "line one\nline two\tend"}
+
+
+def test_invalid_escapes_keep_their_backslash():
+    assert parse_json('{"a": "\\alpha"}') == {"a": "\\alpha"}
+
+
+def test_truncated_string_and_containers_are_closed():
+    assert parse_json('{"a": "cut off he') == {"a": "cut off he"}
+    assert parse_json('{"a": [1, 2') == {"a": [1, 2]}
+
+
+def test_dangling_key_and_partial_literal_are_dropped():
+    assert parse_json('{"a": 1, "b":') == {"a": 1}
+    assert parse_json('{"a": 1, "b"') == {"a": 1}
+    assert parse_json('{"a": 1, "b": tr') == {"a": 1}
+    assert parse_json('{"a": 1, "b": 12.') == {"a": 1}
+
+
+def test_partial_array_element_is_dropped_not_stubbed():
+    text = '{"items": [{"name": "NaCl", "state": "aq"}, {"name": "H2O", "sta'
+    assert json.loads(repair_json(text)) == {"items": [{"name": "NaCl", "state": "aq"}]}
+    assert json.loads(repair_json('{"items": [{"name": "NaCl"}, {"na')) == {"items": [{"name": "NaCl"}]}
+    assert json.loads(repair_json('[{"a": 1}, [2, ')) == [{"a": 1}]
+
+
+def test_truncated_reaction_with_partial_product_is_truncated_not_invalid():
+    complete = reaction_json(productsInfo=[{"name": "NaCl"}, {"name": "H2O", "state": "liquid"}])
+    text = complete[:complete.index('"state"') + 3]
+    with pytest.raises(TruncatedOutputError) as raised:
+        parse_model(text, ReactionAnalysis, "test", allow_truncated=False)
+    assert [p.name for p in raised.value.value.productsInfo] == ["NaCl"]
+    # Allowed, the same output is returned as a model
+    assert parse_model(text, ReactionAnalysis, "test").balancedEquation == REACTION["balancedEquation"]
+
+
+def test_schema_mismatch_and_garbage_raise_llm_output_error():
+    with pytest.raises(LLMOutputError):
+        parse_model('{"reactionType": "Neutralization"}', ReactionAnalysis, "test")
+    with pytest.raises(LLMOutputError):
+        parse_json("")
+    with pytest.raises(LLMOutputError):
+        parse_json("no json here")
+
+
+def test_complete_reaction_validates_cleanly():
+    model = parse_model(reaction_json(productsInfo=[{"name": "NaCl"}]), ReactionAnalysis, "test",
+                        allow_truncated=False)
+    assert model.productsInfo[0].name == "NaCl"
@@ -0,0 +1,111 @@
+import random
+import time
+
+from molecule_graph import MAX_CANONICAL_ATOMS, canonical_molecule_hash
+
+
+def molecule(elements, edges, bond_type="single"):
+    atoms = [(f"a{i}", element) for i, element in enumerate(elements)]
+    bonds = [(f"a{a}", f"a{b}", bond_type) for a, b in edges]
+    return atoms, bonds
+
+
+def shuffled(atoms, bonds, seed):
+    """The same graph with fresh atom IDs and atoms and bonds in a different order"""
+    rng = random.Random(seed)
+    ids = {atom_id: f"x{i}" for i, (atom_id, _) in enumerate(rng.sample(atoms, len(atoms)))}
+    new_atoms = [(ids[atom_id], element) for atom_id, element in rng.sample(atoms, len(atoms))]
+    new_bonds = [
+        (ids[b], ids[a], bond_type) if rng.random() < 0.5 else (ids[a], ids[b], bond_type)
+        for a, b, bond_type in rng.sample(bonds, len(bonds))
+    ]
+    return new_atoms, new_bonds
+
+
+# C-C-O plus hydrogens: ethanol (C0 H3, C1 H2, O H) and dimethyl ether (C-O-C, 6 H)
+ETHANOL = molecule("CCOHHHHHH", [(0, 1), (1, 2), (0, 3), (0, 4), (0, 5), (1, 6), (1, 7), (2, 8)])
+DIMETHYL_ETHER = molecule("COCHHHHHH", [(0, 1), (1, 2), (0, 3), (0, 4), (0, 5), (2, 6), (2, 7), (2, 8)])
+
+
+def ring(size):
+    return molecule("C" * size, [(i, (i + 1) % size) for i in range(size)])
+
+
+def grid(width, height):
+    edges = []
+    for y in range(height):
+        for x in range(width):
+            v = y * width + x
+            if x + 1 < width:
+                edges.append((v, v + 1))
+            if y + 1 < height:
+                edges.append((v, v + width))
+    return molecule("C" * (width * height), edges)
+
+
+def hypercube(dimension):
+    size = 1 << dimension
+    edges = [(v, v ^ (1 << bit)) for v in range(size) for bit in range(dimension) if v < v ^ (1 << bit)]
+    return molecule("C" * size, edges)
+
+
+def waters(count):
+    return ([(f"w{i}{a}", e) for i in range(count) for a, e in (("o", "O"), ("h1", "H"), ("h2", "H"))],
+            [(f"w{i}o", f"w{i}{h}", "single") for i in range(count) for h in ("h1", "h2")])
+
+
+def test_hash_ignores_atom_ids_and_order():
+    for graph in (ETHANOL, DIMETHYL_ETHER, ring(6), grid(4, 4)):
+        expected = canonical_molecule_hash(*graph)
+        for seed in range(5):
+            assert canonical_molecule_hash(*shuffled(*graph, seed)) == expected
+
+
+def test_hash_normalizes_element_case_and_bond_type():
+    atoms, bonds = ETHANOL
+    variant = ([(atom_id, element.lower()) for atom_id, element in atoms],
+               [(a, b, " SINGLE ") for a, b, _ in bonds])
+    assert canonical_molecule_hash(*variant) == canonical_molecule_hash(*ETHANOL)
+
+
+def test_isomers_hash_differently():
+    assert canonical_molecule_hash(*ETHANOL) != canonical_molecule_hash(*DIMETHYL_ETHER)
+
+
+def test_bond_types_are_part_of_the_hash():
+    ethene = molecule("CC", [(0, 1)], "double")
+    ethane_skeleton = molecule("CC", [(0, 1)], "single")
+    assert canonical_molecule_hash(*ethene) != canonical_molecule_hash(*ethane_skeleton)
+
+
+def test_refinement_equivalent_graphs_are_told_apart():
+    # Decalin (two fused hexagons) and bicyclopentyl (two linked pentagons): same atoms, same degrees
+    decalin = molecule("C" * 10, [(0, 1), (1, 2), (2, 3), (3, 4), (4, 5), (5, 0),
+                                  (4, 6), (6, 7), (7, 8), (8, 9), (9, 5)])
+    bicyclopentyl = molecule("C" * 10, [(0, 1), (1, 2), (2, 3), (3, 4), (4, 0),
+                                        (5, 6), (6, 7), (7, 8), (8, 9), (9, 5), (0, 5)])
+    assert canonical_molecule_hash(*decalin) != canonical_molecule_hash(*bicyclopentyl)
+
+
+def test_disjoint_fragments_hash_regardless_of_order():
+    water = molecule("OHH", [(0, 1), (0, 2)])
+    atoms, bonds = water
+    two = [(f"w{i}{a}", e) for i in range(2) for a, e in atoms], \
+          [(f"w{i}{a}", f"w{i}{b}", t) for i in range(2) for a, b, t in bonds]
+    assert canonical_molecule_hash(*two) == canonical_molecule_hash(*shuffled(*two, 1))
+    assert canonical_molecule_hash(*two) != canonical_molecule_hash(*water)
+
+
+def test_symmetric_graphs_stay_fast():
+    for graph in (ring(60), grid(10, 10), hypercube(6), waters(60)):
+        started = time.perf_counter()
+        first = canonical_molecule_hash(*graph)
+        assert canonical_molecule_hash(*shuffled(*graph, 3)) == first
+        assert time.perf_counter() - started < 2.0
+
+
+def test_graphs_over_the_atom_limit_are_still_told_apart():
+    big = waters(MAX_CANONICAL_ATOMS)
+    atoms, bonds = big
+    assert canonical_molecule_hash(*big) == canonical_molecule_hash(list(atoms), list(bonds))
+    assert canonical_molecule_hash(*big) != canonical_molecule_hash(atoms, bonds[:-1])
@@ -0,0 +1,45 @@
+from question_similarity import SimilarityIndex, formula_terms, is_near_duplicate
+
+
+def test_different_reactions_are_not_duplicates():
+    first = "Complete the reaction: CH4 + 2O2 ->"
+    second = "Complete the reaction: C2H6 + O2 ->"
+    assert not is_near_duplicate(second, [first])
+    index = SimilarityIndex()
+    assert index.add_if_unique("1", first) is None
+    assert index.add_if_unique("2", second) is None
+
+
+def test_different_equations_to_balance_are_not_duplicates():
+    index = SimilarityIndex()
+    assert index.add_if_unique("1", "Balance the equation: Fe + O2 -> Fe2O3") is None
+    assert index.add_if_unique("2", "Balance the equation: Al + O2 -> Al2O3") is None
+
+
+def test_rewording_of_the_same_reaction_is_a_duplicate():
+    index = SimilarityIndex()
+    index.add("1", "Complete the reaction: CH4 + 2O2 ->")
+    assert index.find("Complete this reaction: CH4 + 2O2 ->") == "1"
+
+
+def test_short_question_inside_a_long_one_is_found_without_an_lsh_hit():
+    long_text = (
+        "Explain why the boiling point of water is higher than expected for its molar mass, "
+        "referring to hydrogen bonding between molecules and comparing it with hydrogen sulfide."
+    )
+    index = SimilarityIndex()
+    index.add("1", long_text)
+    assert index.find("why the boiling point of water is higher") == "1"
+    assert is_near_duplicate("why the boiling point of water is higher", [long_text])
+
+
+def test_containment_needs_whole_words():
+    index = SimilarityIndex()
+    index.add("1", "What is the oxidation state of carbon in CO2 and in carbonate?")
+    assert index.find("oxidation state of carbon in CO") is None
+
+
+def test_formula_terms():
+    assert formula_terms("Complete the reaction: CH4 + 2O2 -> ?") == {"CH4", "2O2"}
+    assert formula_terms("How many moles of NaCl are in 58.5 g?") == {"NaCl", "58.5"}
+    assert formula_terms("Which gas is released when a metal reacts with acid?") == frozenset()
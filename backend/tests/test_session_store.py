@@ -0,0 +1,120 @@
+from types import SimpleNamespace
+
+import pytest
+
+import session_store
+from session_store import CompactSession, QuizSessionStore, compact_question
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(session_store.time, "time", clock)
+    return clock
+
+
+def question(index, **overrides):
+    fields = dict(
+        id=index, question_text=f"Question {index}?", question_type="mcq",
+        options=["A", "B", "C"], correct_answer="A", explanation="Because.", topic="Stoichiometry",
+        option_feedback={"B": "- review B", "C": "- review C"},
+    )
+    fields.update(overrides)
+    return SimpleNamespace(**fields)
+
+
+def session(session_id, questions=2):
+    return CompactSession(session_id, [compact_question(question(i + 1)) for i in range(questions)])
+
+
+def test_question_round_trips_through_the_compact_form():
+    compact = compact_question(question(1))
+    assert compact.options == ("A", "B", "C")
+    assert compact.feedback_for(" b ") == "- review B"
+    assert compact.feedback_for("A") is None
+    assert compact.public_dict() == {
+        "id": 1, "question_text": "Question 1?", "question_type": "mcq", "options": ("A", "B", "C"),
+        "correct_answer": "A", "explanation": "Because.", "topic": "Stoichiometry",
+    }
+    free_text = compact_question(question(2, question_type="explanation", options=None, option_feedback=None))
+    assert free_text.options is None and free_text.feedback_for("anything") is None
+
+
+def test_session_round_trips_through_the_store(clock):
+    store = QuizSessionStore()
+    saved = session("s1")
+    saved.record_answer(1, "B", 12, "- review B")
+    store.save(saved)
+    loaded = store.get("s1")
+    assert loaded is saved
+    assert loaded.total_questions == 2
+    assert loaded.answers[1] == ("B", 12, "- review B")
+    assert store.stats()["approx_bytes"] == saved.size > 0
+
+
+def test_least_recently_used_session_is_evicted_at_the_entry_cap(clock):
+    store = QuizSessionStore(max_entries=2)
+    store.save(session("a"))
+    store.save(session("b"))
+    assert store.get("a") is not None  # "b" is now least recently used
+    store.save(session("c"))
+    assert len(store) == 2
+    assert store.get("b") is None
+    assert store.get("a") is not None and store.get("c") is not None
+    assert store.stats()["evicted_lru"] == 1
+
+
+def test_oldest_sessions_are_evicted_over_the_memory_cap(clock):
+    one = session("probe")
+    one.size = one.approx_size()
+    store = QuizSessionStore(max_bytes=one.size * 2 + one.size // 2)
+    for session_id in ("a", "b", "c"):
+        store.save(session(session_id))
+    assert len(store) == 2
+    assert store.get("a") is None
+    assert store.stats()["evicted_memory"] == 1
+
+
+def test_idle_sessions_expire_after_the_ttl(clock):
+    store = QuizSessionStore(idle_ttl_seconds=100, completed_ttl_seconds=10)
+    store.save(session("idle"))
+    clock.now += 100
+    assert store.get("idle") is not None  # exactly at the TTL is still alive
+    clock.now += 101
+    assert store.get("idle") is None
+    assert store.stats()["evicted_ttl"] == 1
+
+
+def test_completed_sessions_use_the_shorter_ttl(clock):
+    store = QuizSessionStore(idle_ttl_seconds=100, completed_ttl_seconds=10)
+    done = session("done")
+    done.completed = True
+    store.save(done)
+    store.save(session("live"))
+    clock.now += 11
+    # The live session is newer, so only the sweep (or an access) finds the completed one
+    assert store.sweep() == 1
+    assert store.get("done") is None
+    assert store.get("live") is not None
+
+
+def test_dropping_a_session_cancels_its_builder_and_update_does_not_revive_it(clock):
+    store = QuizSessionStore(idle_ttl_seconds=100)
+    lazy = session("lazy")
+    builder = SimpleNamespace(cancelled=False)
+    builder.cancel = lambda: setattr(builder, "cancelled", True)
+    lazy.builder = builder
+    store.save(lazy)
+    clock.now += 101
+    assert store.get("lazy") is None
+    assert builder.cancelled and lazy.builder is None
+    store.update(lazy)
+    assert len(store) == 0 and store.stats()["approx_bytes"] == 0
@@ -0,0 +1,105 @@
+import asyncio
+
+from single_flight import SingleFlight
+
+
+def test_concurrent_callers_share_one_execution():
+    async def scenario():
+        flight = SingleFlight("test")
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "result"
+
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+        return flight, calls, results
+
+    flight, calls, results = asyncio.run(scenario())
+    assert calls == 1
+    assert results == ["result"] * 5
+    assert flight.stats()["coalesced"] == 4
+    assert flight.waiters("key") == 0
+
+
+def test_waiters_drop_when_callers_leave():
+    async def scenario():
+        flight = SingleFlight("test")
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return "result"
+
+        task, started = flight.start("key", work)
+        joined, joined_started = flight.start("key", work)
+        assert started and not joined_started and joined is task
+        assert flight.waiters("key") == 2
+
+        # The joiner disconnects, then the starter: nobody is left waiting
+        assert flight.leave("key", task) == 1
+        assert flight.leave("key", task) == 0
+        assert not task.done()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return flight
+
+    flight = asyncio.run(scenario())
+    assert flight.waiters("key") == 0
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_cancelled_do_caller_leaves_without_cancelling_the_call():
+    async def scenario():
+        flight = SingleFlight("test")
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return "result"
+
+        first = asyncio.create_task(flight.do("key", work))
+        second = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+        assert flight.waiters("key") == 2
+
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        assert flight.waiters("key") == 1
+
+        release.set()
+        return await second
+
+    assert asyncio.run(scenario()) == "result"
+
+
+def test_abandoned_call_releases_key_before_cancellation_unwinds():
+    async def scenario():
+        flight = SingleFlight("test")
+        runs = 0
+
+        async def work():
+            nonlocal runs
+            runs += 1
+            if runs == 1:
+                await asyncio.Event().wait()
+            return "fresh"
+
+        task, _ = flight.start("key", work)
+        await asyncio.sleep(0)
+        flight.abandon("key", task)
+        # The abandoned task has not finished unwinding, yet a new caller starts over
+        assert not task.done()
+        fresh, started = flight.start("key", work)
+        assert started and fresh is not task
+        result = await fresh
+        flight.leave("key", fresh)
+        await asyncio.gather(task, return_exceptions=True)
+        return flight, task, result
+
+    flight, task, result = asyncio.run(scenario())
+    assert task.cancelled()
+    assert result == "fresh"
+    assert flight.stats()["in_flight"] == 0
@@ -37,6 +37,23 @@ export function getBackendUrl(): string {
   return 'http://127.0.0.1:8000'
 }
 
+/**
+ * Headers identifying the end user to the backend, for server-side route handlers.
+ * The backend rate-limits per client IP; without this every student reaching it
+ * through these routes would share the Next.js server's address and one limit.
+ * The backend only believes X-Forwarded-For from TRUSTED_PROXIES (loopback by
+ * default), so set that on the backend when Next.js runs on another host.
+ */
+export function forwardedHeaders(request: Request & { ip?: string }): Record<string, string> {
+  const chain = request.headers.get('x-forwarded-for')
+  const clientIp = request.ip || request.headers.get('x-real-ip')
+  const hops = [chain, clientIp].filter((hop): hop is string => Boolean(hop))
+  if (chain && clientIp && chain.split(',').map(hop => hop.trim()).pop() === clientIp) {
+    hops.pop()
+  }
+  return hops.length ? { 'X-Forwarded-For': hops.join(', ') } : {}
+}
+
 /**
  * Get WebSocket URL (ws:// instead of http://)
  */